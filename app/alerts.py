@@ -0,0 +1,258 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+from app.models import HIGH_TEMPERATURE, AlertConfig, WeatherAlert, SessionLocal
+from app.query_cache import bump_data_version
+from app.email_notifier import notifier
+from app import metrics
+import config
+
+logger = logging.getLogger(__name__)
+
+RuleKey = Tuple[float, int]
+
+
+class AlertRule:
+    """
+    Fire when a city's temperature exceeds threshold for consecutive readings
+    """
+
+    __slots__ = ('threshold', 'consecutive', 'emails')
+
+    def __init__(self, threshold: float, consecutive: int, emails: Optional[Set[str]] = None):
+        self.threshold = threshold
+        self.consecutive = max(1, consecutive)
+        self.emails = emails or set()
+
+    @property
+    def key(self) -> RuleKey:
+        return (self.threshold, self.consecutive)
+
+
+def default_alert_rules() -> List[AlertRule]:
+    return [AlertRule(config.TEMP_THRESHOLD, 2)]
+
+
+def load_alert_rules(session_factory: Callable[[], Session] = SessionLocal) -> Optional[List[AlertRule]]:
+    """
+    Build the rule set from config.TEMP_THRESHOLD and every AlertConfig row
+
+    AlertConfig rows with the same threshold and streak share one rule.
+
+    Returns:
+        Optional[List[AlertRule]]: The rules, or None if AlertConfig could not be read
+    """
+    rules = {rule.key: rule for rule in default_alert_rules()}
+    session = session_factory()
+    try:
+        for alert_config in session.query(AlertConfig).all():
+            rule = AlertRule(alert_config.temp_threshold, alert_config.consecutive_readings or 2)
+            rules.setdefault(rule.key, rule).emails.add(alert_config.email)
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to load alert configs: {str(e)}")
+        return None
+    finally:
+        session.close()
+    return list(rules.values())
+
+
+class AlertEngine:
+    """
+    Evaluate alert rules against readings as they are ingested
+
+    Each city keeps a ring buffer of its latest temperatures, sized to the
+    longest streak any rule needs, and a streak counter per rule, so every
+    reading costs O(1) per rule and no database reads. A rule fires once when
+    its streak is reached and stays quiet until the temperature drops back
+    below the threshold. Fired alerts are queued until flush() persists them
+    and hands them to notify, which should return without waiting for delivery.
+
+    Rules are loaded from AlertConfig on first use and reloaded by
+    refresh_rules(), which the scheduler runs every ALERT_RULES_REFRESH seconds.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        rules: Optional[List[AlertRule]] = None,
+        notify: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    ):
+        self.session_factory = session_factory
+        self.notify = notify
+        self._rules: List[AlertRule] = []
+        self._rules_loaded_at: Optional[float] = None
+        self._history: Dict[str, Deque[float]] = {}
+        self._streaks: Dict[Tuple[str, RuleKey], int] = {}
+        self._firing: Set[Tuple[str, RuleKey]] = set()
+        self._pending: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        if rules is not None:
+            self.set_rules(rules)
+
+    @property
+    def rules(self) -> List[AlertRule]:
+        return list(self._rules)
+
+    def set_rules(self, rules: List[AlertRule]) -> None:
+        """
+        Replace the rule set, rebuilding streaks from the buffered history
+        """
+        with self._lock:
+            self._rules = list(rules)
+            self._rules_loaded_at = time.monotonic()
+            size = max([rule.consecutive for rule in self._rules], default=1)
+            self._history = {city: deque(temps, maxlen=size) for city, temps in self._history.items()}
+            keys = {rule.key for rule in self._rules}
+            self._firing = {firing for firing in self._firing if firing[1] in keys}
+            self._rebuild_streaks()
+
+    def _rebuild_streaks(self) -> None:
+        self._streaks = {}
+        for city, temps in self._history.items():
+            for rule in self._rules:
+                streak = 0
+                for temperature in reversed(temps):
+                    if temperature <= rule.threshold:
+                        break
+                    streak += 1
+                self._streaks[(city, rule.key)] = streak
+
+    def history_size(self) -> int:
+        """
+        Readings per city needed to rebuild every rule's streak, the longest streak of any rule
+        """
+        self._ensure_rules()
+        with self._lock:
+            return max([rule.consecutive for rule in self._rules], default=1)
+
+    def prime(self, readings: Iterable[Any]) -> None:
+        """
+        Seed the per-city history with readings stored before a restart
+
+        Streaks continue from the stored readings, and rules they already
+        satisfy are treated as having fired so they are not raised again.
+
+        Args:
+            readings (Iterable[Any]): Rows with city and temperature, oldest first
+        """
+        self._ensure_rules()
+        with self._lock:
+            size = max([rule.consecutive for rule in self._rules], default=1)
+            for reading in readings:
+                self._history.setdefault(reading.city, deque(maxlen=size)).append(reading.temperature)
+            self._rebuild_streaks()
+            for (city, key), streak in self._streaks.items():
+                if streak >= key[1]:
+                    self._firing.add((city, key))
+
+    def refresh_rules(self) -> bool:
+        """
+        Reload the rules from AlertConfig, keeping the current ones if the database cannot be read
+
+        Returns:
+            bool: True if the rules were reloaded
+        """
+        rules = load_alert_rules(self.session_factory)
+        if rules is None:
+            if self._rules_loaded_at is None:
+                logger.warning("Evaluating the default threshold only until alert configs can be loaded")
+                self.set_rules(default_alert_rules())
+            return False
+        self.set_rules(rules)
+        return True
+
+    def _ensure_rules(self) -> None:
+        if self._rules_loaded_at is None:
+            self.refresh_rules()
+
+    def observe(self, weather_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Feed one reading through every rule
+
+        Args:
+            weather_data (Dict[str, Any]): Reading as returned by get_weather_data
+
+        Returns:
+            List[Dict[str, Any]]: Alerts fired by this reading
+        """
+        self._ensure_rules()
+        city = weather_data['city']
+        temperature = weather_data['temperature']
+        fired = []
+        with metrics.stage('alert_eval', city), self._lock:
+            history = self._history.get(city)
+            if history is None:
+                size = max([rule.consecutive for rule in self._rules], default=1)
+                history = self._history[city] = deque(maxlen=size)
+            history.append(temperature)
+
+            for rule in self._rules:
+                key = (city, rule.key)
+                if temperature > rule.threshold:
+                    streak = self._streaks[key] = self._streaks.get(key, 0) + 1
+                else:
+                    self._streaks[key] = 0
+                    self._firing.discard(key)
+                    continue
+
+                if streak >= rule.consecutive and key not in self._firing:
+                    self._firing.add(key)
+                    alert = {
+                        'city': city,
+                        'alert_type': HIGH_TEMPERATURE,
+                        'message': (
+                            f"{city} temperature exceeded {rule.threshold:g}°C "
+                            f"for {rule.consecutive} consecutive updates"
+                        ),
+                        'temperature': temperature,
+                        'consecutive_count': streak,
+                        'timestamp': weather_data['timestamp'],
+                        'emails': sorted(rule.emails),
+                    }
+                    fired.append(alert)
+                    self._pending.append(alert)
+
+        for alert in fired:
+            metrics.ALERTS.inc(city=city)
+            logger.warning(f"ALERT: {alert['message']}")
+        return fired
+
+    def flush(self) -> int:
+        """
+        Persist queued alerts as WeatherAlert rows in one transaction, then pass them to notify
+
+        Returns:
+            int: Number of alerts written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+
+        session = self.session_factory()
+        try:
+            session.add_all([
+                WeatherAlert(**{name: value for name, value in alert.items() if name != 'emails'})
+                for alert in pending
+            ])
+            bump_data_version(session)
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.error(f"Database error while saving {len(pending)} weather alerts: {str(e)}")
+            with self._lock:
+                self._pending = pending + self._pending
+            raise
+        finally:
+            session.close()
+        if self.notify is not None:
+            for alert in pending:
+                self.notify(alert)
+        return len(pending)
+
+
+alert_engine = AlertEngine(notify=notifier.enqueue)
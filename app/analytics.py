@@ -0,0 +1,347 @@
+"""
+Vectorized statistics over batches of readings
+
+Every function takes a columnar batch covering any number of cities, usually
+a DataFrame shaped like queries.load_history() (timestamp, city and one
+column per measurement), and computes its per-city results with a handful of
+NumPy/pandas operations instead of a Python loop per reading. The rollup
+tiers, the dashboard's statistics table and alert rules share these.
+
+    python -m benchmarks.bench_analytics
+
+compares them with the per-reading loops they replace.
+"""
+from datetime import timedelta
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+MEASUREMENTS = ('temperature', 'feels_like', 'humidity', 'wind_speed')
+
+
+def group_index(*keys: Sequence) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Dense group number per row for each combination of keys
+
+    Returns:
+        Tuple[np.ndarray, List[np.ndarray]]: Group number of every row, and
+        each key's value per group, groups ordered by the sorted keys
+        (categorical keys sort in category order, as in pandas)
+    """
+    import pandas as pd
+
+    codes, uniques = [], []
+    for key in keys:
+        # Categorical keys are factorized from their codes, without hashing every value
+        key_codes, key_uniques = pd.factorize(key if isinstance(key, pd.Series) else np.asarray(key), sort=True)
+        codes.append(key_codes)
+        uniques.append(np.asarray(key_uniques))
+    shape = tuple(max(len(values), 1) for values in uniques)
+    combined = np.ravel_multi_index(codes, shape)
+    size = int(np.prod(shape))
+    if size <= 4 * len(combined) + 1024:
+        # Few enough key combinations to renumber the used ones with a bincount instead of a sort
+        used = np.bincount(combined, minlength=size) > 0
+        groups = np.flatnonzero(used)
+        inverse = (np.cumsum(used) - 1)[combined]
+    else:
+        groups, inverse = np.unique(combined, return_inverse=True)
+    positions = np.unravel_index(groups, shape)
+    return inverse.reshape(-1), [values[position] for values, position in zip(uniques, positions)]
+
+
+def reduce_groups(inverse: np.ndarray, values: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Count, sum, min and max of every column per group, skipping NaN
+
+    Args:
+        inverse (np.ndarray): Dense group number per row, as from group_index
+        values (np.ndarray): One row per reading, one column per measurement
+
+    Returns:
+        Dict[str, np.ndarray]: 'count', 'sum', 'min' and 'max', each groups x columns;
+        min and max are NaN where a group has no values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    groups = int(inverse.max()) + 1 if len(inverse) else 0
+    present = ~np.isnan(values)
+    count = np.zeros((groups, values.shape[1]))
+    total = np.zeros((groups, values.shape[1]))
+    for column in range(values.shape[1]):
+        count[:, column] = np.bincount(inverse, weights=present[:, column], minlength=groups)
+        total[:, column] = np.bincount(
+            inverse, weights=np.where(present[:, column], values[:, column], 0.0), minlength=groups
+        )
+    if not groups:
+        empty = np.zeros((0, values.shape[1]))
+        return {'count': count, 'sum': total, 'min': empty, 'max': empty}
+
+    order = np.argsort(inverse, kind='stable')
+    ordered = inverse[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    sorted_values = values[order]
+    with np.errstate(invalid='ignore'):
+        low = np.fmin.reduceat(sorted_values, starts, axis=0)
+        high = np.fmax.reduceat(sorted_values, starts, axis=0)
+    return {'count': count, 'sum': total, 'min': low, 'max': high}
+
+
+def _timestamps(df: 'pd.DataFrame') -> 'pd.Series':
+    import pandas as pd
+
+    timestamps = df['timestamp']
+    if pd.api.types.is_datetime64_dtype(timestamps):
+        return timestamps
+    return pd.to_datetime(timestamps)
+
+
+def _period_starts(df: 'pd.DataFrame', freq: str) -> 'pd.Series':
+    # Fixed-width periods (hours, days) are a cheap floor; calendar ones (months) go through Period
+    timestamps = _timestamps(df)
+    try:
+        return timestamps.dt.floor(freq)
+    except ValueError:
+        return timestamps.dt.to_period(freq).dt.start_time
+
+
+def bucket_statistics(df: 'pd.DataFrame', width: timedelta, fields: Sequence[str] = MEASUREMENTS) -> 'pd.DataFrame':
+    """
+    Per-city count, sum, min and max of fields in fixed-width time buckets
+
+    Buckets are aligned to midnight, as rollup_tiers.bucket_start.
+
+    Returns:
+        pd.DataFrame: city, bucket_start, reading_count and <field>_count/_sum/_min/_max columns
+    """
+    import pandas as pd
+
+    buckets = _timestamps(df).dt.floor(width)
+    inverse, (cities, starts) = group_index(df['city'], buckets)
+    stats = reduce_groups(inverse, df[list(fields)].to_numpy(dtype=np.float64, na_value=np.nan))
+    result = {
+        'city': cities,
+        'bucket_start': pd.to_datetime(starts),
+        'reading_count': np.bincount(inverse, minlength=len(cities)),
+    }
+    for index, field in enumerate(fields):
+        result[f'{field}_count'] = stats['count'][:, index].astype(np.int64)
+        for name in ('sum', 'min', 'max'):
+            result[f'{field}_{name}'] = stats[name][:, index]
+    return pd.DataFrame(result)
+
+
+def group_quantiles(inverse: np.ndarray, values: np.ndarray, quantile: float, groups: int) -> np.ndarray:
+    """
+    Linearly interpolated quantile of values per group, skipping NaN, as pandas computes it
+
+    Returns:
+        np.ndarray: One value per group, NaN where a group has no values
+    """
+    values = np.asarray(values, dtype=np.float64)
+    present = ~np.isnan(values)
+    inverse, values = inverse[present], values[present]
+    order = np.lexsort((values, inverse))
+    values = values[order]
+    counts = np.bincount(inverse, minlength=groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = np.full(groups, np.nan)
+    has_values = counts > 0
+    position = starts[has_values] + quantile * (counts[has_values] - 1)
+    below = np.floor(position).astype(np.int64)
+    above = np.ceil(position).astype(np.int64)
+    result[has_values] = values[below] + (values[above] - values[below]) * (position - below)
+    return result
+
+
+def period_statistics(
+    df: 'pd.DataFrame',
+    freq: str = 'D',
+    fields: Sequence[str] = ('temperature',),
+    percentiles: Sequence[float] = (0.1, 0.5, 0.9),
+) -> 'pd.DataFrame':
+    """
+    Per-city mean, min, max and percentiles of fields per calendar period
+
+    Args:
+        df (pd.DataFrame): Readings with timestamp, city and the fields
+        freq (str): pandas period alias, e.g. 'h' for hours or 'D' for days
+        percentiles (Sequence[float]): Reported as <field>_p<percent> columns
+
+    Returns:
+        pd.DataFrame: city, period (start time), reading_count and <field>_mean/_min/_max/_pNN columns,
+        ordered by city and period
+    """
+    import pandas as pd
+
+    inverse, (cities, starts) = group_index(df['city'], _period_starts(df, freq))
+    values = df[list(fields)].to_numpy(dtype=np.float64, na_value=np.nan)
+    stats = reduce_groups(inverse, values)
+    result = {
+        'city': cities,
+        'period': pd.to_datetime(starts),
+        'reading_count': np.bincount(inverse, minlength=len(cities)),
+    }
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = stats['sum'] / stats['count']
+    for index, field in enumerate(fields):
+        result[f'{field}_mean'] = means[:, index]
+        result[f'{field}_min'] = stats['min'][:, index]
+        result[f'{field}_max'] = stats['max'][:, index]
+        for percentile in percentiles:
+            result[f'{field}_p{round(percentile * 100):02d}'] = group_quantiles(
+                inverse, values[:, index], percentile, len(cities)
+            )
+    return pd.DataFrame(result)
+
+
+def rollup_period_statistics(
+    df: 'pd.DataFrame', freq: str = 'D', fields: Sequence[str] = ('temperature',)
+) -> 'pd.DataFrame':
+    """
+    Per-city mean, min and max of fields per calendar period from rollup tier buckets
+
+    Bucket means are weighted by their <field>_count, and the extremes come
+    from the buckets' <field>_min/<field>_max rather than from their means.
+
+    Args:
+        df (pd.DataFrame): Buckets as from queries.load_history with a rollup tier
+        freq (str): pandas period alias no finer than the tier's buckets
+
+    Returns:
+        pd.DataFrame: The columns of period_statistics without percentiles
+    """
+    import pandas as pd
+
+    inverse, (cities, starts) = group_index(df['city'], _period_starts(df, freq))
+    groups = len(cities)
+    result = {
+        'city': cities,
+        'period': pd.to_datetime(starts),
+        'reading_count': np.bincount(inverse, weights=df['reading_count'].to_numpy(dtype=np.float64),
+                                     minlength=groups).astype(np.int64),
+    }
+    extremes = {
+        name: reduce_groups(inverse, df[[f'{field}_{name}' for field in fields]].to_numpy(
+            dtype=np.float64, na_value=np.nan))[name]
+        for name in ('min', 'max')
+    }
+    for index, field in enumerate(fields):
+        means = df[field].to_numpy(dtype=np.float64, na_value=np.nan)
+        counts = df[f'{field}_count'].to_numpy(dtype=np.float64, na_value=0.0)
+        present = ~np.isnan(means) & (counts > 0)
+        total = np.bincount(inverse[present], weights=means[present] * counts[present], minlength=groups)
+        weight = np.bincount(inverse[present], weights=counts[present], minlength=groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result[f'{field}_mean'] = total / weight
+        result[f'{field}_min'] = extremes['min'][:, index]
+        result[f'{field}_max'] = extremes['max'][:, index]
+    return pd.DataFrame(result)
+
+
+def dominant_conditions(df: 'pd.DataFrame', freq: str = 'D') -> 'pd.DataFrame':
+    """
+    Most frequent weather_main per city and period, ties going to the first condition alphabetically
+
+    Conditions are counted as categorical codes with one bincount over all
+    cities and periods.
+
+    Returns:
+        pd.DataFrame: city, period, weather_main and readings (of the dominant condition)
+    """
+    import pandas as pd
+
+    inverse, (cities, starts) = group_index(df['city'], _period_starts(df, freq))
+    codes, conditions = pd.factorize(df['weather_main'], sort=True)
+    known = codes >= 0
+    counts = np.bincount(
+        inverse[known] * len(conditions) + codes[known], minlength=len(cities) * len(conditions)
+    ).reshape(len(cities), len(conditions))
+    dominant = counts.argmax(axis=1)
+    return pd.DataFrame({
+        'city': cities,
+        'period': pd.to_datetime(starts),
+        'weather_main': np.asarray(conditions)[dominant],
+        'readings': counts[np.arange(len(cities)), dominant],
+    })
+
+
+def heat_index(temperature, humidity) -> np.ndarray:
+    """
+    NOAA heat index in °C from temperature (°C) and relative humidity (%)
+
+    Uses the Rothfusz regression with its low- and high-humidity adjustments
+    where the simple formula gives 80°F or more, as the US National Weather
+    Service does. NaN where either input is missing.
+    """
+    t = np.asarray(temperature, dtype=np.float64) * 9 / 5 + 32
+    rh = np.asarray(humidity, dtype=np.float64)
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    regression = (
+        -42.379 + 2.04901523 * t + 10.14333127 * rh - 0.22475541 * t * rh
+        - 6.83783e-3 * t ** 2 - 5.481717e-2 * rh ** 2 + 1.22874e-3 * t ** 2 * rh
+        + 8.5282e-4 * t * rh ** 2 - 1.99e-6 * t ** 2 * rh ** 2
+    )
+    with np.errstate(invalid='ignore'):
+        dry = (rh < 13) & (t >= 80) & (t <= 112)
+        regression -= np.where(dry, (13 - rh) / 4 * np.sqrt(np.clip(17 - np.abs(t - 95), 0, None) / 17), 0)
+        humid = (rh > 85) & (t >= 80) & (t <= 87)
+        regression += np.where(humid, (rh - 85) / 10 * (87 - t) / 5, 0)
+        index = np.where((simple + t) / 2 >= 80, regression, simple)
+    return (index - 32) * 5 / 9
+
+
+def rolling_anomaly(
+    df: 'pd.DataFrame', field: str = 'temperature', window: str = '24h', min_periods: int = 3
+) -> 'pd.Series':
+    """
+    Z-score of each reading against its city's readings in the preceding window
+
+    Returns:
+        pd.Series: Aligned with df's index; NaN until a city has min_periods
+        earlier readings in the window or while they do not vary
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame({'city': df['city'].to_numpy(), 'timestamp': _timestamps(df).to_numpy(),
+                          'value': df[field].to_numpy(dtype=np.float64, na_value=np.nan)}, index=df.index)
+    frame = frame.sort_values(['city', 'timestamp'], kind='stable')
+    rolling = frame.groupby('city', sort=False).rolling(window, on='timestamp', closed='left', min_periods=min_periods)['value']
+    # The frame is sorted by city, so the per-city results come back in its row order
+    mean = rolling.mean().to_numpy()
+    std = rolling.std().to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        score = (frame['value'].to_numpy() - mean) / np.where(std > 0, std, np.nan)
+    return pd.Series(score, index=frame.index, name=f'{field}_anomaly').reindex(df.index)
+
+
+def trend_slopes(df: 'pd.DataFrame', field: str = 'temperature', per: timedelta = timedelta(days=1)) -> 'pd.Series':
+    """
+    Least-squares slope of field over time per city, in units per `per`
+
+    Computed from per-city sums in one pass, so any number of cities costs
+    the same handful of vectorized operations.
+
+    Returns:
+        pd.Series: Slope per city, NaN for cities with fewer than two distinct timestamps
+    """
+    import pandas as pd
+
+    timestamps = _timestamps(df)
+    x = ((timestamps - timestamps.min()) / per).to_numpy(dtype=np.float64)
+    y = df[field].to_numpy(dtype=np.float64, na_value=np.nan)
+    present = ~np.isnan(y)
+    inverse, (cities,) = group_index(df['city'][present])
+    x, y = x[present], y[present]
+    n = np.bincount(inverse, minlength=len(cities)).astype(np.float64)
+    mean_x = np.bincount(inverse, weights=x, minlength=len(cities)) / n
+    mean_y = np.bincount(inverse, weights=y, minlength=len(cities)) / n
+    dx, dy = x - mean_x[inverse], y - mean_y[inverse]
+    covariance = np.bincount(inverse, weights=dx * dy, minlength=len(cities))
+    variance = np.bincount(inverse, weights=dx * dx, minlength=len(cities))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slopes = np.where(variance > 0, covariance / variance, np.nan)
+    return pd.Series(slopes, index=pd.Index(cities, name='city'), name=f'{field}_slope')
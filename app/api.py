@@ -1,11 +1,21 @@
-import requests
 from datetime import datetime
+import json
 import logging
-from app.models import WeatherData, SessionLocal
+import os
+import time
+from app.models import get_engine
 import config
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from requests.exceptions import RequestException
-from sqlalchemy.exc import SQLAlchemyError
+from app.ingestion import SweepReport, rate_limiter_for, run_sweep
+from app.batch_writer import WEATHER_COLUMNS, WeatherBatchWriter
+from app.http_client import response_cache
+from app.alerts import alert_engine
+from app.latest_weather import get_latest_readings
+from app.recent_store import RecentStore
+from app.poller import AdaptivePoller
+from app.spool import Spool, SpoolDrainer
+from app import metrics, resilience
 
 # Set up logging
 logging.basicConfig(
@@ -14,34 +24,97 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def get_weather_data(city: str) -> Dict[str, Any]:
+BASE_URL = config.OPENWEATHER_BASE_URL
+
+# Recent readings of this process's cities, kept in memory for hot reads
+recent_store = RecentStore()
+
+# Learns each city's upstream update interval to decide which cities to poll
+poller = AdaptivePoller()
+
+# Shared across sweeps so readings can be batched up to the configured size/age
+batch_writer = WeatherBatchWriter(on_write=recent_store.add_many, on_drop=response_cache.forget_observations)
+
+# With SPOOL_DIR set, sweeps append readings to the spool and spool_drainer writes them; see start_spool()
+spool: Optional[Spool] = None
+spool_drainer: Optional[SpoolDrainer] = None
+
+metrics.registry.gauge('weather_write_buffer_readings', 'Readings waiting in the batch writer').set_function(
+    lambda: len(batch_writer)
+)
+metrics.registry.gauge('weather_spool_backlog_bytes', 'Spooled bytes not yet written to the database').set_function(
+    lambda: spool.backlog_bytes() if spool is not None else 0
+)
+metrics.registry.gauge('weather_recent_store_cities', 'Cities held in the recent store').set_function(
+    lambda: len(recent_store)
+)
+
+def parse_weather_data(city: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convert an OpenWeatherMap current weather payload into a reading
+    
+    Args:
+        city (str): Name of the city
+        data (Dict[str, Any]): Decoded API response for the city
+    
+    Returns:
+        Dict[str, Any]: Dictionary containing weather data
+    """
+    # Only return the fields that exist in your WeatherData model
+    return {
+        'city': city,
+        'temperature': data['main']['temp'],
+        'feels_like': data['main']['feels_like'],
+        'humidity': data['main']['humidity'],
+        'wind_speed': data['wind']['speed'],
+        'weather_main': data['weather'][0]['main'],
+        'timestamp': datetime.fromtimestamp(data['dt'])
+    }
+
+def get_weather_data(city: str, timeout: Optional[float] = None) -> Dict[str, Any]:
     """
     Fetch weather data for a specific city from OpenWeatherMap API
     
+    Responses are served from response_cache while fresh and revalidated with
+    conditional requests over the pooled HTTP session otherwise. Transient
+    failures are retried through app.resilience.
+    
     Args:
         city (str): Name of the city
+        timeout (Optional[float]): Seconds the fetch may take, retries included; unbounded if None
     
     Returns:
         Dict[str, Any]: Dictionary containing weather data
     """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    def request(headers: Dict[str, str]):
+        return resilience.get(
+            f"{BASE_URL}/data/2.5/weather",
+            params={'q': city, 'appid': config.OPENWEATHER_API_KEY, 'units': 'metric'},
+            headers=headers,
+            timeout=max(0.0, deadline - time.monotonic()) if deadline is not None else None,
+        )
+
     try:
-        url = f"http://api.openweathermap.org/data/2.5/weather?q={city}&appid={config.OPENWEATHER_API_KEY}&units=metric"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        logger.info(f"Successfully fetched weather data for {city}")
-        
-        # Only return the fields that exist in your WeatherData model
-        return {
-            'city': city,
-            'temperature': data['main']['temp'],
-            'feels_like': data['main']['feels_like'],
-            'humidity': data['main']['humidity'],
-            'wind_speed': data['wind']['speed'],
-            'weather_main': data['weather'][0]['main'],
-            'timestamp': datetime.fromtimestamp(data['dt'])
-        }
+        data = response_cache.get(city)
+        if data is None:
+            with metrics.stage('fetch', city):
+                response = request(response_cache.conditional_headers(city))
+                if response.status_code == 304:
+                    data = response_cache.revalidate(city)
+                    if data is None:
+                        # The payload the validators came from is gone; a 304 has no body to use
+                        response = request({})
+            if data is None:
+                response.raise_for_status()
+            logger.debug(f"Successfully fetched weather data for {city}")
+
+        with metrics.stage('parse', city):
+            if data is None:
+                data = response.json()
+                response_cache.store(city, data, response.headers)
+            return parse_weather_data(city, data)
     
     except RequestException as e:
         logger.error(f"Failed to fetch weather data for {city}: {str(e)}")
@@ -53,63 +126,303 @@ def get_weather_data(city: str) -> Dict[str, Any]:
         logger.error(f"Unexpected error while fetching weather data for {city}: {str(e)}")
         raise
 
-def save_weather_data(weather_data: Dict[str, Any]) -> None:
+def load_city_ids(path: str = None) -> Dict[str, int]:
     """
-    Save weather data to database
+    Load the on-disk cache of OpenWeatherMap city IDs
+    """
+    path = path or config.CITY_ID_CACHE
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return {city: int(city_id) for city, city_id in json.load(f).items()}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable city ID cache {path}: {str(e)}")
+        return {}
+
+def resolve_city_ids(cities: Iterable[str], path: str = None, timeout: Optional[float] = None) -> Dict[str, int]:
+    """
+    Resolve city names to OpenWeatherMap city IDs, caching them on disk
+    
+    Only cities missing from the cache cost an upstream call.
     
     Args:
-        weather_data (Dict[str, Any]): Dictionary containing weather data
+        cities (Iterable[str]): Names of the cities
+        path (str): Cache file, defaults to config.CITY_ID_CACHE
+        timeout (Optional[float]): Seconds all lookups together may take, retries
+            included; cities not reached in time stay unresolved until the next call
+    
+    Returns:
+        Dict[str, int]: City name to city ID for every city that resolved
+    """
+    path = path or config.CITY_ID_CACHE
+    city_ids = load_city_ids(path)
+    missing = [city for city in cities if city not in city_ids]
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    
+    for city in missing:
+        remaining = deadline - time.monotonic() if deadline is not None else None
+        if remaining is not None and remaining <= 0:
+            logger.warning(f"Out of time resolving city IDs, {city} and later cities left unresolved")
+            break
+        try:
+            response = resilience.get(
+                f"{BASE_URL}/data/2.5/weather",
+                params={'q': city, 'appid': config.OPENWEATHER_API_KEY, 'units': 'metric'},
+                timeout=remaining,
+            )
+            response.raise_for_status()
+            city_ids[city] = int(response.json()['id'])
+        except (RequestException, KeyError, ValueError) as e:
+            logger.error(f"Failed to resolve city ID for {city}: {str(e)}")
+    
+    if missing:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(city_ids, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    
+    return city_ids
+
+def get_weather_data_group(cities: Iterable[str], city_ids: Dict[str, int],
+                           timeout: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Fetch weather data for up to GROUP_CHUNK_SIZE cities in one call
+    
+    Args:
+        cities (Iterable[str]): Names of the cities, all present in city_ids
+        city_ids (Dict[str, int]): City name to city ID mapping
+        timeout (Optional[float]): Seconds the fetch may take, retries included
+    
+    Returns:
+        Dict[str, Dict[str, Any]]: City name to weather data, in the same shape
+        get_weather_data returns; cities missing from the response are left out
     """
-    session = SessionLocal()
+    names_by_id = {city_ids[city]: city for city in cities}
+    if len(names_by_id) > config.GROUP_CHUNK_SIZE:
+        raise ValueError(f"The group endpoint accepts at most {config.GROUP_CHUNK_SIZE} cities per call")
+    
     try:
-        weather_entry = WeatherData(
-            city=weather_data['city'],
-            temperature=weather_data['temperature'],
-            feels_like=weather_data['feels_like'],
-            humidity=weather_data['humidity'],
-            wind_speed=weather_data['wind_speed'],
-            weather_main=weather_data['weather_main'],
-            timestamp=weather_data['timestamp']
-        )
-        
-        session.add(weather_entry)
-        session.commit()
-        logger.info(f"Successfully saved weather data for {weather_data['city']}")
-    
-    except SQLAlchemyError as e:
-        session.rollback()
-        logger.error(f"Database error while saving weather data for {weather_data['city']}: {str(e)}")
-        raise
-    except Exception as e:
-        session.rollback()
-        logger.error(f"Unexpected error while saving weather data for {weather_data['city']}: {str(e)}")
+        with metrics.stage('fetch'):
+            response = resilience.get(
+                f"{BASE_URL}/data/2.5/group",
+                params={
+                    'id': ','.join(str(city_id) for city_id in names_by_id),
+                    'appid': config.OPENWEATHER_API_KEY,
+                    'units': 'metric',
+                },
+                timeout=timeout,
+            )
+            response.raise_for_status()
+        with metrics.stage('parse'):
+            payload = response.json()
+    except RequestException as e:
+        logger.error(f"Failed to fetch group weather data for {', '.join(names_by_id.values())}: {str(e)}")
         raise
-    finally:
-        session.close()
+    
+    results = {}
+    for data in payload.get('list', []):
+        city = names_by_id.get(data.get('id'))
+        if city is None:
+            continue
+        try:
+            with metrics.stage('parse', city):
+                results[city] = parse_weather_data(city, data)
+            response_cache.store(city, data)
+        except KeyError as e:
+            logger.error(f"Missing required data in API response for {city}: {str(e)}")
+    return results
+
+def chunk_cities(cities: List[str], size: int = None) -> List[Tuple[str, ...]]:
+    size = size or config.GROUP_CHUNK_SIZE
+    return [tuple(cities[i:i + size]) for i in range(0, len(cities), size)]
+
+def save_weather_data(weather_data: Dict[str, Any]) -> None:
+    """
+    Save one reading through batch_writer, or to the spool when one is started
+
+    The reading is written at once, in its own transaction, with the same
+    rollup, latest_weather and data version updates as a flush.
+
+    Args:
+        weather_data (Dict[str, Any]): Dictionary containing weather data
+
+    Raises:
+        SQLAlchemyError: If the database is unavailable
+    """
+    row = {name: weather_data.get(name) for name in WEATHER_COLUMNS}
+    if spool is not None:
+        spool.append([row])
+        spool.sync()
+        spool_drainer.notify()
+        return
+    batch_writer.write([row], raise_unavailable=True)
 
-def fetch_weather_data() -> None:
+def start_spool(directory: str) -> SpoolDrainer:
+    """
+    Route readings through a write-ahead spool in directory, drained by a background thread
+
+    Readings left in the spool by an earlier run are written first. Each
+    scheduler process needs a directory of its own.
+    """
+    global spool, spool_drainer
+    spool = Spool(directory)
+    spool_drainer = SpoolDrainer(spool, batch_writer.write)
+    spool_drainer.start()
+    logger.info(f"Spooling readings in {directory}")
+    return spool_drainer
+
+def stop_spool(timeout: Optional[float] = None) -> None:
+    """
+    Stop the drainer after writing what the database accepts; the rest is replayed on the next start
+    """
+    global spool, spool_drainer
+    if spool_drainer is not None:
+        spool_drainer.stop(timeout)
+    spool = spool_drainer = None
+
+def warm_start(cities: Optional[List[str]] = None) -> None:
+    """
+    Restore per-city ingestion state from latest_weather after a restart
+
+    The stored observation times keep the first sweep from writing the same
+    observations again. recent_store is loaded with the cities' recent
+    history, from which the poller learns when each city updates next and the
+    alert engine rebuilds its streaks over as many readings as its longest
+    rule needs.
+    """
+    engine = get_engine()
+    recent_store.load(engine, cities)
+    readings = get_latest_readings(engine, cities)
+    depth = alert_engine.history_size()
+    history = []
+    for reading in readings:
+        response_cache.is_new_observation(reading.city, reading.timestamp)
+        recent = recent_store.last(reading.city, max(depth, poller.history + 1))
+        poller.prime(reading.city, [row.timestamp for row in recent] or [reading.timestamp], reading.temperature)
+        # Readings older than the recent store's window count as a streak of one
+        history.extend(recent[-depth:] or [reading])
+    alert_engine.prime(history)
+    logger.info(f"Restored latest readings for {len(readings)} cities")
+
+def fetch_weather_data(cities: Optional[List[str]] = None) -> SweepReport:
     """
     Fetch and save weather data for all configured cities
+
+    Cities are fetched concurrently on a bounded thread pool, rate limited per
+    upstream host and cut off at the sweep deadline. With USE_GROUP_ENDPOINT
+    set, cities are fetched GROUP_CHUNK_SIZE at a time from the group endpoint.
+    Readings are buffered in batch_writer and bulk inserted once the batch size
+    or age limit is reached, or, after start_spool(), appended to the spool.
+
+    Args:
+        cities (Optional[List[str]]): Cities to fetch, defaults to config.CITIES
+
+    Returns:
+        SweepReport: Fetched, failed and skipped cities with per-city latency
     """
-    successful_cities = []
-    failed_cities = []
-    
-    for city in config.CITIES:
-        try:
-            logger.info(f"Starting weather data fetch for {city}")
-            weather_data = get_weather_data(city)
-            save_weather_data(weather_data)
-            successful_cities.append(city)
-            logger.info(f"Successfully processed weather data for {city}")
-        
-        except Exception as e:
-            logger.error(f"Failed to process weather data for {city}: {str(e)}")
-            failed_cities.append(city)
-    
+    cities = list(cities if cities is not None else config.CITIES)
+    rate_limiter = rate_limiter_for(BASE_URL, config.FETCH_RATE_LIMIT)
+
+    def handle_reading(weather_data: Dict[str, Any]) -> None:
+        city = weather_data['city']
+        poller.observe(city, weather_data['timestamp'], weather_data.get('temperature'))
+        if not response_cache.is_new_observation(city, weather_data['timestamp']):
+            logger.debug(f"Weather data for {city} unchanged since last sweep, skipping write")
+            metrics.READINGS.inc(outcome='unchanged')
+            return
+        if spool is not None:
+            try:
+                spool.append([{name: weather_data.get(name) for name in WEATHER_COLUMNS}])
+            except OSError:
+                response_cache.forget_observations([weather_data])
+                raise
+        else:
+            batch_writer.add(weather_data)
+        alert_engine.observe(weather_data)
+        logger.debug(f"Successfully processed weather data for {city}")
+
+    if config.USE_GROUP_ENDPOINT:
+        # Resolving new cities comes out of the sweep's budget
+        started = time.monotonic()
+        city_ids = resolve_city_ids(cities, timeout=config.SWEEP_DEADLINE)
+        missing = [city for city in cities if city not in city_ids]
+
+        def process_chunk(chunk: Tuple[str, ...], remaining: float) -> None:
+            readings = get_weather_data_group(chunk, city_ids, timeout=remaining)
+            for city in chunk:
+                if city in readings:
+                    handle_reading(readings[city])
+                else:
+                    missing.append(city)
+
+        report = run_sweep(
+            chunk_cities([city for city in cities if city in city_ids]),
+            process_chunk,
+            concurrency=config.FETCH_CONCURRENCY,
+            deadline=max(0.0, config.SWEEP_DEADLINE - (time.monotonic() - started)),
+            rate_limiter=rate_limiter,
+        ).flatten()
+        for city in missing:
+            if city in report.fetched:
+                report.fetched.remove(city)
+            report.failed.append(city)
+    else:
+        def process_city(city: str, remaining: float) -> None:
+            logger.debug(f"Starting weather data fetch for {city}")
+            handle_reading(get_weather_data(city, timeout=remaining))
+
+        report = run_sweep(
+            cities,
+            process_city,
+            concurrency=config.FETCH_CONCURRENCY,
+            deadline=config.SWEEP_DEADLINE,
+            rate_limiter=rate_limiter,
+        )
+
+    if spool is not None:
+        # One fsync per sweep, then the drainer writes the readings
+        spool.sync()
+        spool_drainer.notify()
+    elif batch_writer.due():
+        batch_writer.flush()
+
+    for city in report.failed:
+        poller.failure(city)
+    for outcome in ('fetched', 'failed', 'skipped'):
+        metrics.SWEEP_CITIES.set(len(getattr(report, outcome)), outcome=outcome)
+
     # Log summary
-    logger.info(f"Weather data fetch completed. Successful: {len(successful_cities)}, Failed: {len(failed_cities)}")
-    if failed_cities:
-        logger.warning(f"Failed cities: {', '.join(failed_cities)}")
+    logger.info(f"Weather data fetch completed. {report.summary()}")
+    logger.info(f"Response cache: {response_cache.stats()}, poller: {poller.stats()}")
+    logger.info(f"Upstream: {resilience.stats()}")
+    if report.failed:
+        logger.warning(f"Failed cities: {', '.join(report.failed)}")
+    if report.skipped:
+        logger.warning(f"Skipped cities (sweep deadline reached): {', '.join(report.skipped)}")
+    if report.latencies:
+        slowest = max(report.latencies, key=report.latencies.get)
+        logger.info(f"Slowest city: {slowest} ({report.latencies[slowest]:.2f}s)")
+    return report
+
+def fetch_due_weather_data(cities: Optional[List[str]] = None) -> SweepReport:
+    """
+    Fetch only the cities whose next upstream update is due, per the poller
+
+    Args:
+        cities (Optional[List[str]]): Cities to consider, defaults to config.CITIES
+
+    Returns:
+        SweepReport: Report of the sweep, empty if no city was due
+    """
+    due = poller.due(cities if cities is not None else config.CITIES)
+    if not due:
+        logger.debug("No city due for polling")
+        # Readings still buffered are written once old enough, even between sweeps
+        if batch_writer.due():
+            batch_writer.flush()
+        return SweepReport()
+    return fetch_weather_data(due)
 
 if __name__ == "__main__":
     fetch_weather_data()
\ No newline at end of file
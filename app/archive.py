@@ -0,0 +1,241 @@
+"""
+Parquet cold archive for expired history
+
+With ARCHIVE_DIR set, cleanup_old_data first moves weather_data and
+daily_summary rows older than the retention window into Hive-partitioned
+Parquet datasets:
+
+    ARCHIVE_DIR/weather_data/city=Delhi/month=2024-10/part-<first id>-0.parquet
+    ARCHIVE_DIR/daily_summary/city=Delhi/month=2024-10/part-<first id>-0.parquet
+
+Rows are exported and deleted ARCHIVE_CHUNK_SIZE at a time, file names are
+derived from the chunk's first id, so an export interrupted between writing
+a chunk and deleting it rewrites the same files when it is rerun.
+
+Reads go through pyarrow datasets over memory-mapped files: the city and
+month filters prune whole directories, timestamp filters are pushed down to
+Parquet row-group statistics, and aggregate_archive() folds record batches
+one at a time, so multi-year trends never load the whole archive.
+
+pyarrow is an optional dependency, imported only when the archive is used.
+"""
+import logging
+import os
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+import pandas as pd
+from sqlalchemy import Table, delete, select
+from sqlalchemy.orm import Session
+from app.models import DailySummary, WeatherData, SessionLocal
+from app.partitioning import deletable_tables
+import config
+
+logger = logging.getLogger(__name__)
+
+WEATHER_DATA = 'weather_data'
+DAILY_SUMMARY = 'daily_summary'
+
+# Time column of each archived table
+TIME_COLUMNS = {WEATHER_DATA: 'timestamp', DAILY_SUMMARY: 'date'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.fs
+    except ImportError as e:
+        raise ImportError("The Parquet archive needs pyarrow: pip install pyarrow") from e
+    return pyarrow
+
+
+def _partitioning():
+    pa = _pyarrow()
+    return pa.dataset.partitioning(pa.schema([('city', pa.string()), ('month', pa.string())]), flavor='hive')
+
+
+def _month(timestamp: datetime) -> str:
+    return f"{timestamp:%Y-%m}"
+
+
+def _export_chunk(rows: List[Dict[str, Any]], name: str, archive_dir: str) -> None:
+    pa = _pyarrow()
+    frame = pd.DataFrame(rows)
+    frame['month'] = pd.to_datetime(frame[TIME_COLUMNS[name]]).dt.strftime('%Y-%m')
+    pa.dataset.write_dataset(
+        pa.Table.from_pandas(frame, preserve_index=False),
+        os.path.join(archive_dir, name),
+        format='parquet',
+        partitioning=_partitioning(),
+        basename_template=f"part-{rows[0]['id']}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+
+def _archive_table(
+    session: Session, table: Table, name: str, cutoff: datetime, archive_dir: str, chunk_size: int
+) -> int:
+    time_column = table.c[TIME_COLUMNS[name]]
+    archived = 0
+    while True:
+        rows = session.execute(
+            select(table).where(time_column < cutoff).order_by(table.c.id).limit(chunk_size)
+        ).mappings().all()
+        if not rows:
+            return archived
+        rows = [dict(row) for row in rows]
+        _export_chunk(rows, name, archive_dir)
+        session.execute(delete(table).where(table.c.id.in_([row['id'] for row in rows])))
+        session.commit()
+        archived += len(rows)
+        if len(rows) < chunk_size:
+            return archived
+
+
+def archive_expired(
+    cutoff: datetime,
+    session_factory: Callable[[], Session] = SessionLocal,
+    archive_dir: str = config.ARCHIVE_DIR,
+    chunk_size: int = config.ARCHIVE_CHUNK_SIZE,
+) -> Dict[str, int]:
+    """
+    Move weather_data and daily_summary rows older than cutoff into the Parquet archive
+
+    Args:
+        cutoff (datetime): Rows before this are archived and deleted
+        session_factory (Callable[[], Session]): Sessions on the database to archive from
+        archive_dir (str): Root directory of the archive
+        chunk_size (int): Rows exported and deleted per transaction
+
+    Returns:
+        Dict[str, int]: Rows archived per table
+    """
+    _pyarrow()
+    archived = {WEATHER_DATA: 0, DAILY_SUMMARY: 0}
+    session = session_factory()
+    try:
+        engine = session.get_bind()
+        for table in deletable_tables(engine, WeatherData.__table__, cutoff):
+            archived[WEATHER_DATA] += _archive_table(session, table, WEATHER_DATA, cutoff, archive_dir, chunk_size)
+        archived[DAILY_SUMMARY] += _archive_table(
+            session, DailySummary.__table__, DAILY_SUMMARY, cutoff, archive_dir, chunk_size
+        )
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    logger.info(
+        f"Archived {archived[WEATHER_DATA]} readings and {archived[DAILY_SUMMARY]} daily summaries "
+        f"older than {cutoff:%Y-%m-%d} to {archive_dir}"
+    )
+    return archived
+
+
+def open_archive(name: str = WEATHER_DATA, archive_dir: str = config.ARCHIVE_DIR):
+    """
+    pyarrow dataset over an archived table, read through memory-mapped files
+
+    Returns:
+        pyarrow.dataset.Dataset: Dataset with city and month partition columns, or None if nothing is archived
+    """
+    pa = _pyarrow()
+    path = os.path.join(archive_dir, name)
+    if not os.path.isdir(path):
+        return None
+    return pa.dataset.dataset(
+        path, format='parquet', partitioning=_partitioning(), filesystem=pa.fs.LocalFileSystem(use_mmap=True)
+    )
+
+
+def archive_filter(
+    name: str, start: Optional[datetime] = None, end: Optional[datetime] = None, cities: Optional[Sequence[str]] = None
+):
+    """
+    Dataset filter for start <= time < end and cities
+
+    The month bounds prune partitions; the time bounds are checked against
+    row-group statistics.
+    """
+    pc = _pyarrow().compute
+    field = pc.field(TIME_COLUMNS[name])
+    conditions = []
+    if cities is not None:
+        conditions.append(pc.field('city').isin(list(cities)))
+    if start is not None:
+        conditions += [pc.field('month') >= _month(start), field >= pc.scalar(start)]
+    if end is not None:
+        conditions += [pc.field('month') <= _month(end), field < pc.scalar(end)]
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def read_archive(
+    name: str = WEATHER_DATA,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cities: Optional[Sequence[str]] = None,
+    columns: Optional[Sequence[str]] = None,
+    archive_dir: str = config.ARCHIVE_DIR,
+) -> pd.DataFrame:
+    """
+    Load the archived rows matching the filters as a DataFrame, ordered by time
+    """
+    dataset = open_archive(name, archive_dir)
+    if dataset is None:
+        return pd.DataFrame(columns=list(columns) if columns else None)
+    table = dataset.to_table(
+        columns=list(columns) if columns else None, filter=archive_filter(name, start, end, cities)
+    )
+    df = table.to_pandas()
+    time_column = TIME_COLUMNS[name]
+    if time_column in df:
+        df = df.sort_values(time_column, kind='stable', ignore_index=True)
+    return df
+
+
+def aggregate_archive(
+    freq: str = 'M',
+    field: str = 'temperature',
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    cities: Optional[Sequence[str]] = None,
+    archive_dir: str = config.ARCHIVE_DIR,
+) -> pd.DataFrame:
+    """
+    Per-city mean, min, max and count of an archived weather_data field per period
+
+    Record batches are aggregated one at a time and the partial results
+    merged, so memory stays bounded by the batch size and the number of
+    (city, period) groups.
+
+    Args:
+        freq (str): pandas period alias, e.g. 'M' for months or 'Y' for years
+
+    Returns:
+        pd.DataFrame: city, period, mean, min, max and count columns
+    """
+    dataset = open_archive(WEATHER_DATA, archive_dir)
+    columns = ['city', 'period', 'mean', 'min', 'max', 'count']
+    if dataset is None:
+        return pd.DataFrame(columns=columns)
+
+    partials = []
+    scanner = dataset.scanner(columns=['city', 'timestamp', field], filter=archive_filter(WEATHER_DATA, start, end, cities))
+    for batch in scanner.to_batches():
+        if not batch.num_rows:
+            continue
+        frame = batch.to_pandas()
+        frame['period'] = frame['timestamp'].dt.to_period(freq).dt.start_time
+        partials.append(frame.groupby(['city', 'period'], observed=True)[field].agg(['sum', 'min', 'max', 'count']))
+    if not partials:
+        return pd.DataFrame(columns=columns)
+
+    merged = pd.concat(partials).groupby(level=['city', 'period']).agg(
+        {'sum': 'sum', 'min': 'min', 'max': 'max', 'count': 'sum'}
+    )
+    merged['mean'] = merged['sum'] / merged['count']
+    return merged.reset_index()[columns]
@@ -0,0 +1,273 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError, SQLAlchemyError
+from sqlalchemy.orm import Session
+from app.models import WeatherData, SessionLocal
+from app.db_utils import UPSERT_CHUNK_SIZE, dialect_insert, supports_on_conflict
+from app.partitioning import route_rows
+from app.rollup_tiers import update_rollup_tiers
+from app.query_cache import bump_data_version
+from app.latest_weather import update_latest_weather
+from app import metrics
+import config
+
+logger = logging.getLogger(__name__)
+
+WEATHER_COLUMNS = tuple(column.name for column in WeatherData.__table__.columns if column.name != 'id')
+
+# Errors meaning the database could not be reached, rather than a bad row
+UNAVAILABLE_ERRORS = (OperationalError, InterfaceError)
+
+
+def is_unavailable(error: SQLAlchemyError) -> bool:
+    """
+    Whether error means the database could not be reached, rather than a bad row
+    """
+    return isinstance(error, UNAVAILABLE_ERRORS) or (
+        isinstance(error, DBAPIError) and error.connection_invalidated
+    )
+
+
+def insert_readings(session: Session, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insert weather_data rows in bulk, routing them to partitions when enabled
+
+    The insert is idempotent: a row whose (city, timestamp) is already stored,
+    or repeated earlier in rows, is skipped by ON CONFLICT DO NOTHING, or on
+    dialects without it by a lookup of the stored keys before an executemany.
+
+    Args:
+        session (Session): Session to execute in; the caller commits
+        rows (List[Dict[str, Any]]): Rows keyed by WEATHER_COLUMNS
+
+    Returns:
+        List[Dict[str, Any]]: The rows actually inserted, in their original order
+    """
+    if not supports_on_conflict(session):
+        return _insert_new_readings(session, rows)
+    postgresql = session.get_bind().dialect.name == 'postgresql'
+    inserted = set()
+    for table, table_rows in route_rows(session, WeatherData.__table__, rows):
+        # No conflict target, so tables still waiting for the unique index keep accepting writes
+        statement = dialect_insert(session, table).on_conflict_do_nothing()
+        if postgresql:
+            # Multi-row VALUES statements avoid one round trip per row
+            for start in range(0, len(table_rows), UPSERT_CHUNK_SIZE):
+                chunk = table_rows[start:start + UPSERT_CHUNK_SIZE]
+                result = session.execute(statement.values(chunk).returning(table.c.city, table.c.timestamp))
+                inserted.update(tuple(key) for key in result)
+        else:
+            result = session.execute(statement.returning(table.c.city, table.c.timestamp), table_rows)
+            inserted.update(tuple(key) for key in result)
+
+    written = []
+    for row in rows:
+        key = (row.get('city'), row.get('timestamp'))
+        if key in inserted:
+            inserted.discard(key)
+            written.append(row)
+    return written
+
+
+def _insert_new_readings(session: Session, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Without ON CONFLICT, keys already stored are looked up and the rest inserted with executemany
+    table = WeatherData.__table__
+    keys = {(row.get('city'), row.get('timestamp')) for row in rows}
+    stored = set()
+    for city in {city for city, _ in keys}:
+        stamps = [timestamp for key_city, timestamp in keys if key_city == city]
+        for start in range(0, len(stamps), UPSERT_CHUNK_SIZE):
+            stored.update(tuple(key) for key in session.execute(
+                select(table.c.city, table.c.timestamp).where(
+                    table.c.city == city, table.c.timestamp.in_(stamps[start:start + UPSERT_CHUNK_SIZE])
+                )
+            ))
+    written = []
+    for row in rows:
+        key = (row.get('city'), row.get('timestamp'))
+        if key not in stored:
+            stored.add(key)
+            written.append(row)
+    if written:
+        session.execute(table.insert(), written)
+    return written
+
+
+class WeatherBatchWriter:
+    """
+    Buffer weather readings and write them to the database in bulk
+
+    Readings are flushed in a single transaction once the buffer reaches
+    max_size or its oldest reading is older than max_age seconds, together with
+    the matching updates to the downsampled rollup tiers, latest_weather and
+    the dashboard's data version. Readings already stored are skipped and
+    counted in rows_duplicate. If the bulk insert fails, rows are retried one
+    by one inside savepoints so a single bad row is dropped instead of the
+    whole batch. Once committed, the written rows are passed to on_write;
+    rows dropped instead of stored are passed to on_drop.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        max_size: int = config.WRITE_BATCH_SIZE,
+        max_age: float = config.WRITE_BATCH_MAX_AGE,
+        on_write: Optional[Callable[[List[Dict[str, Any]]], Any]] = None,
+        on_drop: Optional[Callable[[List[Dict[str, Any]]], Any]] = None,
+    ):
+        self.session_factory = session_factory
+        self.on_write = on_write
+        self.on_drop = on_drop
+        self.max_size = max_size
+        self.max_age = max_age
+        self._buffer: List[Dict[str, Any]] = []
+        self._oldest: Optional[float] = None
+        self._lock = threading.Lock()
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.rows_duplicate = 0
+        self.flushes = 0
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def add(self, weather_data: Dict[str, Any]) -> None:
+        """
+        Queue a reading, flushing the buffer if it is full
+
+        Args:
+            weather_data (Dict[str, Any]): Reading as returned by get_weather_data
+        """
+        row = {name: weather_data.get(name) for name in WEATHER_COLUMNS}
+        with self._lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.max_size
+        if full:
+            self.flush()
+
+    def add_many(self, readings: Iterable[Dict[str, Any]]) -> None:
+        for weather_data in readings:
+            self.add(weather_data)
+
+    def due(self) -> bool:
+        """
+        Whether the buffered readings have reached the size or age limit
+        """
+        with self._lock:
+            if not self._buffer:
+                return False
+            return len(self._buffer) >= self.max_size or time.monotonic() - self._oldest >= self.max_age
+
+    def flush(self) -> int:
+        """
+        Write all buffered readings in one transaction
+
+        Returns:
+            int: Number of rows written
+        """
+        with self._lock:
+            rows, self._buffer, self._oldest = self._buffer, [], None
+        if not rows:
+            return 0
+        return self.write(rows)
+
+    def write(self, rows: List[Dict[str, Any]], raise_unavailable: bool = False) -> int:
+        """
+        Write rows in one transaction, as flush does with the buffer
+
+        Args:
+            rows (List[Dict[str, Any]]): Rows keyed by WEATHER_COLUMNS
+            raise_unavailable (bool): Re-raise errors meaning the database is
+                unavailable (see is_unavailable) instead of dropping the rows, also
+                when the database goes down during the row-by-row retry, so the
+                caller can write them again later
+
+        Returns:
+            int: Number of rows written
+        """
+        session = self.session_factory()
+        try:
+            try:
+                # db_write covers the whole transaction, rollup tiers included
+                with metrics.stage('db_write'):
+                    inserted = insert_readings(session, rows)
+                    with metrics.stage('rollup'):
+                        update_rollup_tiers(session, inserted)
+                    update_latest_weather(session, inserted)
+                    if inserted:
+                        bump_data_version(session)
+                    session.commit()
+                written, duplicates = len(inserted), len(rows) - len(inserted)
+                self._written(inserted)
+            except SQLAlchemyError as e:
+                session.rollback()
+                if raise_unavailable and is_unavailable(e):
+                    raise
+                logger.warning(f"Bulk insert of {len(rows)} readings failed, retrying row by row: {str(e)}")
+                written, duplicates = self._insert_isolated(session, rows, raise_unavailable)
+        finally:
+            session.close()
+
+        self.flushes += 1
+        self.rows_written += written
+        self.rows_duplicate += duplicates
+        self.rows_failed += len(rows) - written - duplicates
+        metrics.READINGS.inc(written, outcome='written')
+        metrics.READINGS.inc(duplicates, outcome='duplicate')
+        metrics.READINGS.inc(len(rows) - written - duplicates, outcome='failed')
+        logger.info(f"Flushed {written}/{len(rows)} weather readings ({duplicates} already stored)")
+        return written
+
+    def _written(self, rows: List[Dict[str, Any]]) -> None:
+        if self.on_write is not None and rows:
+            try:
+                self.on_write(rows)
+            except Exception:
+                logger.exception("on_write callback failed")
+
+    def _dropped(self, rows: List[Dict[str, Any]]) -> None:
+        if self.on_drop is not None and rows:
+            try:
+                self.on_drop(rows)
+            except Exception:
+                logger.exception("on_drop callback failed")
+
+    def _insert_isolated(
+        self, session: Session, rows: List[Dict[str, Any]], raise_unavailable: bool = False
+    ) -> Tuple[int, int]:
+        written_rows = []
+        dropped = []
+        duplicates = 0
+        for row in rows:
+            try:
+                with session.begin_nested():
+                    inserted = insert_readings(session, [row])
+                    update_rollup_tiers(session, inserted)
+                    update_latest_weather(session, inserted)
+                written_rows.extend(inserted)
+                duplicates += 1 - len(inserted)
+            except SQLAlchemyError as e:
+                if raise_unavailable and is_unavailable(e):
+                    session.rollback()
+                    raise
+                dropped.append(row)
+                logger.error(f"Dropping weather reading for {row.get('city')} at {row.get('timestamp')}: {str(e)}")
+        try:
+            if written_rows:
+                bump_data_version(session)
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            if raise_unavailable and is_unavailable(e):
+                raise
+            logger.error(f"Database error while saving weather data batch: {str(e)}")
+            self._dropped(rows)
+            return 0, 0
+        self._written(written_rows)
+        self._dropped(dropped)
+        return len(written_rows), duplicates
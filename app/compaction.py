@@ -0,0 +1,176 @@
+"""
+One-off compaction of duplicate weather observations
+
+Before weather_data had a unique (city, timestamp) index the same observation
+could be stored more than once, for example when a restart or an overlapping
+sweep wrote it again. This removes the extra copies (keeping the lowest id)
+one time window at a time, so no single transaction locks the table for
+long, rebuilds the daily summaries and rollup tiers of the affected days and
+then creates the unique index, after which the database rejects duplicates
+itself.
+
+    python -m app.compaction --window-hours 24 --chunk-size 5000
+"""
+import argparse
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Set
+from sqlalchemy import Table, delete, func, inspect, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app.models import WeatherData, SessionLocal, get_engine
+from app.partitioning import deletable_tables
+import config
+
+logger = logging.getLogger(__name__)
+
+UNIQUE_INDEX = 'ix_weather_data_city_timestamp'
+
+
+def _weather_tables(bind: Engine) -> List[Table]:
+    # SQLite partitions are separate tables behind a read-only view
+    return deletable_tables(bind, WeatherData.__table__, datetime.max)
+
+
+def _duplicates(session: Session, table: Table, start: datetime, end: datetime) -> List[Any]:
+    copy_number = func.row_number().over(
+        partition_by=(table.c.city, table.c.timestamp), order_by=table.c.id
+    ).label('copy_number')
+    ranked = select(table.c.id, table.c.timestamp, copy_number).where(
+        table.c.timestamp >= start, table.c.timestamp < end
+    ).subquery()
+    return session.execute(
+        select(ranked.c.id, ranked.c.timestamp).where(ranked.c.copy_number > 1)
+    ).all()
+
+
+def remove_duplicates(
+    session_factory: Callable[[], Session] = SessionLocal,
+    window: timedelta = timedelta(days=1),
+    chunk_size: int = config.RETENTION_CHUNK_SIZE,
+) -> Dict[str, Any]:
+    """
+    Delete repeated (city, timestamp) readings, keeping the first one stored
+
+    Args:
+        session_factory (Callable[[], Session]): Sessions on the database to compact
+        window (timedelta): Span of timestamps scanned per query
+        chunk_size (int): Rows deleted per transaction
+
+    Returns:
+        Dict[str, Any]: Number of rows deleted and the days they belonged to
+    """
+    deleted = 0
+    days: Set[datetime] = set()
+    session = session_factory()
+    try:
+        for table in _weather_tables(session.get_bind()):
+            first, last = session.execute(select(func.min(table.c.timestamp), func.max(table.c.timestamp))).one()
+            if first is None:
+                continue
+            start = datetime.combine(first.date(), datetime.min.time())
+            while start <= last:
+                duplicates = _duplicates(session, table, start, start + window)
+                for offset in range(0, len(duplicates), chunk_size):
+                    ids = [row.id for row in duplicates[offset:offset + chunk_size]]
+                    session.execute(delete(table).where(table.c.id.in_(ids)))
+                    session.commit()
+                deleted += len(duplicates)
+                days.update(datetime.combine(row.timestamp.date(), datetime.min.time()) for row in duplicates)
+                start += window
+            logger.info(f"Compacted {table.name}: {deleted} duplicate readings removed so far")
+    finally:
+        session.close()
+    return {'deleted': deleted, 'days': sorted(days)}
+
+
+def has_duplicates(bind: Engine) -> bool:
+    """
+    Whether any (city, timestamp) observation is stored more than once
+    """
+    with bind.connect() as connection:
+        for table in _weather_tables(bind):
+            repeated = select(table.c.city).group_by(table.c.city, table.c.timestamp).having(func.count() > 1).limit(1)
+            if connection.execute(repeated).first() is not None:
+                return True
+    return False
+
+
+def require_unique_index(bind: Engine) -> None:
+    """
+    Migration making sure weather_data rejects duplicate observations
+
+    The writes rely on the unique index to skip observations already stored;
+    without it they are inserted again without an error. Databases created
+    before the index may hold duplicates, so the migration fails, and is run
+    again at the next start, until python -m app.compaction has removed them.
+
+    Raises:
+        RuntimeError: If duplicate readings are still stored
+    """
+    if has_duplicates(bind):
+        raise RuntimeError("weather_data holds duplicate readings; run python -m app.compaction to remove them")
+    create_unique_index(bind)
+
+
+def create_unique_index(bind: Engine) -> List[str]:
+    """
+    Create the unique (city, timestamp) index, replacing a non-unique one of the same name
+
+    Returns:
+        List[str]: Names of the indexes created
+    """
+    created = []
+    inspector = inspect(bind)
+    for table in _weather_tables(bind):
+        index = next(index for index in table.indexes if index.name.endswith('_city_timestamp'))
+        existing = {item['name']: item for item in inspector.get_indexes(table.name)}
+        if index.name in existing:
+            if existing[index.name]['unique']:
+                continue
+            index.drop(bind=bind)
+        index.create(bind=bind)
+        created.append(index.name)
+        logger.info(f"Created unique index {index.name}")
+    return created
+
+
+def rebuild_derived(days: List[datetime]) -> None:
+    """
+    Recompute the daily summaries and rollup tiers of days that held duplicates
+    """
+    from app.data_processor import calculate_daily_summary
+    from app.query_cache import bump_data_version
+    from app.rollup_tiers import rebuild_rollup_tiers
+
+    for day in days:
+        calculate_daily_summary(day)
+        session = SessionLocal()
+        try:
+            rebuild_rollup_tiers(session, day, day + timedelta(days=1))
+            bump_data_version(session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remove duplicate weather readings and enforce one row per observation")
+    parser.add_argument('--window-hours', type=float, default=24, help='Span of timestamps scanned per query')
+    parser.add_argument('--chunk-size', type=int, default=config.RETENTION_CHUNK_SIZE, help='Rows deleted per transaction')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    result = remove_duplicates(window=timedelta(hours=args.window_hours), chunk_size=args.chunk_size)
+    if result['days']:
+        rebuild_derived(result['days'])
+    created = create_unique_index(get_engine())
+    print(f"Removed {result['deleted']} duplicate readings across {len(result['days'])} days; "
+          f"created {len(created)} unique indexes")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,62 +1,330 @@
-from sqlalchemy import func
-from datetime import date, datetime, timedelta
-from app.models import WeatherData, DailySummary, SessionLocal
-from config import CITIES
+import json
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from sqlalchemy import delete, func, or_, select
+from datetime import date, datetime, time, timedelta
+from app.models import (WeatherData, DailySummary, DailyConditionRollup, RollupWatermark, SessionLocal,
+                        WeatherRollup15m, WeatherRollupHourly)
+from app.db_utils import upsert, least, greatest
+from app.query_cache import bump_data_version
+from app.alerts import alert_engine
+from app.partitioning import deletable_tables, drop_partitions_before
+from config import (ARCHIVE_DIR, CONDITION_ROLLUP_RETENTION_DAYS, RETENTION_CHUNK_SIZE, RETENTION_DAYS,
+                    ROLLUP_15M_RETENTION_DAYS, ROLLUP_CHUNK_SIZE, ROLLUP_GAP_TIMEOUT, ROLLUP_HOURLY_RETENTION_DAYS,
+                    ROLLUP_MAX_GAPS)
 
+logger = logging.getLogger(__name__)
 
-def cleanup_old_data(days=30):
-    session = SessionLocal()
-    cutoff_date = datetime.now() - timedelta(days=days)
-    session.query(WeatherData).filter(WeatherData.timestamp < cutoff_date).delete()
-    session.commit()
-    session.close()
+# Derived tables pruned by cleanup_old_data: (table, time column, days kept)
+ROLLUP_RETENTION = (
+    (WeatherRollup15m.__table__, 'bucket_start', ROLLUP_15M_RETENTION_DAYS),
+    (WeatherRollupHourly.__table__, 'bucket_start', ROLLUP_HOURLY_RETENTION_DAYS),
+    (DailyConditionRollup.__table__, 'date', CONDITION_ROLLUP_RETENTION_DAYS),
+)
 
-# Function to calculate daily rollups
-def calculate_daily_summary():
+
+def _delete_before(session, table, column, cutoff, chunk_size):
+    """Delete rows of table with column before cutoff, chunk_size rows per transaction."""
+    deleted = 0
+    while True:
+        expired_ids = select(table.c.id).where(table.c[column] < cutoff).limit(chunk_size)
+        result = session.execute(delete(table).where(table.c.id.in_(expired_ids)))
+        session.commit()
+        deleted += result.rowcount
+        if result.rowcount < chunk_size:
+            return deleted
+
+
+def cleanup_old_data(days=RETENTION_DAYS, chunk_size=RETENTION_CHUNK_SIZE, archive_dir=ARCHIVE_DIR):
+    """
+    Remove weather readings older than the retention window
+
+    With archive_dir set, expired readings and daily summaries are first
+    moved to the Parquet archive (see app.archive). Whole expired partitions
+    are dropped when partitioned storage is enabled; anything left over (or
+    the whole table without partitioning) is deleted in transactions of at
+    most chunk_size rows so ingestion is never blocked behind one long delete.
+    The rollup tiers and per-condition daily aggregates are pruned the same
+    way, each after its own retention (see ROLLUP_RETENTION).
+
+    Returns:
+        tuple: Dropped partitions and deleted weather_data rows
+    """
+    cutoff_date = datetime.now() - timedelta(days=days)
+    weather_table = WeatherData.__table__
+    deleted = 0
+    if archive_dir:
+        from app.archive import archive_expired
+        archive_expired(cutoff_date, SessionLocal, archive_dir)
     session = SessionLocal()
-    for city in CITIES:
-        today = date.today()
+    try:
+        engine = session.get_bind()
+        dropped = drop_partitions_before(engine, weather_table, cutoff_date)
+        for table in deletable_tables(engine, weather_table, cutoff_date):
+            deleted += _delete_before(session, table, 'timestamp', cutoff_date, chunk_size)
+        for table, column, retention_days in ROLLUP_RETENTION:
+            pruned = _delete_before(session, table, column, datetime.now() - timedelta(days=retention_days), chunk_size)
+            if pruned:
+                logger.info(f"Deleted {pruned} {table.name} rows older than {retention_days} days")
+    finally:
+        session.close()
+    return len(dropped), deleted
+
+DAILY_ROLLUP = 'daily_summary'
+
+# The scheduler may run the incremental update and the nightly rebuild at the same time
+_rollup_lock = threading.RLock()
+
+
+def _as_datetime(day):
+    # func.date() yields a date on PostgreSQL and an ISO string on SQLite
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    if isinstance(day, datetime):
+        day = day.date()
+    return datetime.combine(day, time.min)
+
+
+def _id_runs(ids):
+    """Collapse sorted ids into [first, last] runs of consecutive ids."""
+    runs = []
+    for id_ in ids:
+        if runs and id_ == runs[-1][1] + 1:
+            runs[-1][1] = id_
+        else:
+            runs.append([id_, id_])
+    return runs
+
+
+def _missing_runs(first, last, ids):
+    """[first, last] runs of the ids in first..last that are not in the sorted ids."""
+    runs = []
+    expected = first
+    for id_ in ids[bisect_left(ids, first):bisect_right(ids, last)]:
+        if id_ > expected:
+            runs.append([expected, id_ - 1])
+        expected = id_ + 1
+    if expected <= last:
+        runs.append([expected, last])
+    return runs
+
+
+def _in_runs(runs):
+    return or_(*[WeatherData.id.between(first, last) for first, last in runs])
 
-        # Fetch today's weather data for the city
-        data = session.query(WeatherData).filter(
-            WeatherData.city == city,
-            func.date(WeatherData.timestamp) == today
+
+def _fold_weather_data(session, *filters):
+    """Add readings matching filters to the per-condition running aggregates."""
+    day = func.date(WeatherData.timestamp)
+    rows = session.execute(
+        select(
+            WeatherData.city,
+            day.label('day'),
+            WeatherData.weather_main,
+            func.count().label('reading_count'),
+            func.sum(WeatherData.temperature).label('temp_sum'),
+            func.min(WeatherData.temperature).label('temp_min'),
+            func.max(WeatherData.temperature).label('temp_max'),
+            func.coalesce(func.sum(WeatherData.humidity), 0).label('humidity_sum'),
+            func.count(WeatherData.humidity).label('humidity_count'),
+            func.coalesce(func.sum(WeatherData.wind_speed), 0).label('wind_speed_sum'),
+            func.count(WeatherData.wind_speed).label('wind_speed_count'),
+        ).where(*filters).group_by(WeatherData.city, day, WeatherData.weather_main)
+    ).mappings().all()
+    if not rows:
+        return set()
+
+    records = []
+    for row in rows:
+        record = dict(row)
+        record['date'] = _as_datetime(record.pop('day'))
+        records.append(record)
+
+    table = DailyConditionRollup.__table__
+    upsert(session, table, records, ['city', 'date', 'weather_main'], set_=lambda excluded: {
+        'reading_count': table.c.reading_count + excluded.reading_count,
+        'temp_sum': table.c.temp_sum + excluded.temp_sum,
+        'temp_min': least(session, table.c.temp_min, excluded.temp_min),
+        'temp_max': greatest(session, table.c.temp_max, excluded.temp_max),
+        'humidity_sum': table.c.humidity_sum + excluded.humidity_sum,
+        'humidity_count': table.c.humidity_count + excluded.humidity_count,
+        'wind_speed_sum': table.c.wind_speed_sum + excluded.wind_speed_sum,
+        'wind_speed_count': table.c.wind_speed_count + excluded.wind_speed_count,
+    })
+    return {record['date'] for record in records}
+
+
+def _refresh_daily_summaries(session, days):
+    """Upsert DailySummary rows for the given days from the running aggregates."""
+    if not days:
+        return
+    rollup = DailyConditionRollup
+    partition = (rollup.city, rollup.date)
+    ranked = select(
+        rollup.city,
+        rollup.date,
+        rollup.weather_main,
+        func.sum(rollup.reading_count).over(partition_by=partition).label('reading_count'),
+        func.sum(rollup.temp_sum).over(partition_by=partition).label('temp_sum'),
+        func.min(rollup.temp_min).over(partition_by=partition).label('min_temp'),
+        func.max(rollup.temp_max).over(partition_by=partition).label('max_temp'),
+        func.sum(rollup.humidity_sum).over(partition_by=partition).label('humidity_sum'),
+        func.sum(rollup.humidity_count).over(partition_by=partition).label('humidity_count'),
+        func.sum(rollup.wind_speed_sum).over(partition_by=partition).label('wind_speed_sum'),
+        func.sum(rollup.wind_speed_count).over(partition_by=partition).label('wind_speed_count'),
+        # The dominant condition is the mode: the condition with the most readings
+        func.row_number().over(
+            partition_by=partition,
+            order_by=(rollup.reading_count.desc(), rollup.weather_main),
+        ).label('condition_rank'),
+    ).where(rollup.date.in_(days)).subquery()
+    rows = session.execute(select(ranked).where(ranked.c.condition_rank == 1)).mappings().all()
+
+    summaries = [{
+        'city': row['city'],
+        'date': row['date'],
+        'avg_temp': row['temp_sum'] / row['reading_count'],
+        'max_temp': row['max_temp'],
+        'min_temp': row['min_temp'],
+        'humidity': row['humidity_sum'] / row['humidity_count'] if row['humidity_count'] else None,
+        'wind_speed': row['wind_speed_sum'] / row['wind_speed_count'] if row['wind_speed_count'] else None,
+        'dominant_weather': row['weather_main'],
+        'reading_count': row['reading_count'],
+    } for row in rows]
+    if summaries:
+        upsert(session, DailySummary.__table__, summaries, ['city', 'date'], set_=lambda excluded: {
+            column: excluded[column]
+            for column in ('avg_temp', 'max_temp', 'min_temp', 'humidity', 'wind_speed', 'dominant_weather', 'reading_count')
+        })
+
+
+# Function to fold new readings into today's summaries
+def update_daily_summaries(chunk_size=ROLLUP_CHUNK_SIZE):
+    """
+    Incrementally update daily summaries with readings ingested since the last run
+
+    Readings are picked up by id above the stored watermark, aggregated in one
+    GROUP BY city, date, condition query and merged into the running aggregates.
+    At most chunk_size readings are folded per transaction, so a first run over
+    a large table moves the watermark up in bounded steps.
+
+    Concurrent writers can commit a lower id after a higher one, so ids below
+    the watermark that were missing when it moved past them are kept as gaps
+    and folded if their rows appear within ROLLUP_GAP_TIMEOUT seconds. Only the
+    newest ROLLUP_MAX_GAPS gaps are kept. Each row is folded exactly once: only
+    the ids read in this run are folded.
+    """
+    with _rollup_lock:
+        while _fold_new_readings(chunk_size) == chunk_size:
+            pass
+
+
+def _fold_new_readings(chunk_size):
+    """Fold up to chunk_size readings above the watermark plus the gap rows that appeared; returns the former count."""
+    session = SessionLocal()
+    try:
+        watermark = session.execute(
+            select(RollupWatermark).where(RollupWatermark.name == DAILY_ROLLUP).with_for_update()
+        ).scalar_one_or_none()
+        last_id = watermark.last_id if watermark else 0
+        gaps = json.loads(watermark.gaps) if watermark is not None and watermark.gaps else []
+        new_ids = session.scalars(
+            select(WeatherData.id).where(WeatherData.id > last_id).order_by(WeatherData.id).limit(chunk_size)
         ).all()
+        gap_ids = session.scalars(
+            select(WeatherData.id).where(_in_runs([(first, last) for first, last, _ in gaps])).order_by(WeatherData.id)
+        ).all() if gaps else []
+        # Gaps are all below the watermark, so this stays sorted
+        ids = gap_ids + new_ids
+        now = datetime.now().timestamp()
+        max_id = max(last_id, ids[-1] if ids else 0)
+        candidates = gaps + ([[last_id + 1, max_id, now]] if max_id > last_id else [])
+        remaining = []
+        for first, last, seen in candidates:
+            for run in _missing_runs(first, last, ids):
+                if now - seen < ROLLUP_GAP_TIMEOUT:
+                    remaining.append(run + [seen])
+                else:
+                    logger.debug(f"Giving up on weather_data ids {run[0]}-{run[1]}, never committed")
+        if len(remaining) > ROLLUP_MAX_GAPS:
+            # Keep the most recently seen gaps, in id order
+            dropped = len(remaining) - ROLLUP_MAX_GAPS
+            remaining = sorted(sorted(remaining, key=lambda run: run[2])[dropped:])
+            logger.warning(f"Giving up on {dropped} runs of weather_data ids, more than {ROLLUP_MAX_GAPS} are waited for")
+        if not ids and remaining == gaps:
+            return 0
 
-        if data:
-            avg_temp = sum([entry.temperature for entry in data]) / len(data)  # Updated here
-            max_temp = max([entry.temperature for entry in data])  # Updated here
-            min_temp = min([entry.temperature for entry in data])  # Updated here
-
-            # Find the most frequent weather condition
-            condition_counts = {}
-            for entry in data:
-                condition_counts[entry.weather_main] = condition_counts.get(entry.weather_main, 0) + 1  # Updated here
-            dominant_condition = max(condition_counts, key=condition_counts.get)
-
-            # Save the daily summary
-            daily_summary = DailySummary(
-                city=city,
-                date=today,
-                avg_temp=avg_temp,
-                max_temp=max_temp,
-                min_temp=min_temp,
-                dominant_weather=dominant_condition  # Updated here
+        days = set()
+        runs = _id_runs(ids)
+        # Bounded OR lists keep the statements a reasonable size
+        for start in range(0, len(runs), 500):
+            days |= _fold_weather_data(session, _in_runs(runs[start:start + 500]))
+        _refresh_daily_summaries(session, days)
+        if watermark is None:
+            watermark = RollupWatermark(name=DAILY_ROLLUP)
+            session.add(watermark)
+        watermark.last_id = max_id
+        watermark.gaps = json.dumps(remaining) if remaining else None
+        bump_data_version(session)
+        session.commit()
+        return len(new_ids)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+# Function to calculate daily rollups
+def calculate_daily_summary(day=None):
+    """
+    Rebuild the daily summaries for a day (default today) from raw readings
+
+    Reruns replace the day's summaries instead of adding duplicate rows, and
+    summaries of cities with no readings left that day are deleted.
+    """
+    with _rollup_lock:
+        update_daily_summaries()
+
+        day_start = _as_datetime(day or date.today())
+        day_end = day_start + timedelta(days=1)
+        session = SessionLocal()
+        try:
+            watermark = session.execute(
+                select(RollupWatermark).where(RollupWatermark.name == DAILY_ROLLUP).with_for_update()
+            ).scalar_one_or_none()
+            last_id = watermark.last_id if watermark else 0
+            gaps = json.loads(watermark.gaps) if watermark is not None and watermark.gaps else []
+            # Rows in gaps are not folded yet; the incremental update folds them when they appear
+            filters = [~_in_runs([(first, last) for first, last, _ in gaps])] if gaps else []
+            session.execute(delete(DailyConditionRollup).where(DailyConditionRollup.date == day_start))
+            _fold_weather_data(
+                session,
+                WeatherData.timestamp >= day_start,
+                WeatherData.timestamp < day_end,
+                WeatherData.id <= last_id,
+                *filters,
             )
-            session.add(daily_summary)
+            session.execute(delete(DailySummary).where(
+                DailySummary.date == day_start,
+                DailySummary.city.notin_(select(DailyConditionRollup.city).where(DailyConditionRollup.date == day_start)),
+            ))
+            _refresh_daily_summaries(session, {day_start})
+            bump_data_version(session)
             session.commit()
-    session.close()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
 
-# Function to monitor and alert on thresholds
+# Function to persist alerts raised by the streaming alert engine
 def check_thresholds():
-    session = SessionLocal()
-    for city in CITIES:
-        recent_data = session.query(WeatherData).filter(
-            WeatherData.city == city
-        ).order_by(WeatherData.timestamp.desc()).limit(2).all()
-
-        if len(recent_data) == 2:
-            if recent_data[0].temperature > 35 and recent_data[1].temperature > 35:  # Updated here
-                print(f"ALERT: {city} temperature exceeded 35°C for two consecutive updates.")
-                # Add logic for email alert (optional)
-    session.close()
+    """
+    Write alerts fired since the last tick as WeatherAlert rows and queue their emails
+
+    Rules are evaluated by app.alerts.alert_engine as readings are ingested,
+    so this does not query weather_data. Emails are sent in the background by
+    app.email_notifier.notifier.
+    """
+    return alert_engine.flush()
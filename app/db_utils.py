@@ -0,0 +1,119 @@
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from sqlalchemy import Table, and_, func, literal, select, update
+from sqlalchemy.orm import Session
+
+# Keeps multi-row VALUES statements under SQLite's bound parameter limit
+UPSERT_CHUNK_SIZE = 500
+
+# Dialects whose insert() supports ON CONFLICT
+ON_CONFLICT_DIALECTS = ('postgresql', 'sqlite')
+
+
+def dialect_name(session: Session) -> str:
+    return session.get_bind().dialect.name
+
+
+def supports_on_conflict(session: Session) -> bool:
+    return dialect_name(session) in ON_CONFLICT_DIALECTS
+
+
+def dialect_insert(session: Session, table: Table):
+    """
+    Return the dialect-specific insert() construct that supports ON CONFLICT
+
+    Check supports_on_conflict() first; other dialects need the plain fallbacks.
+    """
+    name = dialect_name(session)
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upserts are not supported on {name}")
+    return insert(table)
+
+
+def least(session: Session, *args):
+    """Smallest of the given expressions (two-argument min() on SQLite)."""
+    return func.min(*args) if dialect_name(session) == 'sqlite' else func.least(*args)
+
+
+def greatest(session: Session, *args):
+    """Largest of the given expressions (two-argument max() on SQLite)."""
+    return func.max(*args) if dialect_name(session) == 'sqlite' else func.greatest(*args)
+
+
+def upsert(
+    session: Session,
+    table: Table,
+    rows: List[Dict[str, Any]],
+    index_elements: Sequence[str],
+    set_: Optional[Callable[[Any], Dict[str, Any]]] = None,
+    where: Optional[Callable[[Any], Any]] = None,
+) -> None:
+    """
+    Insert rows, resolving conflicts on index_elements
+
+    Dialects without ON CONFLICT update or insert one row at a time instead,
+    which is slower and not safe against concurrent writers of the same keys.
+
+    Args:
+        session (Session): Session to execute in; the caller commits
+        table (Table): Target table
+        rows (List[Dict[str, Any]]): Rows to insert
+        index_elements (Sequence[str]): Columns of the unique constraint
+        set_ (Optional[Callable]): Called with the statement's excluded row and
+            returning the columns to update on conflict; None skips conflicting rows
+        where (Optional[Callable]): Called with the excluded row and returning a
+            condition the conflicting row must meet to be updated
+    """
+    if not supports_on_conflict(session):
+        for row in rows:
+            _upsert_row(session, table, row, index_elements, set_, where)
+        return
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        statement = dialect_insert(session, table).values(rows[start:start + UPSERT_CHUNK_SIZE])
+        if set_ is None:
+            statement = statement.on_conflict_do_nothing(index_elements=index_elements)
+        else:
+            statement = statement.on_conflict_do_update(
+                index_elements=index_elements,
+                set_=set_(statement.excluded),
+                where=where(statement.excluded) if where is not None else None,
+            )
+        session.execute(statement)
+
+
+class _Excluded:
+    """
+    Stands in for a statement's excluded row, with the values of one row as literals
+    """
+
+    def __init__(self, table: Table, row: Dict[str, Any]):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, name: str):
+        return literal(self._row.get(name), type_=self._table.c[name].type)
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+
+def _upsert_row(
+    session: Session,
+    table: Table,
+    row: Dict[str, Any],
+    index_elements: Sequence[str],
+    set_: Optional[Callable[[Any], Dict[str, Any]]],
+    where: Optional[Callable[[Any], Any]],
+) -> None:
+    key = and_(*(table.c[name] == row[name] for name in index_elements))
+    if session.execute(select(literal(1)).select_from(table).where(key)).first() is None:
+        session.execute(table.insert().values(row))
+    elif set_ is not None:
+        excluded = _Excluded(table, row)
+        condition = and_(key, where(excluded)) if where is not None else key
+        session.execute(update(table).where(condition).values(set_(excluded)))
@@ -1,28 +1,302 @@
 # email_notifier.py
+"""
+Background delivery of alert emails
+
+Callers enqueue alerts and return immediately; one worker thread sends them
+over a single authenticated SMTP connection that is reused until it has been
+idle for SMTP_IDLE_TIMEOUT seconds. Alerts for the same recipient arriving
+within ALERT_DIGEST_WINDOW seconds go out as one digest, each recipient gets
+at most one email per ALERT_EMAIL_MIN_INTERVAL seconds (alerts arriving in
+between wait for the next digest), and failed deliveries are retried with
+exponential backoff.
+"""
+import logging
+import queue
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from config import EMAIL_PASSWORD, SENDER_EMAIL, RECEIVER_EMAIL
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from app import metrics
+import config
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
 
-def send_alert_email(city, temperature):
-    sender_email = SENDER_EMAIL
-    receiver_email = RECEIVER_EMAIL
-    password = EMAIL_PASSWORD
 
-    subject = f"ALERT: High Temperature in {city}"
-    body = f"The temperature has exceeded the threshold! Current temperature in {city} is {temperature}°C."
+def build_message(sender: str, recipient: str, alerts: List[Dict[str, Any]]) -> MIMEMultipart:
+    """
+    Build the email for one or more alerts to a recipient
+    """
+    cities = sorted({alert['city'] for alert in alerts})
+    if len(alerts) == 1:
+        alert = alerts[0]
+        subject = f"ALERT: High Temperature in {alert['city']}"
+        body = (
+            f"The temperature has exceeded the threshold! "
+            f"Current temperature in {alert['city']} is {alert['temperature']}°C."
+        )
+    else:
+        subject = f"ALERT: {len(alerts)} weather alerts for {', '.join(cities)}"
+        body = '\n'.join(
+            f"{alert.get('timestamp') or ''} {alert['message']} (currently {alert['temperature']}°C)".strip()
+            for alert in alerts
+        )
 
     msg = MIMEMultipart()
-    msg['From'] = sender_email
-    msg['To'] = receiver_email
+    msg['From'] = sender
+    msg['To'] = recipient
     msg['Subject'] = subject
     msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+
+class AlertNotifier:
+    """
+    Queue alerts and email them from a background worker
+
+    Args:
+        host (str): SMTP server
+        port (int): SMTP port
+        sender (Optional[str]): From address, also the login user
+        password (Optional[str]): SMTP password; no login without one
+        default_recipients (Iterable[str]): Recipients of alerts that name none
+        starttls (bool): Upgrade the connection with STARTTLS before login
+        digest_window (float): Seconds to collect alerts into one email
+        min_interval (float): Minimum seconds between emails to one recipient
+        retries (int): Delivery attempts after the first before alerts are dropped
+        backoff (float): Seconds before the first retry, doubled per retry
+        idle_timeout (float): Seconds an unused SMTP connection is kept open
+        clock (Callable[[], float]): Monotonic time source
+    """
+
+    def __init__(
+        self,
+        host: str = config.SMTP_HOST,
+        port: int = config.SMTP_PORT,
+        sender: Optional[str] = config.SENDER_EMAIL,
+        password: Optional[str] = config.EMAIL_PASSWORD,
+        default_recipients: Iterable[str] = (config.RECEIVER_EMAIL,),
+        starttls: bool = config.SMTP_STARTTLS,
+        digest_window: float = config.ALERT_DIGEST_WINDOW,
+        min_interval: float = config.ALERT_EMAIL_MIN_INTERVAL,
+        retries: int = config.ALERT_EMAIL_RETRIES,
+        backoff: float = config.ALERT_EMAIL_BACKOFF,
+        idle_timeout: float = config.SMTP_IDLE_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.default_recipients = [recipient for recipient in default_recipients if recipient]
+        self.starttls = starttls
+        self.digest_window = digest_window
+        self.min_interval = min_interval
+        self.retries = retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self._queue: queue.Queue = queue.Queue()
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._due: Dict[str, float] = {}
+        self._attempts: Dict[str, int] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_used_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.emails_sent = 0
+        self.alerts_sent = 0
+        self.alerts_dropped = 0
+        self.retried = 0
+        self.connections = 0
+
+    def enqueue(self, alert: Dict[str, Any], recipients: Optional[Iterable[str]] = None) -> bool:
+        """
+        Queue an alert for delivery without waiting for it
+
+        Args:
+            alert (Dict[str, Any]): Alert as fired by the alert engine
+            recipients (Optional[Iterable[str]]): Defaults to the alert's emails, then default_recipients
+
+        Returns:
+            bool: False if there is no sender or recipient to email
+        """
+        recipients = sorted(set(recipients or alert.get('emails') or self.default_recipients))
+        if not self.sender or not recipients:
+            logger.debug(f"No email configured for the alert on {alert.get('city')}")
+            return False
+        self._start()
+        self._queue.put((alert, recipients))
+        return True
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='alert-notifier', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Send every queued alert now, ignoring the digest window and rate limit, and stop the worker
+        """
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'emails_sent': self.emails_sent,
+            'alerts_sent': self.alerts_sent,
+            'alerts_dropped': self.alerts_dropped,
+            'retried': self.retried,
+            'connections': self.connections,
+            'pending': sum(len(alerts) for alerts in self._pending.values()) + self._queue.qsize(),
+        }
 
-    try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(sender_email, password)
-            server.send_message(msg)
-            print(f"Alert email sent for {city}.")
-    except Exception as e:
-        print(f"Failed to send email: {e}")
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self._wait_time())
+            except queue.Empty:
+                item = None
+            try:
+                while item is not None:
+                    if item is _STOP:
+                        stopping = True
+                    else:
+                        self._add(*item)
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+                self._send_due(force=stopping)
+                if stopping or (self._smtp is not None and self.clock() - self._smtp_used_at >= self.idle_timeout):
+                    self._disconnect()
+            except Exception:
+                # Keep the worker alive; alerts already queued are sent on the next pass
+                logger.exception("Alert email worker failed")
+
+    def _wait_time(self) -> Optional[float]:
+        now = self.clock()
+        waits = [due - now for due in self._due.values()]
+        if self._smtp is not None:
+            waits.append(self._smtp_used_at + self.idle_timeout - now)
+        return max(0.0, min(waits)) if waits else None
+
+    def _add(self, alert: Dict[str, Any], recipients: List[str]) -> None:
+        now = self.clock()
+        for recipient in recipients:
+            if recipient not in self._pending:
+                self._pending[recipient] = []
+                self._due[recipient] = max(
+                    now + self.digest_window,
+                    self._last_sent.get(recipient, float('-inf')) + self.min_interval,
+                )
+            self._pending[recipient].append(alert)
+
+    def _send_due(self, force: bool = False) -> None:
+        now = self.clock()
+        for recipient in [recipient for recipient, due in self._due.items() if force or due <= now]:
+            alerts = self._pending[recipient]
+            try:
+                self._send(recipient, alerts)
+            except (smtplib.SMTPException, OSError) as e:
+                # 5xx replies will not succeed on a retry
+                permanent = isinstance(e, smtplib.SMTPRecipientsRefused) or (
+                    isinstance(e, smtplib.SMTPResponseException) and e.smtp_code >= 500
+                )
+                if not permanent:
+                    self._disconnect()
+                attempts = self._attempts[recipient] = self._attempts.get(recipient, 0) + 1
+                if permanent or force or attempts > self.retries:
+                    logger.error(f"Dropping {len(alerts)} alert email(s) to {recipient}: {str(e)}")
+                    self.alerts_dropped += len(alerts)
+                    metrics.EMAILS.inc(outcome='dropped')
+                    self._forget(recipient)
+                else:
+                    delay = self.backoff * 2 ** (attempts - 1)
+                    logger.warning(f"Alert email to {recipient} failed, retrying in {delay:g}s: {str(e)}")
+                    self._due[recipient] = now + delay
+                    self.retried += 1
+                    metrics.EMAILS.inc(outcome='retried')
+                continue
+            except Exception:
+                # Anything else, such as a malformed alert, fails the same way on a retry
+                logger.exception(f"Dropping {len(alerts)} alert email(s) to {recipient}")
+                self._disconnect()
+                self.alerts_dropped += len(alerts)
+                metrics.EMAILS.inc(outcome='dropped')
+                self._forget(recipient)
+                continue
+
+            logger.info(f"Alert email with {len(alerts)} alert(s) sent to {recipient}")
+            self.emails_sent += 1
+            metrics.EMAILS.inc(outcome='sent')
+            self.alerts_sent += len(alerts)
+            self._last_sent[recipient] = self.clock()
+            self._forget(recipient)
+
+    def _forget(self, recipient: str) -> None:
+        self._pending.pop(recipient, None)
+        self._due.pop(recipient, None)
+        self._attempts.pop(recipient, None)
+
+    def _send(self, recipient: str, alerts: List[Dict[str, Any]]) -> None:
+        msg = build_message(self.sender, recipient, alerts)
+        reused = self._smtp is not None
+        with metrics.stage('email_send'):
+            try:
+                self._connection().send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # The server closed the idle connection; reconnect once
+                self._disconnect()
+                if not reused:
+                    raise
+                self._connection().send_message(msg)
+        self._smtp_used_at = self.clock()
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=config.SMTP_TIMEOUT)
+            try:
+                if self.starttls:
+                    smtp.starttls()
+                if self.password:
+                    smtp.login(self.sender, self.password)
+            except Exception:
+                smtp.close()
+                raise
+            self._smtp = smtp
+            self.connections += 1
+        return self._smtp
+
+    def _disconnect(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        self._smtp = None
+
+
+notifier = AlertNotifier()
+
+metrics.registry.gauge('weather_email_pending_alerts', 'Alerts waiting to be emailed').set_function(
+    lambda: notifier.stats()['pending']
+)
+
+
+def send_alert_email(city, temperature):
+    """
+    Queue a high temperature alert email for RECEIVER_EMAIL
+    """
+    return notifier.enqueue({'city': city, 'temperature': temperature, 'message': f"{city} temperature exceeded the threshold"})
@@ -0,0 +1,140 @@
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+import requests
+from requests.adapters import HTTPAdapter
+import config
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+    Return the process-wide HTTP session
+
+    The session keeps TCP/TLS connections alive between sweeps; its pool is
+    sized so every ingestion worker can hold a connection to the same host.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(
+                pool_connections=config.HTTP_POOL_CONNECTIONS,
+                pool_maxsize=config.HTTP_POOL_SIZE,
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+class ResponseCache:
+    """
+    Short-TTL cache of upstream responses per city
+
+    OpenWeatherMap only refreshes a city every few minutes, so a response
+    fetched within the TTL is reused without a download. The cache also keeps
+    validators for conditional requests and the last observation time written
+    per city, so an unchanged observation can skip the database write.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._last_written: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.unchanged = 0
+
+    def get(self, city: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached payload for a city if it is still fresh
+        """
+        with self._lock:
+            entry = self._entries.get(city)
+            if entry is not None and time.monotonic() - entry['stored_at'] < self.ttl:
+                self.hits += 1
+                return entry['data']
+            self.misses += 1
+            return None
+
+    def conditional_headers(self, city: str) -> Dict[str, str]:
+        """
+        Build If-None-Match/If-Modified-Since headers from the last response
+        """
+        with self._lock:
+            entry = self._entries.get(city)
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, city: str, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        headers = headers or {}
+        with self._lock:
+            self._entries[city] = {
+                'data': data,
+                'stored_at': time.monotonic(),
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+            }
+
+    def revalidate(self, city: str) -> Optional[Dict[str, Any]]:
+        """
+        Refresh the TTL of a cached payload after a 304 Not Modified
+        """
+        with self._lock:
+            entry = self._entries.get(city)
+            if entry is None:
+                return None
+            entry['stored_at'] = time.monotonic()
+            self.not_modified += 1
+            return entry['data']
+
+    def is_new_observation(self, city: str, observed_at: datetime) -> bool:
+        """
+        Record an observation time, returning False if it is not newer than the last one written
+
+        This drops repeated observations in process, before they reach the
+        database's ON CONFLICT check. The time is recorded before the reading
+        is stored, so the same observation fetched again while the first is
+        still buffered is skipped too; if the reading is then dropped instead
+        of stored, forget_observations() lets the next fetch write it.
+        """
+        with self._lock:
+            last = self._last_written.get(city)
+            if last is not None and observed_at is not None and observed_at <= last:
+                self.unchanged += 1
+                return False
+            self._last_written[city] = observed_at
+            return True
+
+    def forget_observations(self, readings: Iterable[Dict[str, Any]]) -> None:
+        """
+        Undo is_new_observation for readings that were not stored
+        """
+        with self._lock:
+            for reading in readings:
+                city = reading.get('city')
+                # A newer observation recorded since then stays
+                if self._last_written.get(city) == reading.get('timestamp'):
+                    del self._last_written[city]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'unchanged': self.unchanged,
+        }
+
+
+response_cache = ResponseCache(ttl=config.RESPONSE_CACHE_TTL)
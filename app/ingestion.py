@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """
+    Thread-safe token bucket limiting how many requests start per second
+    """
+
+    def __init__(self, rate: float, burst: Optional[int] = None):
+        self.rate = rate
+        self.capacity = float(burst if burst is not None else max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline: Optional[float] = None) -> bool:
+        """
+        Block until a token is available
+
+        Args:
+            deadline (Optional[float]): time.monotonic() value after which to give up
+
+        Returns:
+            bool: True if a token was taken, False if the deadline was hit first
+        """
+        if self.rate <= 0:
+            return True
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def rate_limiter_for(url: str, rate: float) -> RateLimiter:
+    """
+    Return the shared rate limiter for the host of the given URL
+    """
+    host = urlparse(url).netloc
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(host)
+        if limiter is None or limiter.rate != rate:
+            limiter = _rate_limiters[host] = RateLimiter(rate)
+        return limiter
+
+
+class SweepReport:
+    """
+    Outcome of one ingestion sweep over a list of cities
+    """
+
+    def __init__(self):
+        self.fetched: List[Hashable] = []
+        self.failed: List[Hashable] = []
+        self.skipped: List[Hashable] = []
+        self.latencies: Dict[Hashable, float] = {}
+        self.duration = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str, city: Hashable, latency: Optional[float] = None) -> None:
+        with self._lock:
+            getattr(self, outcome).append(city)
+            if latency is not None:
+                self.latencies[city] = latency
+
+    def flatten(self) -> 'SweepReport':
+        """
+        Expand a report whose items are groups of cities into a per-city report
+        """
+        report = SweepReport()
+        report.duration = self.duration
+        for outcome in ('fetched', 'failed', 'skipped'):
+            for group in getattr(self, outcome):
+                for city in group:
+                    report.record(outcome, city, self.latencies.get(group))
+        return report
+
+    def summary(self) -> str:
+        return (
+            f"fetched={len(self.fetched)} failed={len(self.failed)} "
+            f"skipped={len(self.skipped)} duration={self.duration:.2f}s"
+        )
+
+
+def run_sweep(
+    cities: Iterable[Hashable],
+    process_city: Callable[[Any, float], Any],
+    concurrency: int,
+    deadline: float,
+    rate_limiter: Optional[RateLimiter] = None,
+) -> SweepReport:
+    """
+    Run process_city for every city on a bounded thread pool
+
+    Cities that cannot start before the sweep deadline are skipped rather than
+    stacked into the next sweep.
+
+    Args:
+        cities (Iterable[Hashable]): Cities, or groups of cities, to process
+        process_city (Callable[[Any, float], Any]): Called with the city and the
+            seconds left before the deadline; raising marks the city as failed
+        concurrency (int): Maximum number of cities processed at once
+        deadline (float): Sweep budget in seconds
+        rate_limiter (Optional[RateLimiter]): Limiter shared by all workers
+
+    Returns:
+        SweepReport: Per-city outcome and latency
+    """
+    report = SweepReport()
+    started = time.monotonic()
+    deadline_at = started + deadline
+
+    def worker(city: Hashable) -> None:
+        if rate_limiter is not None and not rate_limiter.acquire(deadline_at):
+            report.record('skipped', city)
+            return
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            report.record('skipped', city)
+            return
+
+        city_started = time.monotonic()
+        try:
+            process_city(city, remaining)
+        except Exception as e:
+            logger.error(f"Failed to process weather data for {city}: {str(e)}")
+            report.record('failed', city, time.monotonic() - city_started)
+        else:
+            report.record('fetched', city, time.monotonic() - city_started)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='ingest') as executor:
+        for city in cities:
+            executor.submit(worker, city)
+
+    report.duration = time.monotonic() - started
+    return report
@@ -0,0 +1,125 @@
+"""
+Latest reading per city
+
+The batch writer upserts the newest reading of every city into latest_weather
+in the same transaction as the raw insert, so current conditions for any
+number of cities are one primary-key read. Cities missing from the table,
+as in databases populated before it existed, fall back to a single
+ROW_NUMBER() query over weather_data; the migrations backfill it with
+backfill_latest_weather().
+"""
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine, Row
+from sqlalchemy.orm import Session
+from app.models import LatestWeather, WeatherData
+from app.db_utils import upsert
+
+logger = logging.getLogger(__name__)
+
+LATEST_COLUMNS = tuple(column.name for column in LatestWeather.__table__.columns)
+
+
+def _newest_per_city(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    newest: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        if row.get('timestamp') is None:
+            continue
+        current = newest.get(row['city'])
+        if current is None or row['timestamp'] >= current['timestamp']:
+            newest[row['city']] = row
+    return [{name: row.get(name) for name in LATEST_COLUMNS} for row in newest.values()]
+
+
+def update_latest_weather(session: Session, rows: List[Dict[str, Any]]) -> None:
+    """
+    Upsert the newest of rows for each city, ignoring readings older than the stored one
+
+    Runs in the caller's transaction.
+    """
+    table = LatestWeather.__table__
+    upsert(
+        session, table, _newest_per_city(rows), ['city'],
+        set_=lambda excluded: {name: excluded[name] for name in LATEST_COLUMNS if name != 'city'},
+        where=lambda excluded: excluded.timestamp >= table.c.timestamp,
+    )
+
+
+def latest_history_statement(cities: Optional[Sequence[str]] = None, exclude: Sequence[str] = ()):
+    """
+    Select the latest reading per city from weather_data with ROW_NUMBER()
+
+    Args:
+        cities (Optional[Sequence[str]]): Cities to select, or None for all
+        exclude (Sequence[str]): Cities to leave out
+    """
+    ranked = select(
+        *[WeatherData.__table__.c[name] for name in LATEST_COLUMNS],
+        func.row_number().over(partition_by=WeatherData.city, order_by=WeatherData.timestamp.desc()).label('rank'),
+    )
+    if cities is not None:
+        ranked = ranked.where(WeatherData.city.in_(cities))
+    if exclude:
+        ranked = ranked.where(WeatherData.city.notin_(exclude))
+    ranked = ranked.subquery()
+    return select(*[ranked.c[name] for name in LATEST_COLUMNS]).where(ranked.c.rank == 1)
+
+
+def get_latest_readings(bind, cities: Optional[Sequence[str]] = None) -> List[Row]:
+    """
+    Latest reading for each city, in the order of cities
+
+    Args:
+        bind: Engine to read from
+        cities (Optional[Sequence[str]]): Cities to return, or None for all
+
+    Returns:
+        List[Row]: Detached rows with the LatestWeather columns; cities without
+            readings are left out
+
+    Cities missing from latest_weather are read from weather_data. Without a
+    list of cities that means checking every city not in latest_weather.
+    """
+    statement = select(LatestWeather.__table__)
+    if cities is not None:
+        statement = statement.where(LatestWeather.city.in_(cities))
+    with bind.connect() as connection:
+        rows = connection.execute(statement).all()
+        found = {row.city for row in rows}
+        if cities is None:
+            rows += connection.execute(latest_history_statement(exclude=sorted(found))).all()
+        else:
+            missing = [city for city in cities if city not in found]
+            if missing:
+                rows += connection.execute(latest_history_statement(missing)).all()
+    if cities is None:
+        return sorted(rows, key=lambda row: row.city)
+    order = {city: position for position, city in enumerate(cities)}
+    return sorted(rows, key=lambda row: order[row.city])
+
+
+def rebuild_latest_weather(session: Session) -> int:
+    """
+    Refill latest_weather from weather_data
+
+    Returns:
+        int: Number of cities stored
+    """
+    rows = [row._asdict() for row in session.execute(latest_history_statement())]
+    session.query(LatestWeather).delete()
+    update_latest_weather(session, rows)
+    return len(rows)
+
+
+def backfill_latest_weather(engine: Engine) -> None:
+    """
+    Migration adding every city's newest stored reading to latest_weather
+
+    Rows already there are only replaced by newer readings.
+    """
+    with Session(bind=engine) as session:
+        rows = [row._asdict() for row in session.execute(latest_history_statement())]
+        update_latest_weather(session, rows)
+        session.commit()
+    logger.info(f"Backfilled latest_weather for {len(rows)} cities")
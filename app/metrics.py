@@ -0,0 +1,327 @@
+"""
+In-process metrics in the Prometheus text format
+
+Pipeline stages record latency histograms, counters and gauges here, cheap
+enough to call once per reading: a lock, a dict lookup and a bisect. The
+scheduler serves the current values at http://METRICS_HOST:METRICS_PORT/metrics
+for Prometheus to scrape.
+
+    weather_stage_seconds{stage, city}       fetch, parse, db_write, rollup, alert_eval, email_send
+    weather_stage_errors_total{stage, city}
+    weather_readings_total{outcome}          written, duplicate, failed, unchanged
+    weather_alerts_total{city}
+    weather_emails_total{outcome}            sent, retried, dropped
+    weather_sweep_cities{outcome}            fetched, failed, skipped in the last sweep
+    weather_job_seconds{job}, weather_job_runs_total{job, outcome}, weather_job_lag_seconds{job}
+    weather_upstream_breaker_state{endpoint}  0 closed, 1 half-open, 2 open
+    weather_upstream_retries_total{endpoint, reason}, weather_upstream_rejected_total{endpoint}
+    weather_upstream_hedges_total{endpoint, outcome}   sent, won
+
+plus gauges read at scrape time, such as the batch writer's buffered readings.
+
+With METRICS_PER_CITY off, stage metrics are recorded with an empty city
+label, keeping the number of series independent of the number of cities.
+"""
+import bisect
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import config
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + '}'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if labels.keys() != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{labels} {_format_value(value)}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count per label combination
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in values]
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, either set directly or read from a function at scrape time
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """
+        Read the (unlabelled) value from function whenever metrics are rendered
+        """
+        self._function = function
+
+    def value(self, **labels: str) -> float:
+        if self._function is not None:
+            return self._function()
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        if self._function is not None:
+            try:
+                return [(self.name, '', float(self._function()))]
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} could not be read: {str(e)}")
+                return []
+        with self._lock:
+            values = sorted(self._values.items())
+        return [(self.name, _format_labels(self.labelnames, key), value) for key, value in values]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'errors', 'started')
+
+    def __init__(self, histogram: 'Histogram', labels: Dict[str, str], errors: Optional[Counter]):
+        self.histogram = histogram
+        self.labels = labels
+        self.errors = errors
+
+    def __enter__(self) -> '_Timer':
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        if exc_type is not None and self.errors is not None:
+            self.errors.inc(**self.labels)
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets, with their sum and count
+    """
+
+    kind = 'histogram'
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: count per bucket (plus +Inf), sum of values
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def time(self, errors: Optional[Counter] = None, **labels: str) -> _Timer:
+        """
+        Context manager observing the seconds spent in its block, counting exceptions in errors
+        """
+        return _Timer(self, labels, errors)
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+        samples = []
+        names = self.labelnames + ('le',)
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', _format_labels(names, key + (_format_value(bound),)), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class Registry:
+    """
+    Named collection of metrics rendered together
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered differently")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram('weather_stage_seconds', 'Seconds spent per pipeline stage', ('stage', 'city'))
+STAGE_ERRORS = registry.counter('weather_stage_errors_total', 'Pipeline stage failures', ('stage', 'city'))
+READINGS = registry.counter('weather_readings_total', 'Readings by outcome', ('outcome',))
+ALERTS = registry.counter('weather_alerts_total', 'Alerts fired', ('city',))
+EMAILS = registry.counter('weather_emails_total', 'Alert email deliveries by outcome', ('outcome',))
+SWEEP_CITIES = registry.gauge('weather_sweep_cities', 'Cities per outcome in the last sweep', ('outcome',))
+JOB_SECONDS = registry.histogram('weather_job_seconds', 'Scheduled job run time', ('job',))
+JOB_RUNS = registry.counter('weather_job_runs_total', 'Scheduled job runs by outcome', ('job', 'outcome'))
+JOB_LAG = registry.gauge('weather_job_lag_seconds', 'How late the last run of a job started', ('job',))
+BREAKER_STATE = registry.gauge(
+    'weather_upstream_breaker_state', 'Circuit breaker state per endpoint: 0 closed, 1 half-open, 2 open', ('endpoint',)
+)
+UPSTREAM_RETRIES = registry.counter('weather_upstream_retries_total', 'Retried upstream requests', ('endpoint', 'reason'))
+UPSTREAM_REJECTED = registry.counter(
+    'weather_upstream_rejected_total', 'Upstream requests rejected by an open circuit breaker', ('endpoint',)
+)
+UPSTREAM_HEDGES = registry.counter('weather_upstream_hedges_total', 'Hedged upstream requests', ('endpoint', 'outcome'))
+
+
+def city_label(city: Optional[str]) -> str:
+    return (city or '') if config.METRICS_PER_CITY else ''
+
+
+def stage(name: str, city: Optional[str] = None) -> _Timer:
+    """
+    Time a pipeline stage into weather_stage_seconds, counting failures in weather_stage_errors_total
+
+        with metrics.stage('fetch', city):
+            ...
+    """
+    return STAGE_SECONDS.time(errors=STAGE_ERRORS, stage=name, city=city_label(city))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = registry
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def start_http_server(
+    port: int = config.METRICS_PORT, host: str = config.METRICS_HOST, metrics: Registry = registry
+) -> ThreadingHTTPServer:
+    """
+    Serve metrics at /metrics from a daemon thread
+
+    Returns:
+        ThreadingHTTPServer: The running server; call shutdown() to stop it
+    """
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Serving metrics at http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,132 @@
+"""
+Versioned schema migrations
+
+Importing app.models no longer creates tables. The schema is created and
+upgraded here, once per deployment:
+
+    python -m app.migrations            # apply pending migrations
+    python -m app.migrations --status   # list applied and pending migrations
+
+The scheduler applies pending migrations when it starts; the dashboard and
+tests never do. Each migration runs once and is recorded in
+schema_migrations. On PostgreSQL an advisory lock keeps processes starting
+at the same time from applying one twice.
+
+The first two migrations only create what is missing, so databases created
+before migrations existed are adopted as they are; the fourth fills the
+rollup tiers and the sixth latest_weather from the readings such databases
+already hold. A database still holding duplicate readings fails to migrate
+until python -m app.compaction has removed them. Add a migration to the end
+of MIGRATIONS for every later schema change.
+"""
+import argparse
+import logging
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Set, Tuple
+from sqlalchemy import inspect, select, text
+from sqlalchemy.engine import Engine
+from app.compaction import require_unique_index
+from app.latest_weather import backfill_latest_weather
+from app.models import RollupWatermark, SchemaMigration, create_missing_indexes, create_schema, get_engine
+from app.rollup_tiers import backfill_rollup_tiers
+
+logger = logging.getLogger(__name__)
+
+# (version, name, function applying it to the engine)
+Migration = Tuple[int, str, Callable[[Engine], None]]
+
+
+def add_rollup_watermark_gaps(engine: Engine) -> None:
+    table = RollupWatermark.__tablename__
+    if 'gaps' not in {column['name'] for column in inspect(engine).get_columns(table)}:
+        with engine.begin() as connection:
+            connection.execute(text(f'ALTER TABLE {table} ADD COLUMN gaps TEXT'))
+
+
+MIGRATIONS: List[Migration] = [
+    (1, 'create tables', create_schema),
+    (2, 'add indexes declared after their tables', create_missing_indexes),
+    (3, 'track id gaps below rollup watermarks', add_rollup_watermark_gaps),
+    (4, 'backfill rollup tiers from existing readings', backfill_rollup_tiers),
+    (5, 'require unique (city, timestamp) readings', require_unique_index),
+    (6, 'backfill latest readings per city', backfill_latest_weather),
+]
+
+# Arbitrary key of the PostgreSQL advisory lock held while migrating
+LOCK_KEY = 720_431_118
+
+
+@contextmanager
+def _migration_lock(engine: Engine):
+    if engine.dialect.name != 'postgresql':
+        yield
+        return
+    with engine.connect() as connection:
+        connection.execute(text('SELECT pg_advisory_lock(:key)'), {'key': LOCK_KEY})
+        try:
+            yield
+        finally:
+            connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': LOCK_KEY})
+            connection.commit()
+
+
+def applied_versions(engine: Engine) -> Set[int]:
+    """
+    Versions recorded in schema_migrations, empty if the table does not exist yet
+    """
+    if not inspect(engine).has_table(SchemaMigration.__tablename__):
+        return set()
+    with engine.connect() as connection:
+        return set(connection.execute(select(SchemaMigration.version)).scalars())
+
+
+def pending_migrations(engine: Engine) -> List[Migration]:
+    applied = applied_versions(engine)
+    return [migration for migration in MIGRATIONS if migration[0] not in applied]
+
+
+def migrate(engine: Optional[Engine] = None, target: Optional[int] = None) -> List[int]:
+    """
+    Apply pending migrations in version order
+
+    Args:
+        engine (Optional[Engine]): Database to migrate, defaults to DATABASE_URL
+        target (Optional[int]): Stop after this version
+
+    Returns:
+        List[int]: Versions applied
+    """
+    engine = engine or get_engine()
+    applied = []
+    with _migration_lock(engine):
+        SchemaMigration.__table__.create(bind=engine, checkfirst=True)
+        for version, name, function in pending_migrations(engine):
+            if target is not None and version > target:
+                break
+            logger.info(f"Applying migration {version}: {name}")
+            function(engine)
+            with engine.begin() as connection:
+                connection.execute(SchemaMigration.__table__.insert().values(version=version, name=name))
+            applied.append(version)
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create or upgrade the database schema")
+    parser.add_argument('--status', action='store_true', help='List applied and pending migrations without applying them')
+    parser.add_argument('--target', type=int, help='Apply migrations up to this version only')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    engine = get_engine()
+    if args.status:
+        applied = applied_versions(engine)
+        for version, name, _ in MIGRATIONS:
+            print(f"{version:>4}  {'applied' if version in applied else 'pending':<8} {name}")
+        return
+    applied = migrate(engine, args.target)
+    print(f"Applied {len(applied)} migration(s)" + (f": {', '.join(map(str, applied))}" if applied else ''))
+
+
+if __name__ == '__main__':
+    main()
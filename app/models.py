@@ -1,19 +1,26 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime
+from sqlalchemy import Column, Integer, Float, String, DateTime, Index, Text, UniqueConstraint, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 import os, sys
+import threading
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import DATABASE_URL
+from config import DATABASE_URL, PARTITION_PERIOD
 
 Base = declarative_base()
 
+HIGH_TEMPERATURE = 'high_temperature'
+
 class WeatherData(Base):
     __tablename__ = 'weather_data'
+    # Serves city = ? ORDER BY timestamp and city = ? AND timestamp ranges, read in either direction,
+    # and makes writes idempotent: one row per observation
+    __table_args__ = (Index('ix_weather_data_city_timestamp', 'city', 'timestamp', unique=True),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    city = Column(String(100), nullable=False, index=True)
+    city = Column(String(100), nullable=False)
     temperature = Column(Float, nullable=False)
     feels_like = Column(Float, nullable=False)
     weather_main = Column(String(50), nullable=False)
@@ -25,8 +32,22 @@ class WeatherData(Base):
     def __repr__(self):
         return f"<WeatherData(city='{self.city}', temp={self.temperature}°C, time={self.timestamp})>"
 
+class LatestWeather(Base):
+    """Most recent reading per city, upserted on every write."""
+    __tablename__ = 'latest_weather'
+
+    city = Column(String(100), primary_key=True)
+    temperature = Column(Float, nullable=False)
+    feels_like = Column(Float, nullable=False)
+    weather_main = Column(String(50), nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    humidity = Column(Float, nullable=True)
+    pressure = Column(Float)
+    wind_speed = Column(Float, nullable=True)
+
 class DailySummary(Base):
     __tablename__ = 'daily_summary'
+    __table_args__ = (UniqueConstraint('city', 'date', name='uq_daily_summary_city_date'),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     city = Column(String(100), nullable=False, index=True)
@@ -37,35 +58,91 @@ class DailySummary(Base):
     humidity = Column(Float, nullable=True)
     wind_speed = Column(Float, nullable=True) 
     dominant_weather = Column(String(50), nullable=False)
+    reading_count = Column(Integer, nullable=True)
 
     def __repr__(self):
         return f"<DailySummary(city='{self.city}', date={self.date.date()}, avg_temp={self.avg_temp}°C)>"
 
-def init_db():
-    """Initialize database connection and create tables."""
-    if DATABASE_URL is None:
-        raise ValueError("DATABASE_URL is not set in the environment variables")
-    
-    engine = create_engine(
-        DATABASE_URL,
-        pool_size=5,
-        max_overflow=10,
-        pool_pre_ping=True
-    )
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    Base.metadata.create_all(bind=engine)
-    return engine, SessionLocal
+class DailyConditionRollup(Base):
+    """Running aggregates per city, day and weather condition, feeding DailySummary."""
+    __tablename__ = 'daily_condition_rollup'
+    __table_args__ = (UniqueConstraint('city', 'date', 'weather_main', name='uq_daily_condition_rollup'),)
 
-# Initialize database connection
-engine, SessionLocal = init_db()
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    city = Column(String(100), nullable=False)
+    date = Column(DateTime, nullable=False)
+    weather_main = Column(String(50), nullable=False)
+    reading_count = Column(Integer, nullable=False, default=0)
+    temp_sum = Column(Float, nullable=False, default=0)
+    temp_min = Column(Float, nullable=False)
+    temp_max = Column(Float, nullable=False)
+    humidity_sum = Column(Float, nullable=False, default=0)
+    humidity_count = Column(Integer, nullable=False, default=0)
+    wind_speed_sum = Column(Float, nullable=False, default=0)
+    wind_speed_count = Column(Integer, nullable=False, default=0)
 
-def get_db():
-    """Dependency to get database session."""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+class RollupWatermark(Base):
+    """Highest weather_data id already folded into a rollup, and the ids below it not seen yet."""
+    __tablename__ = 'rollup_watermarks'
+
+    name = Column(String(50), primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    # JSON list of [first_id, last_id, first_seen] id ranges below last_id that were missing when folded
+    gaps = Column(Text)
+
+class WorkerLease(Base):
+    """Heartbeat of a sharded ingestion worker; workers with a live lease split the cities."""
+    __tablename__ = 'worker_leases'
+
+    worker_id = Column(String(100), primary_key=True)
+    hostname = Column(String(100))
+    started_at = Column(DateTime, default=datetime.now)
+    heartbeat = Column(DateTime, nullable=False, index=True)
+
+class DataVersion(Base):
+    """Counter bumped by every write the dashboard reads, used to invalidate its query cache."""
+    __tablename__ = 'data_versions'
+
+    name = Column(String(50), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.now)
+
+class SchemaMigration(Base):
+    """Schema migration applied by app.migrations."""
+    __tablename__ = 'schema_migrations'
+
+    version = Column(Integer, primary_key=True, autoincrement=False)
+    name = Column(String(100), nullable=False)
+    applied_at = Column(DateTime, default=datetime.now)
+
+class WeatherRollupColumns:
+    """Per-city, per-bucket aggregates shared by the downsampled rollup tiers."""
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    city = Column(String(100), nullable=False)
+    bucket_start = Column(DateTime, nullable=False)
+    reading_count = Column(Integer, nullable=False, default=0)
+    temperature_sum = Column(Float, nullable=False, default=0)
+    temperature_min = Column(Float, nullable=False)
+    temperature_max = Column(Float, nullable=False)
+    feels_like_sum = Column(Float, nullable=False, default=0)
+    feels_like_min = Column(Float, nullable=False)
+    feels_like_max = Column(Float, nullable=False)
+    humidity_sum = Column(Float, nullable=False, default=0)
+    humidity_count = Column(Integer, nullable=False, default=0)
+    humidity_min = Column(Float, nullable=True)
+    humidity_max = Column(Float, nullable=True)
+    wind_speed_sum = Column(Float, nullable=False, default=0)
+    wind_speed_count = Column(Integer, nullable=False, default=0)
+    wind_speed_min = Column(Float, nullable=True)
+    wind_speed_max = Column(Float, nullable=True)
+
+class WeatherRollup15m(WeatherRollupColumns, Base):
+    __tablename__ = 'weather_rollup_15m'
+    __table_args__ = (UniqueConstraint('city', 'bucket_start', name='uq_weather_rollup_15m_city_bucket'),)
+
+class WeatherRollupHourly(WeatherRollupColumns, Base):
+    __tablename__ = 'weather_rollup_hourly'
+    __table_args__ = (UniqueConstraint('city', 'bucket_start', name='uq_weather_rollup_hourly_city_bucket'),)
 
 class AlertConfig(Base):
     __tablename__ = 'alert_configs'
@@ -74,11 +151,20 @@ class AlertConfig(Base):
     email = Column(String(100), nullable=False)
     temp_threshold = Column(Float, nullable=False)
     consecutive_readings = Column(Integer, default=2)
-    created_at = Column(DateTime, default=datetime)
-    updated_at = Column(DateTime, default=datetime, onupdate=datetime)
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 class WeatherAlert(Base):
     __tablename__ = 'weather_alerts'
+    __table_args__ = (
+        Index('ix_weather_alerts_timestamp', 'timestamp'),
+        # The dashboard only lists temperature alerts, newest first per city
+        Index(
+            'ix_weather_alerts_high_temperature_city_timestamp', 'city', 'timestamp',
+            postgresql_where=text(f"alert_type = '{HIGH_TEMPERATURE}'"),
+            sqlite_where=text(f"alert_type = '{HIGH_TEMPERATURE}'"),
+        ),
+    )
     
     id = Column(Integer, primary_key=True)
     city = Column(String(50), nullable=False)
@@ -86,4 +172,89 @@ class WeatherAlert(Base):
     message = Column(String(200), nullable=False)
     temperature = Column(Float)
     consecutive_count = Column(Integer)
-    timestamp = Column(DateTime, default=datetime)
+    timestamp = Column(DateTime, default=datetime.now)
+
+class LazySessionmaker(sessionmaker):
+    """sessionmaker that creates the engine when the first session is opened"""
+
+    def __call__(self, **local_kw):
+        if self.kw.get('bind') is None and 'bind' not in local_kw:
+            get_engine()
+        return super().__call__(**local_kw)
+
+# Bound to the engine by get_engine(); importing this module does not touch the database
+SessionLocal = LazySessionmaker(autocommit=False, autoflush=False)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    The process-wide pooled engine, created on first use
+
+    Only connects; the schema is created and upgraded by app.migrations.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                if DATABASE_URL is None:
+                    raise ValueError("DATABASE_URL is not set in the environment variables")
+                _engine = create_engine(
+                    DATABASE_URL,
+                    pool_size=5,
+                    max_overflow=10,
+                    pool_pre_ping=True
+                )
+                SessionLocal.configure(bind=_engine)
+    return _engine
+
+def create_schema(engine):
+    """Create every table that does not exist yet, partitioning weather_data when enabled."""
+    if PARTITION_PERIOD:
+        from app.partitioning import create_partitioned_table
+        weather_table = Base.metadata.tables['weather_data']
+        create_partitioned_table(engine, weather_table)
+        Base.metadata.create_all(bind=engine, tables=[
+            table for table in Base.metadata.sorted_tables if table is not weather_table
+        ])
+    else:
+        Base.metadata.create_all(bind=engine)
+
+def create_missing_indexes(engine):
+    """
+    Add indexes declared on the models to tables created before them
+
+    Raises:
+        RuntimeError: If duplicate rows prevent a unique index; the migration
+            is then not recorded and runs again once they are removed
+    """
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                try:
+                    index.create(bind=engine)
+                except IntegrityError as e:
+                    raise RuntimeError(
+                        f"Duplicate rows in {table.name} prevent creating {index.name}; "
+                        "run python -m app.compaction to remove them"
+                    ) from e
+
+def __getattr__(name):
+    # `from app.models import engine` still works, creating the engine at that point
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def get_db():
+    """Dependency to get database session."""
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
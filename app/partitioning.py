@@ -0,0 +1,308 @@
+"""
+Time-partitioned storage for weather_data
+
+With PARTITION_PERIOD set to 'day' or 'week', weather_data is split into one
+table per period so retention can drop whole partitions instead of deleting
+rows:
+
+- PostgreSQL uses native declarative partitioning: weather_data is a table
+  PARTITIONED BY RANGE (timestamp) with weather_data_pYYYYMMDD partitions.
+- SQLite has no partitioning, so each period is a plain weather_data_pYYYYMMDD
+  table and weather_data is a UNION ALL view over them. Writes are routed to
+  the partition tables and ids come from a shared sequence table so they stay
+  unique and increasing across partitions.
+
+This module only depends on the table objects it is given, so app.models can
+call it while it is still being imported.
+"""
+import logging
+import re
+import threading
+from datetime import datetime, time, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import MetaData, PrimaryKeyConstraint, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import CreateIndex, CreateTable
+import config
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('day', 'week')
+TEMPLATE_SUFFIX = '_template'
+SEQUENCE_SUFFIX = '_id_seq'
+
+_partition_metadata = MetaData()
+_known_partitions = set()
+_partitioned: Dict[Tuple[Engine, str], bool] = {}
+_lock = threading.Lock()
+
+
+def partitioning_enabled() -> bool:
+    return config.PARTITION_PERIOD in PERIODS
+
+
+def period_start(timestamp: datetime, period: Optional[str] = None) -> datetime:
+    """Start of the partition period containing timestamp."""
+    period = period or config.PARTITION_PERIOD
+    start = datetime.combine(timestamp.date(), time.min)
+    if period == 'week':
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def period_end(start: datetime, period: Optional[str] = None) -> datetime:
+    period = period or config.PARTITION_PERIOD
+    return start + timedelta(days=7 if period == 'week' else 1)
+
+
+def partition_name(parent_name: str, start: datetime) -> str:
+    return f"{parent_name}_p{start:%Y%m%d}"
+
+
+def list_partitions(bind, parent_name: str) -> Dict[str, datetime]:
+    """
+    Existing partitions of parent_name, keyed by table name
+
+    Returns:
+        Dict[str, datetime]: Partition table name to the start of its period
+    """
+    pattern = re.compile(rf"^{re.escape(parent_name)}_p(\d{{8}})$")
+    partitions = {}
+    for name in inspect(bind).get_table_names():
+        match = pattern.match(name)
+        if match:
+            partitions[name] = datetime.strptime(match.group(1), '%Y%m%d')
+    return partitions
+
+
+def _rename_schema_items(table: Table, old: str, new: str) -> None:
+    for item in list(table.indexes) + list(table.constraints):
+        if item.name and old in item.name and new not in item.name:
+            item.name = item.name.replace(old, new, 1)
+
+
+def partition_table(parent: Table, start: datetime) -> Table:
+    """
+    Table object for a SQLite partition, with the parent's columns and indexes
+    """
+    name = partition_name(parent.name, start)
+    with _lock:
+        table = _partition_metadata.tables.get(name)
+        if table is None:
+            table = parent.to_metadata(_partition_metadata, name=name)
+            _rename_schema_items(table, parent.name, name)
+        return table
+
+
+def _template_table(parent: Table) -> Table:
+    name = parent.name + TEMPLATE_SUFFIX
+    with _lock:
+        table = _partition_metadata.tables.get(name)
+        if table is None:
+            table = parent.to_metadata(_partition_metadata, name=name)
+            _rename_schema_items(table, parent.name, name)
+        return table
+
+
+def _postgresql_parent(parent: Table) -> Table:
+    # Primary keys and unique constraints on a partitioned table must include the partition key
+    table = parent.to_metadata(MetaData())
+    table.c.timestamp.primary_key = True
+    table.append_constraint(PrimaryKeyConstraint(table.c.id, table.c.timestamp))
+    table.dialect_kwargs['postgresql_partition_by'] = 'RANGE (timestamp)'
+    return table
+
+
+def _rebuild_sqlite_view(connection: Connection, parent: Table, exclude: Iterable[str] = ()) -> None:
+    columns = ', '.join(f'"{column.name}"' for column in parent.columns)
+    partitions = set(list_partitions(connection, parent.name)) - set(exclude)
+    sources = [parent.name + TEMPLATE_SUFFIX] + sorted(partitions)
+    body = '\nUNION ALL\n'.join(f'SELECT {columns} FROM "{source}"' for source in sources)
+    connection.execute(text(f'DROP VIEW IF EXISTS "{parent.name}"'))
+    connection.execute(text(f'CREATE VIEW "{parent.name}" AS\n{body}'))
+
+
+def create_partitioned_table(engine: Engine, parent: Table) -> None:
+    """
+    Create the partitioned parent (PostgreSQL) or template, sequence and view (SQLite)
+    """
+    dialect = engine.dialect.name
+    _partitioned.pop((engine, parent.name), None)
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        if dialect == 'postgresql':
+            if inspector.has_table(parent.name):
+                row = connection.execute(
+                    text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = CAST(:name AS regclass)"),
+                    {'name': parent.name},
+                ).first()
+                if row is None:
+                    logger.warning(
+                        f"{parent.name} already exists and is not partitioned; "
+                        "retention will fall back to chunked deletes"
+                    )
+                return
+            table = _postgresql_parent(parent)
+            connection.execute(CreateTable(table))
+            for index in table.indexes:
+                connection.execute(CreateIndex(index))
+        elif dialect == 'sqlite':
+            if parent.name in inspector.get_table_names():
+                logger.warning(
+                    f"{parent.name} already exists as a table; "
+                    "retention will fall back to chunked deletes"
+                )
+                return
+            _template_table(parent).create(connection, checkfirst=True)
+            connection.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{parent.name}{SEQUENCE_SUFFIX}" '
+                '(id INTEGER PRIMARY KEY CHECK (id = 1), value INTEGER NOT NULL)'
+            ))
+            connection.execute(text(
+                f'INSERT OR IGNORE INTO "{parent.name}{SEQUENCE_SUFFIX}" (id, value) VALUES (1, 0)'
+            ))
+            _rebuild_sqlite_view(connection, parent)
+        else:
+            raise NotImplementedError(f"Partitioned storage is not supported on {dialect}")
+
+
+def is_partitioned(engine: Engine, parent: Table) -> bool:
+    """Whether parent is actually stored partitioned in this database."""
+    if not partitioning_enabled():
+        return False
+    key = (engine, parent.name)
+    if key not in _partitioned:
+        dialect = engine.dialect.name
+        if dialect == 'sqlite':
+            _partitioned[key] = parent.name in inspect(engine).get_view_names()
+        elif dialect == 'postgresql':
+            with engine.connect() as connection:
+                _partitioned[key] = connection.execute(
+                    text("SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+                         "WHERE c.relname = :name"),
+                    {'name': parent.name},
+                ).first() is not None
+        else:
+            _partitioned[key] = False
+    return _partitioned[key]
+
+
+def ensure_partitions(engine: Engine, parent: Table, starts: Iterable[datetime]) -> None:
+    """
+    Create any missing partitions for the given period starts
+    """
+    dialect = engine.dialect.name
+    missing = [
+        start for start in set(starts)
+        if (engine, partition_name(parent.name, start)) not in _known_partitions
+    ]
+    if not missing:
+        return
+
+    with engine.begin() as connection:
+        existing = list_partitions(connection, parent.name)
+        created = False
+        for start in sorted(missing):
+            name = partition_name(parent.name, start)
+            if name not in existing:
+                if dialect == 'postgresql':
+                    connection.execute(text(
+                        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{parent.name}" '
+                        f"FOR VALUES FROM ('{start.isoformat(' ')}') TO ('{period_end(start).isoformat(' ')}')"
+                    ))
+                else:
+                    partition_table(parent, start).create(connection, checkfirst=True)
+                created = True
+                logger.info(f"Created partition {name}")
+        if created and dialect == 'sqlite':
+            _rebuild_sqlite_view(connection, parent)
+
+    for start in missing:
+        _known_partitions.add((engine, partition_name(parent.name, start)))
+
+
+def allocate_ids(session, parent: Table, count: int) -> range:
+    """
+    Reserve count ids from the SQLite sequence table
+
+    Runs inside the caller's transaction so the write lock serialises
+    allocation across processes.
+    """
+    end = session.execute(
+        text(f'UPDATE "{parent.name}{SEQUENCE_SUFFIX}" SET value = value + :count WHERE id = 1 RETURNING value'),
+        {'count': count},
+    ).scalar_one()
+    return range(end - count + 1, end + 1)
+
+
+def route_rows(session, parent: Table, rows: List[Dict[str, Any]]) -> List[Tuple[Table, List[Dict[str, Any]]]]:
+    """
+    Split rows into (target table, rows) pairs for insertion
+
+    Partitions are created on demand. On PostgreSQL rows go to the parent and
+    the database routes them; on SQLite they are assigned ids and grouped by
+    partition table.
+    """
+    engine = session.get_bind()
+    if not is_partitioned(engine, parent):
+        return [(parent, rows)]
+
+    by_start: Dict[datetime, List[Dict[str, Any]]] = {}
+    unroutable = []
+    for row in rows:
+        if row.get('timestamp') is None:
+            # Let the insert fail with a database error like any other bad row
+            unroutable.append(row)
+        else:
+            by_start.setdefault(period_start(row['timestamp']), []).append(row)
+    ensure_partitions(engine, parent, by_start)
+    if engine.dialect.name == 'postgresql':
+        return [(parent, rows)]
+
+    ids = iter(allocate_ids(session, parent, len(rows) - len(unroutable)))
+    routed = [(parent, unroutable)] if unroutable else []
+    for start, partition_rows in sorted(by_start.items()):
+        routed.append((partition_table(parent, start), [dict(row, id=next(ids)) for row in partition_rows]))
+    return routed
+
+
+def drop_partitions_before(engine: Engine, parent: Table, cutoff: datetime) -> List[str]:
+    """
+    Drop every partition whose period ends at or before cutoff
+
+    Returns:
+        List[str]: Names of the dropped partitions
+    """
+    if not is_partitioned(engine, parent):
+        return []
+
+    with engine.begin() as connection:
+        expired = [
+            name for name, start in list_partitions(connection, parent.name).items()
+            if period_end(start) <= cutoff
+        ]
+        if not expired:
+            return []
+        if engine.dialect.name == 'sqlite':
+            # Take the partitions out of the view before dropping them
+            _rebuild_sqlite_view(connection, parent, exclude=expired)
+        for name in sorted(expired):
+            connection.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+            _known_partitions.discard((engine, name))
+            logger.info(f"Dropped expired partition {name}")
+    return expired
+
+
+def deletable_tables(engine: Engine, parent: Table, before: datetime) -> List[Table]:
+    """
+    Tables holding rows older than before, for chunked deletes
+
+    SQLite partitions are deleted from directly since the view is read-only.
+    """
+    if engine.dialect.name != 'sqlite' or not is_partitioned(engine, parent):
+        return [parent]
+    return [
+        partition_table(parent, start)
+        for start in sorted(list_partitions(engine, parent.name).values())
+        if start < before
+    ]
@@ -0,0 +1,189 @@
+"""
+Adaptive per-city polling
+
+OpenWeatherMap refreshes a city's current weather only every few minutes
+(about ten for most stations, much less often for some), so polling every
+city on the scheduler's fixed tick mostly fetches observations already
+stored. The poller learns each city's refresh interval from the observation
+times (`dt`) it is shown and schedules the next poll POLL_GRACE seconds
+after the next update is expected. A poll that finds no new observation is
+retried after POLL_RETRY_INTERVAL seconds, doubling up to POLL_MAX_INTERVAL,
+and failing cities back off the same way. Cities whose last temperature is
+within POLL_PRIORITY_MARGIN of TEMP_THRESHOLD are retried sooner, so an
+update that may raise an alert is not picked up late.
+"""
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Iterable, List, Optional
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class CityPollState:
+    """
+    What the poller knows about one city's upstream updates
+    """
+
+    __slots__ = ('last_observed', 'intervals', 'next_poll', 'misses', 'failures', 'temperature', 'priority')
+
+    def __init__(self, history: int):
+        self.last_observed: Optional[float] = None
+        self.intervals: Deque[float] = deque(maxlen=history)
+        self.next_poll = 0.0
+        self.misses = 0
+        self.failures = 0
+        self.temperature: Optional[float] = None
+        self.priority: Optional[float] = None
+
+
+class AdaptivePoller:
+    """
+    Decide which cities to poll now, from each city's learned update interval
+
+    Args:
+        default_interval (float): Assumed seconds between updates until two have been seen
+        grace (float): Seconds after the expected update before polling
+        retry_interval (float): First delay after a poll without a new observation or a failure
+        max_interval (float): Longest delay between polls of a city
+        priority_margin (float): °C below TEMP_THRESHOLD at which a city is prioritised
+        priority_factor (float): Multiplier (< 1) for the retry delays of prioritised cities
+        history (int): Update intervals kept per city; the median is used
+        clock (Callable[[], float]): Wall-clock time source, comparable with observation times
+    """
+
+    def __init__(
+        self,
+        default_interval: float = config.RAW_SAMPLE_INTERVAL,
+        grace: float = config.POLL_GRACE,
+        retry_interval: float = config.POLL_RETRY_INTERVAL,
+        max_interval: float = config.POLL_MAX_INTERVAL,
+        priority_margin: float = config.POLL_PRIORITY_MARGIN,
+        priority_factor: float = config.POLL_PRIORITY_FACTOR,
+        history: int = 8,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.default_interval = default_interval
+        self.grace = grace
+        self.retry_interval = retry_interval
+        self.max_interval = max_interval
+        self.priority_margin = priority_margin
+        self.priority_factor = priority_factor
+        self.history = history
+        self.clock = clock
+        self._states: Dict[str, CityPollState] = {}
+        self._lock = threading.Lock()
+        self.polls = 0
+        self.fresh = 0
+        self.stale = 0
+        self.failed = 0
+
+    def _state(self, city: str) -> CityPollState:
+        state = self._states.get(city)
+        if state is None:
+            state = self._states[city] = CityPollState(self.history)
+        return state
+
+    def interval(self, city: str) -> float:
+        """
+        Learned seconds between a city's upstream updates
+        """
+        with self._lock:
+            state = self._states.get(city)
+            return self._interval(state) if state is not None else self.default_interval
+
+    def _interval(self, state: CityPollState) -> float:
+        if not state.intervals:
+            return self.default_interval
+        return min(self.max_interval, max(self.retry_interval, statistics.median(state.intervals)))
+
+    def _factor(self, state: CityPollState) -> float:
+        if state.priority is not None:
+            return state.priority
+        if state.temperature is not None and state.temperature >= config.TEMP_THRESHOLD - self.priority_margin:
+            return self.priority_factor
+        return 1.0
+
+    def _backoff(self, state: CityPollState, attempts: int) -> float:
+        return min(self.max_interval, self.retry_interval * 2 ** max(0, attempts - 1)) * self._factor(state)
+
+    def set_priority(self, city: str, factor: Optional[float]) -> None:
+        """
+        Scale a city's retry delays by factor (< 1 polls it more eagerly); None restores the default
+        """
+        with self._lock:
+            state = self._state(city)
+            state.priority = factor
+            state.next_poll = min(state.next_poll, self.clock() + self._backoff(state, 1))
+
+    def due(self, cities: Iterable[str], now: Optional[float] = None) -> List[str]:
+        """
+        Cities whose next poll is due, unknown cities included
+        """
+        now = self.clock() if now is None else now
+        with self._lock:
+            due = [city for city in cities if city not in self._states or self._states[city].next_poll <= now]
+            self.polls += len(due)
+            return due
+
+    def prime(self, city: str, observed: Iterable[datetime], temperature: Optional[float] = None) -> None:
+        """
+        Seed a city's interval and next poll from observation times already stored, oldest first
+        """
+        for observed_at in observed:
+            self.observe(city, observed_at, temperature, count=False)
+
+    def observe(
+        self, city: str, observed_at: datetime, temperature: Optional[float] = None, count: bool = True
+    ) -> bool:
+        """
+        Record the observation time a poll returned and schedule the city's next poll
+
+        Returns:
+            bool: True if the observation is newer than the last one seen
+        """
+        observed = observed_at.timestamp()
+        now = self.clock()
+        with self._lock:
+            state = self._state(city)
+            state.failures = 0
+            if temperature is not None:
+                state.temperature = temperature
+            if state.last_observed is not None and observed <= state.last_observed:
+                state.misses += 1
+                state.next_poll = now + self._backoff(state, state.misses)
+                self.stale += count
+                return False
+
+            if state.last_observed is not None:
+                state.intervals.append(observed - state.last_observed)
+            state.last_observed = observed
+            state.misses = 0
+            expected = observed + self._interval(state) + self.grace
+            # If the expected update has already passed, check again after the retry delay
+            state.next_poll = expected if expected > now else now + self._backoff(state, 1)
+            self.fresh += count
+            return True
+
+    def failure(self, city: str) -> None:
+        """
+        Back off a city whose poll failed
+        """
+        now = self.clock()
+        with self._lock:
+            state = self._state(city)
+            state.failures += 1
+            state.next_poll = now + self._backoff(state, state.failures)
+            self.failed += 1
+
+    def next_poll(self, city: str) -> Optional[datetime]:
+        with self._lock:
+            state = self._states.get(city)
+            return datetime.fromtimestamp(state.next_poll) if state is not None else None
+
+    def stats(self) -> Dict[str, int]:
+        return {'polls': self.polls, 'fresh': self.fresh, 'stale': self.stale, 'failed': self.failed}
@@ -0,0 +1,149 @@
+"""
+Columnar read path for the dashboard
+
+Queries select only the columns they need and stream the result straight into
+pandas columns, so no ORM objects are built and unit conversion runs once
+over each column instead of once per value.
+
+    python -m benchmarks.bench_dashboard_history
+
+compares this path with the ORM one.
+"""
+from datetime import datetime
+from typing import TYPE_CHECKING, List, Optional, Sequence
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine, Row
+from app.models import HIGH_TEMPERATURE, DailySummary, WeatherAlert, WeatherData
+from app.rollup_tiers import FIELDS, NULLABLE_FIELDS, RAW, TIERS
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+HISTORY_CHUNK_SIZE = 50000
+
+TEMPERATURE_COLUMNS = (
+    'temperature', 'temperature_min', 'temperature_max',
+    'feels_like', 'feels_like_min', 'feels_like_max',
+)
+
+
+def read_frame(engine: Engine, statement, chunksize: int = HISTORY_CHUNK_SIZE) -> 'pd.DataFrame':
+    """
+    Run a Core select and load it into a DataFrame in chunks
+
+    yield_per makes the result stream from a server-side cursor where the
+    driver has one (psycopg2), so at most chunksize rows are buffered before
+    each block is turned into columns.
+    """
+    import pandas as pd
+
+    frames = []
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=chunksize).execute(statement)
+        columns = list(result.keys())
+        with result:
+            for rows in result.partitions():
+                frames.append(pd.DataFrame.from_records(rows, columns=columns))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def history_statement(start: datetime, city: Optional[str] = None, tier: str = RAW):
+    """
+    Column-projected select of the history for one city or all cities
+
+    Rollup tiers return the per-bucket mean under the raw column names plus
+    <field>_min/<field>_max columns, and reading_count and <field>_count
+    columns to weight the means by when combining buckets.
+    """
+    if tier == RAW:
+        columns = [WeatherData.timestamp, WeatherData.city, WeatherData.pressure]
+        columns += [getattr(WeatherData, field) for field in FIELDS]
+        statement = select(*columns).where(WeatherData.timestamp >= start)
+        if city is not None:
+            statement = statement.where(WeatherData.city == city)
+        return statement.order_by(WeatherData.timestamp.asc())
+
+    model, _ = TIERS[tier]
+    columns = [model.bucket_start.label('timestamp'), model.city, model.reading_count]
+    for field in FIELDS:
+        count = getattr(model, f'{field}_count') if field in NULLABLE_FIELDS else model.reading_count
+        columns += [
+            (getattr(model, f'{field}_sum') / func.nullif(count, 0)).label(field),
+            getattr(model, f'{field}_min'),
+            getattr(model, f'{field}_max'),
+            count.label(f'{field}_count'),
+        ]
+    statement = select(*columns).where(model.bucket_start >= start)
+    if city is not None:
+        statement = statement.where(model.city == city)
+    return statement.order_by(model.bucket_start.asc())
+
+
+def load_history(engine: Engine, start: datetime, city: Optional[str] = None, tier: str = RAW) -> 'pd.DataFrame':
+    """
+    Load the history since start as a DataFrame
+
+    Args:
+        engine (Engine): Engine to read from
+        start (datetime): Oldest timestamp to include
+        city (Optional[str]): City to load, or None for all cities
+        tier (str): RAW or a key of rollup_tiers.TIERS
+
+    Returns:
+        pd.DataFrame: One row per reading (or bucket), ordered by time, in °C
+    """
+    import pandas as pd
+
+    df = read_frame(engine, history_statement(start, city, tier))
+    # SQLite hands back ISO strings; parse the whole column at once
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    df['city'] = df['city'].astype('category')
+    return df
+
+
+def latest_summaries(engine: Engine, cities: Sequence[str]) -> List[Row]:
+    """
+    Most recent daily summary per city in one query, skipping cities without one
+    """
+    ranked = select(
+        DailySummary.__table__,
+        func.row_number().over(partition_by=DailySummary.city, order_by=DailySummary.date.desc()).label('rank'),
+    ).where(DailySummary.city.in_(cities)).subquery()
+    columns = [ranked.c[column.name] for column in DailySummary.__table__.columns]
+    with engine.connect() as connection:
+        rows = connection.execute(select(*columns).where(ranked.c.rank == 1)).all()
+    order = {city: position for position, city in enumerate(cities)}
+    return sorted(rows, key=lambda row: order[row.city])
+
+
+def recent_alerts_statement(threshold: float, city: Optional[str] = None, limit: int = 5):
+    """
+    Latest temperature alerts at or above threshold, for one city or all cities
+    """
+    statement = select(WeatherAlert.__table__).where(
+        WeatherAlert.alert_type == HIGH_TEMPERATURE,
+        WeatherAlert.temperature >= threshold,
+    )
+    if city is not None:
+        statement = statement.where(WeatherAlert.city == city)
+    return statement.order_by(WeatherAlert.timestamp.desc()).limit(limit)
+
+
+def recent_alerts(engine: Engine, threshold: float, city: Optional[str] = None, limit: int = 5) -> List[Row]:
+    with engine.connect() as connection:
+        return connection.execute(recent_alerts_statement(threshold, city, limit)).all()
+
+
+def convert_temperature_columns(df: 'pd.DataFrame', unit: str, columns: List[str] = TEMPERATURE_COLUMNS) -> 'pd.DataFrame':
+    """
+    Return a copy of df with its temperature columns converted to unit
+    """
+    if unit != 'Fahrenheit':
+        return df
+    df = df.copy()
+    for column in columns:
+        if column in df:
+            df[column] = df[column] * 9 / 5 + 32
+    return df
@@ -0,0 +1,163 @@
+"""
+Shared cache for dashboard query results
+
+Results are cached per key (city, window, tier, ...) together with the current
+data version, a counter the writers bump in the same transaction as every
+reading, summary or alert they store. Once a newer version is seen, every
+cached result is dropped; until then results live for the TTL, so reruns that
+only change the unit or the layout do not touch the database.
+
+Sharded workers each bump their own row (see use_worker_data_version) and
+readers add them up, so flushes from different workers never queue behind
+one row lock.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+from sqlalchemy import func, or_, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app.models import DataVersion
+from app.db_utils import upsert
+import config
+
+logger = logging.getLogger(__name__)
+
+DATA_VERSION = 'weather_data'
+
+# Row this process bumps for DATA_VERSION
+_worker_version = DATA_VERSION
+
+
+def use_worker_data_version(worker_id: str) -> None:
+    """
+    Make this process bump its own DATA_VERSION row, named after worker_id
+    """
+    global _worker_version
+    _worker_version = f'{DATA_VERSION}:{worker_id}'
+
+
+def bump_data_version(session: Session, name: str = DATA_VERSION) -> None:
+    """
+    Increment a data version inside the caller's transaction
+    """
+    if name == DATA_VERSION:
+        name = _worker_version
+    table = DataVersion.__table__
+    upsert(session, table, [{'name': name, 'version': 1, 'updated_at': datetime.now()}], ['name'],
+           set_=lambda excluded: {'version': table.c.version + 1, 'updated_at': excluded.updated_at})
+
+
+def read_data_version(engine: Engine, name: str = DATA_VERSION) -> int:
+    """
+    Sum of a data version over the shared row and every worker's own row
+    """
+    statement = select(func.sum(DataVersion.version)).where(
+        or_(DataVersion.name == name, DataVersion.name.startswith(f'{name}:', autoescape=True))
+    )
+    with engine.connect() as connection:
+        return connection.scalar(statement) or 0
+
+
+class QueryCache:
+    """
+    LRU cache with a TTL, invalidated whenever the data version changes
+
+    The data version is read at most once per version_check_interval seconds.
+    Concurrent callers asking for the same missing key wait for a single load
+    instead of each running the query. Cached values are shared between
+    callers and must not be modified.
+    """
+
+    def __init__(
+        self,
+        version_source: Callable[[], int],
+        ttl: float = config.DASHBOARD_CACHE_TTL,
+        max_entries: int = config.DASHBOARD_CACHE_SIZE,
+        version_check_interval: float = config.DATA_VERSION_CHECK_INTERVAL,
+    ):
+        self.version_source = version_source
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_check_interval = version_check_interval
+        self._entries: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self._loading: Dict[Hashable, threading.Lock] = {}
+        self._version: Optional[int] = None
+        self._version_checked = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self) -> Optional[int]:
+        """
+        Current data version, clearing the cache when it has moved on
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._version is not None and now - self._version_checked < self.version_check_interval:
+                return self._version
+        version = self.version_source()
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    logger.debug(f"Data version {self._version} -> {version}, dropping {len(self._entries)} cached results")
+                self._entries.clear()
+                self._version = version
+            self._version_checked = now
+            return version
+
+    def _lookup(self, key: Hashable) -> Tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            return False, None
+        self._entries.move_to_end(key)
+        return True, entry[1]
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Return the cached value for key, running loader on a miss
+
+        Args:
+            key (Hashable): Cache key, e.g. ('history', city, days, tier)
+            loader (Callable[[], Any]): Runs the query
+
+        Returns:
+            Any: The cached or freshly loaded value
+        """
+        key = (key, self.version())
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                found, value = self._lookup(key)
+                if found:
+                    self.hits += 1
+                    return value
+                self.misses += 1
+            try:
+                value = loader()
+                with self._lock:
+                    self._entries[key] = (time.monotonic(), value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+        return value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
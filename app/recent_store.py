@@ -0,0 +1,371 @@
+"""
+In-process store of recent readings
+
+Each city gets preallocated NumPy ring buffers sized for RECENT_STORE_HOURS
+of readings at RAW_SAMPLE_INTERVAL: int64 timestamps, a float32 column per
+measurement and a small integer code per weather condition. Memory is fixed
+per city (about 3.7 KiB for 24 hours at ten-minute readings), so thousands of
+cities fit in tens of megabytes, and the latest readings, windows and window
+aggregates are answered without touching the database.
+
+The store is fed by the batch writer after each commit and cold-started from
+weather_data with load(); refresh() catches a reader process such as the
+dashboard up with readings written by the scheduler. A city observed more
+often than RAW_SAMPLE_INTERVAL wraps its buffer in less than
+RECENT_STORE_HOURS; covers() tells whether a window is still fully held, so
+callers can read it from the database instead.
+"""
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from app.models import WeatherData
+import config
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+RECENT_FIELDS = ('temperature', 'feels_like', 'humidity', 'wind_speed')
+
+
+def default_capacity() -> int:
+    return max(1, math.ceil(config.RECENT_STORE_HOURS * 3600 / config.RAW_SAMPLE_INTERVAL))
+
+
+def _stamp(timestamp: datetime) -> int:
+    return int(np.datetime64(timestamp, 's').astype(np.int64))
+
+
+class RecentReading:
+    """
+    Read-only view of one stored reading, with the attributes of a LatestWeather row
+    """
+
+    __slots__ = ('city', 'timestamp', 'temperature', 'feels_like', 'humidity', 'wind_speed', 'weather_main')
+
+    def __init__(self, city, timestamp, temperature, feels_like, humidity, wind_speed, weather_main):
+        self.city = city
+        self.timestamp = timestamp
+        self.temperature = temperature
+        self.feels_like = feels_like
+        self.humidity = humidity
+        self.wind_speed = wind_speed
+        self.weather_main = weather_main
+
+    def __repr__(self):
+        return f"<RecentReading(city='{self.city}', temp={self.temperature}°C, time={self.timestamp})>"
+
+
+class _CityBuffer:
+    __slots__ = ('stamps', 'values', 'conditions', 'head', 'count')
+
+    def __init__(self, capacity: int):
+        self.stamps = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((capacity, len(RECENT_FIELDS)), np.nan, dtype=np.float32)
+        self.conditions = np.zeros(capacity, dtype=np.uint16)
+        self.head = 0
+        self.count = 0
+
+    @property
+    def last_stamp(self) -> Optional[int]:
+        return int(self.stamps[self.head - 1]) if self.count else None
+
+    def order(self, n: Optional[int] = None) -> np.ndarray:
+        """Buffer positions of the newest n readings (default all), oldest first."""
+        n = self.count if n is None else min(n, self.count)
+        capacity = len(self.stamps)
+        return (self.head - n + np.arange(n)) % capacity
+
+    def extend(self, stamps: np.ndarray, values: np.ndarray, conditions: np.ndarray) -> int:
+        # Only readings newer than the last one stored are kept, oldest first
+        if self.count:
+            newer = stamps > self.last_stamp
+            stamps, values, conditions = stamps[newer], values[newer], conditions[newer]
+        capacity = len(self.stamps)
+        stamps, values, conditions = stamps[-capacity:], values[-capacity:], conditions[-capacity:]
+        if not len(stamps):
+            return 0
+        positions = (self.head + np.arange(len(stamps))) % capacity
+        self.stamps[positions] = stamps
+        self.values[positions] = values
+        self.conditions[positions] = conditions
+        self.head = (self.head + len(stamps)) % capacity
+        self.count = min(capacity, self.count + len(stamps))
+        return len(stamps)
+
+
+class RecentStore:
+    """
+    Per-city ring buffers of the most recent readings
+
+    Args:
+        capacity (Optional[int]): Readings kept per city, default RECENT_STORE_HOURS at RAW_SAMPLE_INTERVAL
+        refresh_interval (float): Minimum seconds between refresh() queries
+    """
+
+    def __init__(self, capacity: Optional[int] = None, refresh_interval: float = config.RECENT_STORE_REFRESH):
+        self.capacity = capacity or default_capacity()
+        self.refresh_interval = refresh_interval
+        self._buffers: Dict[str, _CityBuffer] = {}
+        self._conditions: List[Optional[str]] = [None]
+        self._condition_codes: Dict[Optional[str], int] = {None: 0}
+        self._high_water: Optional[datetime] = None
+        # Start of the last load() of every city, and of the cities loaded by name
+        self._loaded_from: Optional[datetime] = None
+        self._city_loaded_from: Dict[str, datetime] = {}
+        self._refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buffers)
+
+    def cities(self) -> List[str]:
+        with self._lock:
+            return sorted(self._buffers)
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(
+                buffer.stamps.nbytes + buffer.values.nbytes + buffer.conditions.nbytes
+                for buffer in self._buffers.values()
+            )
+
+    def _condition_code(self, condition: Optional[str]) -> int:
+        code = self._condition_codes.get(condition)
+        if code is None:
+            code = self._condition_codes[condition] = len(self._conditions)
+            self._conditions.append(condition)
+        return code
+
+    def _extend(self, city: str, stamps: np.ndarray, values: np.ndarray, conditions: np.ndarray) -> int:
+        buffer = self._buffers.get(city)
+        if buffer is None:
+            buffer = self._buffers[city] = _CityBuffer(self.capacity)
+        added = buffer.extend(stamps, values, conditions)
+        if added:
+            newest = np.datetime64(int(buffer.last_stamp), 's').item()
+            if self._high_water is None or newest > self._high_water:
+                self._high_water = newest
+        return added
+
+    def add(self, reading: Dict[str, Any]) -> bool:
+        """
+        Append a reading to its city's buffer
+
+        Args:
+            reading (Dict[str, Any]): Reading as written to weather_data
+
+        Returns:
+            bool: False if it is not newer than the city's last stored reading
+        """
+        if reading.get('timestamp') is None or reading.get('city') is None:
+            return False
+        values = np.array(
+            [[np.nan if reading.get(field) is None else reading[field] for field in RECENT_FIELDS]],
+            dtype=np.float32,
+        )
+        with self._lock:
+            conditions = np.array([self._condition_code(reading.get('weather_main'))], dtype=np.uint16)
+            return bool(self._extend(
+                reading['city'], np.array([_stamp(reading['timestamp'])], dtype=np.int64), values, conditions,
+            ))
+
+    def add_many(self, readings: Iterable[Dict[str, Any]]) -> int:
+        return sum(self.add(reading) for reading in readings)
+
+    def add_frame(self, df: 'pd.DataFrame') -> int:
+        """
+        Append a DataFrame of readings with timestamp, city, weather_main and RECENT_FIELDS columns
+        """
+        import pandas as pd
+
+        if df.empty:
+            return 0
+        df = df.sort_values('timestamp', kind='stable')
+        stamps = pd.to_datetime(df['timestamp']).to_numpy().astype('datetime64[s]').astype(np.int64)
+        values = df[list(RECENT_FIELDS)].to_numpy(dtype=np.float32, na_value=np.nan)
+        cities = df['city'].to_numpy()
+        added = 0
+        with self._lock:
+            conditions = np.array([self._condition_code(condition) for condition in df['weather_main']], dtype=np.uint16)
+            for city, positions in pd.Series(np.arange(len(df))).groupby(cities, sort=False).groups.items():
+                positions = np.asarray(positions)
+                added += self._extend(city, stamps[positions], values[positions], conditions[positions])
+        return added
+
+    def _since_statement(self, start: datetime, cities: Optional[Sequence[str]] = None):
+        columns = [WeatherData.timestamp, WeatherData.city, WeatherData.weather_main]
+        columns += [getattr(WeatherData, field) for field in RECENT_FIELDS]
+        statement = select(*columns).where(WeatherData.timestamp >= start)
+        if cities is not None:
+            statement = statement.where(WeatherData.city.in_(cities))
+        return statement.order_by(WeatherData.timestamp.asc())
+
+    def load(self, bind: Engine, cities: Optional[Sequence[str]] = None, now: Optional[datetime] = None) -> int:
+        """
+        Cold-start the buffers with the last RECENT_STORE_HOURS of readings from weather_data
+
+        Args:
+            bind (Engine): Database to read from
+            cities (Optional[Sequence[str]]): Cities to load, or None for all
+            now (Optional[datetime]): End of the loaded window, default now
+
+        Returns:
+            int: Readings added
+        """
+        from app.queries import read_frame
+
+        start = (now or datetime.now()) - timedelta(seconds=self.capacity * config.RAW_SAMPLE_INTERVAL)
+        added = self.add_frame(read_frame(bind, self._since_statement(start, cities)))
+        with self._lock:
+            if cities is None:
+                self._loaded_from = start
+            else:
+                for city in cities:
+                    self._city_loaded_from[city] = min(start, self._city_loaded_from.get(city, start))
+        self._refreshed_at = time.monotonic()
+        logger.info(f"Loaded {added} recent readings for {len(self)} cities")
+        return added
+
+    def refresh(self, bind: Engine, overlap: timedelta = timedelta(hours=1)) -> int:
+        """
+        Add readings written by other processes since the newest one stored
+
+        Readings up to overlap older than that are read again so observations
+        that arrive late are not missed; the buffers skip ones already stored.
+        Queries at most once per refresh_interval.
+
+        Returns:
+            int: Readings added
+        """
+        with self._lock:
+            high_water = self._high_water
+            if self._refreshed_at is not None and time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return 0
+            self._refreshed_at = time.monotonic()
+        if high_water is None:
+            return self.load(bind)
+        from app.queries import read_frame
+
+        return self.add_frame(read_frame(bind, self._since_statement(high_water - overlap)))
+
+    def covers(self, start: datetime, cities: Optional[Sequence[str]] = None) -> bool:
+        """
+        Whether every reading since start of the given cities (default: all) is held
+
+        A buffer that has not wrapped holds everything since the load() of
+        all cities or of that city; one that has wrapped only holds readings
+        from its oldest on.
+        """
+        with self._lock:
+            if cities is None and (self._loaded_from is None or start < self._loaded_from):
+                return False
+            stamp = _stamp(start)
+            for city in (list(self._buffers) if cities is None else cities):
+                loaded_from = [
+                    loaded for loaded in (self._loaded_from, self._city_loaded_from.get(city)) if loaded is not None
+                ]
+                if not loaded_from or start < min(loaded_from):
+                    return False
+                buffer = self._buffers.get(city)
+                if buffer is not None and buffer.count == self.capacity and buffer.stamps[buffer.head] > stamp:
+                    return False
+            return True
+
+    def _record(self, city: str, buffer: _CityBuffer, position: int) -> RecentReading:
+        values = [None if math.isnan(value) else float(value) for value in buffer.values[position]]
+        return RecentReading(
+            city,
+            np.datetime64(int(buffer.stamps[position]), 's').item(),
+            *values,
+            self._conditions[buffer.conditions[position]],
+        )
+
+    def last(self, city: str, n: int = 1) -> List[RecentReading]:
+        """
+        The newest n readings of a city, oldest first
+        """
+        with self._lock:
+            buffer = self._buffers.get(city)
+            if buffer is None:
+                return []
+            return [self._record(city, buffer, position) for position in buffer.order(n)]
+
+    def latest(self, cities: Optional[Sequence[str]] = None) -> List[RecentReading]:
+        """
+        The newest reading per city, in the order given (default: all cities), skipping unknown cities
+        """
+        with self._lock:
+            readings = []
+            for city in (sorted(self._buffers) if cities is None else cities):
+                buffer = self._buffers.get(city)
+                if buffer is not None and buffer.count:
+                    readings.append(self._record(city, buffer, (buffer.head - 1) % self.capacity))
+            return readings
+
+    def window(self, city: str, start: datetime, end: Optional[datetime] = None) -> Dict[str, np.ndarray]:
+        """
+        A city's readings with start <= timestamp < end as columns, oldest first
+
+        Returns:
+            Dict[str, np.ndarray]: 'timestamp' (datetime64[s]) and one float32 array per RECENT_FIELDS entry
+        """
+        with self._lock:
+            buffer = self._buffers.get(city)
+            if buffer is None:
+                positions = np.arange(0)
+                stamps = np.zeros(0, dtype=np.int64)
+                values = np.zeros((0, len(RECENT_FIELDS)), dtype=np.float32)
+            else:
+                positions = buffer.order()
+                stamps = buffer.stamps[positions]
+                values = buffer.values[positions]
+        mask = stamps >= _stamp(start)
+        if end is not None:
+            mask &= stamps < _stamp(end)
+        columns = {'timestamp': stamps[mask].astype('datetime64[s]')}
+        for index, field in enumerate(RECENT_FIELDS):
+            columns[field] = values[mask, index]
+        return columns
+
+    def aggregate(
+        self, city: str, start: datetime, end: Optional[datetime] = None, field: str = 'temperature'
+    ) -> Dict[str, Optional[float]]:
+        """
+        Count, mean, min and max of field over a city's window, ignoring missing values
+        """
+        values = self.window(city, start, end)[field]
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return {'count': 0, 'mean': None, 'min': None, 'max': None}
+        return {
+            'count': int(len(values)),
+            'mean': float(values.mean(dtype=np.float64)),
+            'min': float(values.min()),
+            'max': float(values.max()),
+        }
+
+    def frame(self, start: datetime, cities: Optional[Sequence[str]] = None) -> 'pd.DataFrame':
+        """
+        Readings since start in the shape of queries.load_history(tier=RAW), without pressure
+        """
+        import pandas as pd
+
+        frames = []
+        for city in (cities if cities is not None else self.cities()):
+            columns = self.window(city, start)
+            if len(columns['timestamp']):
+                frames.append(pd.DataFrame(dict(columns, city=city)))
+        if not frames:
+            return pd.DataFrame(columns=['timestamp', 'city', *RECENT_FIELDS])
+        df = pd.concat(frames, ignore_index=True).sort_values('timestamp', kind='stable', ignore_index=True)
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df['city'] = df['city'].astype('category')
+        return df[['timestamp', 'city', *RECENT_FIELDS]]
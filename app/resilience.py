@@ -0,0 +1,340 @@
+"""
+Tail-latency control for upstream requests
+
+Every upstream call in app.api goes through get(), which adds:
+
+- a circuit breaker per endpoint: after BREAKER_FAILURES consecutive
+  failures (connection errors, timeouts, 5xx and 429 responses) the
+  endpoint is not called for BREAKER_RESET seconds, then a single trial
+  request decides whether it closes again
+- retries of those failures, RETRY_ATTEMPTS attempts in all, after
+  exponential backoff with full jitter (honouring Retry-After on 429),
+  never sleeping past the caller's deadline; a Retry-After beyond the
+  deadline or RETRY_AFTER_MAX fails the request at once
+- separate connect and read timeouts, the read timeout cut to the time left
+- with HEDGE_PERCENTILE set, a second identical request once the first has
+  taken longer than that percentile of the endpoint's recent latencies;
+  whichever answers first is used
+
+Other responses (2xx, 304, 404, ...) are returned as they are for the caller
+to handle. Breaker states, retries, hedges and rejected requests are exported
+as weather_upstream_* metrics and returned by stats().
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Optional
+from urllib.parse import urlparse
+import requests
+from requests.exceptions import ConnectionError, RequestException, Timeout
+from app import metrics
+from app.http_client import get_http_session
+import config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+# Value of weather_upstream_breaker_state per state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RequestException):
+    """
+    Raised instead of calling an endpoint whose circuit breaker is open
+    """
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one endpoint
+
+    Args:
+        name (str): Endpoint label used in logs and metrics
+        failure_threshold (int): Consecutive failures that open the breaker
+        reset_timeout (float): Seconds the breaker stays open before a trial request
+        clock (Callable[[], float]): Monotonic time source
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = config.BREAKER_FAILURES,
+        reset_timeout: float = config.BREAKER_RESET,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+        metrics.BREAKER_STATE.set(STATE_VALUES[CLOSED], endpoint=name)
+
+    def _transition(self, state: str) -> None:
+        if state != self.state:
+            logger.warning(f"Circuit breaker for {self.name} {self.state} -> {state}")
+            self.state = state
+            metrics.BREAKER_STATE.set(STATE_VALUES[state], endpoint=self.name)
+
+    def allow(self) -> bool:
+        """
+        Whether a request may be sent now; in half-open state only one trial is let through
+        """
+        with self._lock:
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self._transition(HALF_OPEN)
+                self._trial = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._trial = False
+            self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                self._transition(OPEN)
+
+
+class LatencyTracker:
+    """
+    Recent request latencies of one endpoint, for the hedging threshold
+    """
+
+    def __init__(self, size: int = 200):
+        self._latencies: Deque[float] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = config.HEDGE_MIN_SAMPLES) -> Optional[float]:
+        """
+        The q-th percentile (0-100) of recent latencies, None until min_samples are known
+        """
+        with self._lock:
+            if len(self._latencies) < max(1, min_samples):
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_latencies: Dict[str, LatencyTracker] = {}
+_retries: Dict[str, int] = {}
+_registry_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+
+
+def endpoint_for(url: str) -> str:
+    """
+    Host and path of a URL, the unit circuit breakers and latencies are kept per
+    """
+    parsed = urlparse(url)
+    return f"{parsed.netloc}{parsed.path}"
+
+
+def breaker_for(endpoint: str) -> CircuitBreaker:
+    with _registry_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+
+def latency_for(endpoint: str) -> LatencyTracker:
+    with _registry_lock:
+        tracker = _latencies.get(endpoint)
+        if tracker is None:
+            tracker = _latencies[endpoint] = LatencyTracker()
+        return tracker
+
+
+def reset() -> None:
+    """
+    Forget all breakers, latencies and retry counts
+    """
+    with _registry_lock:
+        _breakers.clear()
+        _latencies.clear()
+        _retries.clear()
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    """
+    Breaker state, consecutive failures and retries per endpoint
+    """
+    with _registry_lock:
+        endpoints = sorted(set(_breakers) | set(_retries))
+        return {
+            endpoint: {
+                'state': _breakers[endpoint].state if endpoint in _breakers else CLOSED,
+                'failures': _breakers[endpoint].failures if endpoint in _breakers else 0,
+                'retries': _retries.get(endpoint, 0),
+            }
+            for endpoint in endpoints
+        }
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _registry_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=max(2, config.FETCH_CONCURRENCY * 2), thread_name_prefix='hedge'
+            )
+        return _hedge_executor
+
+
+def is_retryable(response: requests.Response) -> bool:
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def backoff_delay(attempt: int, base: Optional[float] = None, cap: Optional[float] = None) -> float:
+    """
+    Full-jitter delay before retry number attempt (1 for the first retry)
+    """
+    base = config.RETRY_BASE_DELAY if base is None else base
+    cap = config.RETRY_MAX_DELAY if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def _retry_after(response: Optional[requests.Response]) -> float:
+    if response is None or response.status_code != 429:
+        return 0.0
+    try:
+        return max(0.0, float(response.headers.get('Retry-After', 0)))
+    except ValueError:
+        # HTTP-date form; fall back to the jittered backoff
+        return 0.0
+
+
+def _hedged(send: Callable[[], requests.Response], hedge_after: float, endpoint: str) -> requests.Response:
+    """
+    Run send, and run it a second time if the first has not answered within hedge_after seconds
+    """
+    executor = _executor()
+    first = executor.submit(send)
+    done, _ = wait([first], timeout=hedge_after)
+    if done:
+        return first.result()
+
+    metrics.UPSTREAM_HEDGES.inc(endpoint=endpoint, outcome='sent')
+    second = executor.submit(send)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                response = future.result()
+            except RequestException as e:
+                error = e
+                continue
+            if future is second:
+                metrics.UPSTREAM_HEDGES.inc(endpoint=endpoint, outcome='won')
+            return response
+    raise error
+
+
+def get(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    timeout: Optional[float] = None,
+    session: Optional[requests.Session] = None,
+) -> requests.Response:
+    """
+    GET url through the endpoint's circuit breaker, with retries and optional hedging
+
+    Args:
+        url (str): URL to fetch
+        params (Optional[Dict[str, Any]]): Query parameters
+        headers (Optional[Dict[str, str]]): Request headers
+        timeout (Optional[float]): Seconds all attempts together may take, unbounded if None
+        session (Optional[requests.Session]): Session to use, defaults to the pooled session
+
+    Returns:
+        requests.Response: The first response that is not a 5xx or 429
+
+    Raises:
+        CircuitOpenError: If the endpoint's breaker rejects the request
+        RequestException: The last error, or HTTPError for the last 5xx/429,
+            once attempts or time run out
+    """
+    session = session or get_http_session()
+    endpoint = endpoint_for(url)
+    breaker = breaker_for(endpoint)
+    latency = latency_for(endpoint)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    attempt = 0
+    while True:
+        attempt += 1
+        if not breaker.allow():
+            metrics.UPSTREAM_REJECTED.inc(endpoint=endpoint)
+            raise CircuitOpenError(f"Circuit breaker for {endpoint} is open")
+
+        read_timeout = config.READ_TIMEOUT
+        if deadline is not None:
+            read_timeout = max(0.001, min(read_timeout, deadline - time.monotonic()))
+
+        def send() -> requests.Response:
+            started = time.monotonic()
+            response = session.get(
+                url, params=params, headers=headers, timeout=(config.CONNECT_TIMEOUT, read_timeout)
+            )
+            if not is_retryable(response):
+                latency.observe(time.monotonic() - started)
+            return response
+
+        response = None
+        error = None
+        hedge_after = latency.percentile(config.HEDGE_PERCENTILE) if config.HEDGE_PERCENTILE > 0 else None
+        try:
+            response = _hedged(send, hedge_after, endpoint) if hedge_after is not None else send()
+        except (ConnectionError, Timeout) as e:
+            error = e
+        except RequestException:
+            breaker.record_failure()
+            raise
+
+        if response is not None and not is_retryable(response):
+            breaker.record_success()
+            return response
+        breaker.record_failure()
+        reason = type(error).__name__ if error is not None else str(response.status_code)
+
+        retry_after = _retry_after(response)
+        delay = max(backoff_delay(attempt), retry_after)
+        out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+        if attempt >= config.RETRY_ATTEMPTS or out_of_time or retry_after > config.RETRY_AFTER_MAX:
+            if error is not None:
+                raise error
+            response.raise_for_status()
+
+        with _registry_lock:
+            _retries[endpoint] = _retries.get(endpoint, 0) + 1
+        metrics.UPSTREAM_RETRIES.inc(endpoint=endpoint, reason=reason)
+        logger.debug(f"Retrying {endpoint} in {delay:.2f}s after {reason} (attempt {attempt})")
+        time.sleep(delay)
@@ -0,0 +1,185 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from app.models import WeatherData, WeatherRollup15m, WeatherRollupHourly
+from app.db_utils import upsert, least, greatest
+import config
+
+logger = logging.getLogger(__name__)
+
+RAW = 'raw'
+
+# Tier name -> (model, bucket width), finest first
+TIERS = {
+    '15m': (WeatherRollup15m, timedelta(minutes=15)),
+    '1h': (WeatherRollupHourly, timedelta(hours=1)),
+}
+
+# Mean/min/max are kept for these fields; nullable ones also keep a count
+FIELDS = ('temperature', 'feels_like', 'humidity', 'wind_speed')
+NULLABLE_FIELDS = ('humidity', 'wind_speed')
+
+BACKFILL_CHUNK_SIZE = 10000
+
+
+def bucket_start(timestamp: datetime, width: timedelta) -> datetime:
+    seconds = int(width.total_seconds())
+    midnight = datetime.combine(timestamp.date(), datetime.min.time())
+    offset = int((timestamp - midnight).total_seconds()) // seconds * seconds
+    return midnight + timedelta(seconds=offset)
+
+
+def aggregate_readings(rows: Iterable[Dict[str, Any]], width: timedelta) -> List[Dict[str, Any]]:
+    """
+    Aggregate readings into per-city buckets of the given width
+
+    The readings are grouped and reduced as columns by app.analytics rather
+    than folded into the buckets one at a time.
+
+    Returns:
+        List[Dict[str, Any]]: Rows for a rollup tier table, ordered by city and bucket_start
+    """
+    # pandas is only loaded by the first write, not when the scheduler starts
+    import pandas as pd
+    from app.analytics import group_index, reduce_groups
+
+    rows = list(rows)
+    if not rows:
+        return []
+    stamps = pd.to_datetime([row['timestamp'] for row in rows]).as_unit('us').asi8
+    step = width // timedelta(microseconds=1)
+    # Epoch multiples of a width that divides a day are aligned to midnight, as bucket_start()
+    inverse, (cities, starts) = group_index(
+        np.array([row['city'] for row in rows], dtype=object), stamps // step * step
+    )
+    stats = reduce_groups(inverse, np.array([[row.get(field) for field in FIELDS] for row in rows], dtype=np.float64))
+
+    columns = {
+        'city': cities.tolist(),
+        'bucket_start': starts.astype('datetime64[us]').tolist(),
+        'reading_count': np.bincount(inverse).tolist(),
+    }
+    for index, field in enumerate(FIELDS):
+        columns[f'{field}_sum'] = stats['sum'][:, index].tolist()
+        for name in ('min', 'max'):
+            values = stats[name][:, index]
+            columns[f'{field}_{name}'] = np.where(np.isnan(values), None, values).tolist()
+        if field in NULLABLE_FIELDS:
+            columns[f'{field}_count'] = stats['count'][:, index].astype(np.int64).tolist()
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def _merge(session: Session, table, excluded) -> Dict[str, Any]:
+    values = {'reading_count': table.c.reading_count + excluded.reading_count}
+    for field in FIELDS:
+        values[f'{field}_sum'] = table.c[f'{field}_sum'] + excluded[f'{field}_sum']
+        if field in NULLABLE_FIELDS:
+            values[f'{field}_count'] = table.c[f'{field}_count'] + excluded[f'{field}_count']
+        for suffix, function in (('_min', least), ('_max', greatest)):
+            current, new = table.c[f'{field}{suffix}'], excluded[f'{field}{suffix}']
+            if field in NULLABLE_FIELDS:
+                # A bucket with no values yet has NULL min/max, which must not win
+                current, new = func.coalesce(current, new), func.coalesce(new, current)
+            values[f'{field}{suffix}'] = function(session, current, new)
+    return values
+
+
+def update_rollup_tiers(session: Session, rows: List[Dict[str, Any]]) -> None:
+    """
+    Fold freshly written readings into every rollup tier
+
+    Runs in the caller's transaction so the tiers stay consistent with weather_data.
+    """
+    rows = [row for row in rows if row.get('timestamp') is not None]
+    if not rows:
+        return
+    for model, width in TIERS.values():
+        table = model.__table__
+        upsert(session, table, aggregate_readings(rows, width), ['city', 'bucket_start'],
+               set_=lambda excluded: _merge(session, table, excluded))
+
+
+def rebuild_rollup_tiers(session: Session, start: datetime, end: Optional[datetime] = None) -> int:
+    """
+    Rebuild the rollup tiers for [start, end) from raw readings
+
+    Both bounds are aligned down to the coarsest tier's buckets, so a bucket
+    is either rebuilt from all of its readings or left as it is; a partial
+    last bucket is not rewritten from only the readings before end.
+
+    Returns:
+        int: Number of raw readings folded in
+    """
+    width = max(w for _, w in TIERS.values())
+    start = bucket_start(start, width)
+    end = bucket_start(end or datetime.now(), width)
+    if end <= start:
+        return 0
+    for model, _ in TIERS.values():
+        session.query(model).filter(model.bucket_start >= start, model.bucket_start < end).delete()
+
+    columns = [WeatherData.city, WeatherData.timestamp] + [getattr(WeatherData, field) for field in FIELDS]
+    result = session.execute(
+        select(*columns).where(WeatherData.timestamp >= start, WeatherData.timestamp < end),
+        execution_options={'yield_per': BACKFILL_CHUNK_SIZE},
+    )
+    total = 0
+    for chunk in result.mappings().partitions():
+        update_rollup_tiers(session, [dict(row) for row in chunk])
+        total += len(chunk)
+    return total
+
+
+def backfill_rollup_tiers(engine: Engine, start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+    """
+    Rebuild the rollup tiers over the history in weather_data, one day per transaction
+
+    Fills the tiers for readings ingested before they existed. Buckets from
+    the one holding end on are left to the batch writer.
+
+    Args:
+        engine (Engine): Database to backfill
+        start (Optional[datetime]): First reading to fold in, defaults to the oldest
+        end (Optional[datetime]): Upper bound, defaults to now
+
+    Returns:
+        int: Number of raw readings folded in
+    """
+    with engine.connect() as connection:
+        start = start or connection.scalar(select(func.min(WeatherData.timestamp)))
+    if start is None:
+        return 0
+    width = max(w for _, w in TIERS.values())
+    end = bucket_start(end or datetime.now(), width)
+    day = bucket_start(start, width)
+    total = 0
+    with Session(bind=engine) as session:
+        while day < end:
+            next_day = min(datetime.combine(day.date() + timedelta(days=1), datetime.min.time()), end)
+            total += rebuild_rollup_tiers(session, day, next_day)
+            session.commit()
+            day = next_day
+    logger.info(f"Backfilled the rollup tiers from {total} readings before {end}")
+    return total
+
+
+def choose_tier(window: timedelta, max_points: int = None) -> str:
+    """
+    Pick the finest tier that keeps one series under max_points
+
+    Raw data is used while its expected point count fits, otherwise the
+    first rollup tier whose bucket count fits, falling back to the coarsest.
+    """
+    max_points = max_points or config.DASHBOARD_MAX_POINTS
+    seconds = window.total_seconds()
+    if seconds / config.RAW_SAMPLE_INTERVAL <= max_points:
+        return RAW
+    for name, (_, width) in TIERS.items():
+        if seconds / width.total_seconds() <= max_points:
+            return name
+    return list(TIERS)[-1]
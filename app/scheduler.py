@@ -1,18 +1,321 @@
-import schedule
+import logging
+import threading
 import time
-from app.api import fetch_weather_data
-from app.data_processor import calculate_daily_summary, check_thresholds
-from config import REQUEST_INTERVAL
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from app.alerts import alert_engine
+from app.api import batch_writer, fetch_due_weather_data, fetch_weather_data, start_spool, stop_spool, warm_start
+from app.data_processor import calculate_daily_summary, check_thresholds, cleanup_old_data, update_daily_summaries
+from app.email_notifier import notifier
+from app.migrations import migrate
+from app.query_cache import use_worker_data_version
+from app.sharding import ShardCoordinator
+from app import metrics
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """
+    A periodic job, either every interval seconds or daily at HH:MM
+
+    Interval ticks are aligned to multiples of the interval since local
+    midnight, so they land on the same wall-clock boundaries however long
+    each run takes.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[], Any],
+        interval: Optional[float] = None,
+        at: Optional[str] = None,
+        name: Optional[str] = None,
+        coalesce: bool = False,
+    ):
+        if (interval is None) == (at is None):
+            raise ValueError("A job needs exactly one of interval or at")
+        if interval is not None and interval <= 0:
+            raise ValueError("interval must be positive")
+        self.func = func
+        self.interval = interval
+        self.at = datetime.strptime(at, '%H:%M').time() if at is not None else None
+        self.name = name or getattr(func, '__name__', repr(func))
+        self.coalesce = coalesce
+        self.next_run: Optional[float] = None
+        self.running = False
+        self.pending = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.missed = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    def next_after(self, moment: float) -> float:
+        """
+        First tick strictly after moment (a time.time() value)
+        """
+        current = datetime.fromtimestamp(moment)
+        midnight = datetime.combine(current.date(), datetime.min.time())
+        if self.at is not None:
+            tick = datetime.combine(current.date(), self.at)
+            if tick <= current:
+                tick = datetime.combine(current.date() + timedelta(days=1), self.at)
+            return tick.timestamp()
+        start = midnight.timestamp()
+        tick = start + ((moment - start) // self.interval + 1) * self.interval
+        # Float rounding can land exactly on moment for sub-second intervals
+        while tick <= moment:
+            tick += self.interval
+        return tick
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+            'missed': self.missed,
+            'running': self.running,
+            'last_duration': self.last_duration,
+            'max_duration': self.max_duration,
+            'avg_duration': self.total_duration / self.runs if self.runs else 0.0,
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+            'next_run': datetime.fromtimestamp(self.next_run) if self.next_run else None,
+        }
+
+
+class JobScheduler:
+    """
+    Run periodic jobs on a thread pool without overlap or drift
+
+    Each job runs at most once at a time. A tick that arrives while the job
+    is still running is skipped, or with coalesce=True folded into a single
+    follow-up run. Ticks that pass while the scheduler is behind are counted
+    as missed rather than replayed. The pool has at least one worker per job,
+    so a slow job never holds up the others.
+    """
+
+    def __init__(self, workers: int = config.SCHEDULER_WORKERS, clock: Callable[[], float] = time.time):
+        self.workers = workers
+        self.clock = clock
+        self.jobs: List[Job] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, job: Job) -> Job:
+        with self._lock:
+            if self._executor is not None:
+                job.next_run = job.next_after(self.clock())
+            self.jobs.append(job)
+        self._wake.set()
+        return job
+
+    def every(self, seconds: float, func: Callable[[], Any], name: Optional[str] = None, coalesce: bool = False) -> Job:
+        return self.add(Job(func, interval=seconds, name=name, coalesce=coalesce))
+
+    def daily(self, at: str, func: Callable[[], Any], name: Optional[str] = None, coalesce: bool = False) -> Job:
+        return self.add(Job(func, at=at, name=name, coalesce=coalesce))
+
+    def run_forever(self) -> None:
+        """
+        Dispatch due jobs until stop() is called
+        """
+        with self._lock:
+            self._executor = ThreadPoolExecutor(
+                max_workers=max(self.workers, len(self.jobs), 1), thread_name_prefix='scheduler'
+            )
+            now = self.clock()
+            for job in self.jobs:
+                job.next_run = job.next_after(now)
+
+        try:
+            while not self._stop.is_set():
+                now = self.clock()
+                with self._lock:
+                    due = [job for job in self.jobs if job.next_run <= now]
+                for job in due:
+                    self._dispatch(job, now)
+                with self._lock:
+                    upcoming = min((job.next_run for job in self.jobs), default=now + 60)
+                self._wake.clear()
+                self._wake.wait(max(0.0, min(upcoming - self.clock(), 60)))
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _dispatch(self, job: Job, now: float) -> None:
+        scheduled = job.next_run
+        next_run = job.next_after(scheduled)
+        missed = 0
+        while next_run <= now:
+            missed += 1
+            next_run = job.next_after(next_run)
+        with self._lock:
+            job.next_run = next_run
+            job.missed += missed
+            if job.running:
+                if job.coalesce:
+                    job.pending = True
+                else:
+                    job.skipped += 1
+                    logger.warning(f"Skipping {job.name}: previous run is still in progress")
+                return
+            job.running = True
+        if missed:
+            logger.warning(f"{job.name} fell {missed} tick(s) behind; running once for all of them")
+        self._executor.submit(self._run, job, scheduled)
+
+    def _run(self, job: Job, scheduled: float) -> None:
+        while True:
+            started = self.clock()
+            lag = max(0.0, started - scheduled)
+            try:
+                job.func()
+                failed = False
+            except Exception:
+                failed = True
+                logger.exception(f"Job {job.name} failed")
+            duration = self.clock() - started
+            metrics.JOB_SECONDS.observe(duration, job=job.name)
+            metrics.JOB_RUNS.inc(job=job.name, outcome='failed' if failed else 'succeeded')
+            metrics.JOB_LAG.set(lag, job=job.name)
+
+            with self._lock:
+                job.runs += 1
+                job.failures += failed
+                job.last_duration = duration
+                job.max_duration = max(job.max_duration, duration)
+                job.total_duration += duration
+                job.last_lag = lag
+                job.max_lag = max(job.max_lag, lag)
+                if not job.pending:
+                    job.running = False
+                    break
+                job.pending = False
+                scheduled = self.clock()
+            logger.info(f"Running coalesced tick of {job.name}")
+
+        logger.debug(f"{job.name} finished in {duration:.2f}s ({lag:.2f}s late)")
+        if job.interval is not None and duration > job.interval:
+            logger.warning(f"{job.name} took {duration:.1f}s, longer than its {job.interval:g}s interval")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Per-job run counts, durations and lag in seconds
+        """
+        with self._lock:
+            return {job.name: job.stats() for job in self.jobs}
+
+    def log_stats(self) -> None:
+        for name, stats in self.stats().items():
+            logger.info(
+                f"Job {name}: {stats['runs']} runs, {stats['failures']} failed, {stats['skipped']} skipped, "
+                f"{stats['missed']} missed, avg {stats['avg_duration']:.2f}s, max {stats['max_duration']:.2f}s, "
+                f"max lag {stats['max_lag']:.2f}s"
+            )
+
+
+def _leader_only(coordinator: ShardCoordinator, func: Callable[[], Any]) -> Callable[[], Any]:
+    def run():
+        if coordinator.is_leader():
+            return func()
+    run.__name__ = func.__name__
+    return run
+
+def shutdown(coordinator: Optional[ShardCoordinator] = None, metrics_server=None) -> None:
+    """
+    Write what is still buffered and stop the background threads
+
+    Buffered readings are written before the spool is stopped, and alerts
+    fired since the last check_thresholds tick are stored and queued before
+    the notifier sends its last digests.
+    """
+    if coordinator is not None:
+        coordinator.release()
+    try:
+        batch_writer.flush()
+    except Exception:
+        logger.exception("Failed to write buffered readings on shutdown")
+    stop_spool(timeout=config.SPOOL_MAX_BACKOFF)
+    try:
+        alert_engine.flush()
+    except Exception:
+        logger.exception("Failed to store pending alerts on shutdown")
+    # Send alert digests still waiting for their window
+    notifier.stop(timeout=config.SMTP_TIMEOUT * 2)
+    if metrics_server is not None:
+        metrics_server.shutdown()
 
 # Function to schedule tasks
-def schedule_tasks():
-    schedule.every(REQUEST_INTERVAL).minutes.do(fetch_weather_data)
-    schedule.every().day.at("23:59").do(calculate_daily_summary)
-    schedule.every(REQUEST_INTERVAL).minutes.do(check_thresholds)
-
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+def schedule_tasks(
+    sharded: bool = config.SHARDED_INGESTION, metrics_port: int = config.METRICS_PORT, spool_dir: str = config.SPOOL_DIR
+):
+    """
+    Run the ingestion and maintenance jobs until interrupted
+
+    With sharded=True several processes can run this against the same
+    database: each fetches only the cities it owns on the shard ring, and
+    the rollup and retention jobs run on the shard leader only.
+
+    Metrics are served at /metrics on metrics_port unless it is 0. With
+    spool_dir set, readings go through a write-ahead spool in that directory.
+    Pending schema migrations are applied first.
+    """
+    migrate()
+    if spool_dir:
+        start_spool(spool_dir)
+    scheduler = JobScheduler()
+    fetch_cities = fetch_due_weather_data if config.ADAPTIVE_POLLING else fetch_weather_data
+    coordinator = None
+    metrics_server = None
+    if metrics_port:
+        try:
+            metrics_server = metrics.start_http_server(metrics_port, config.METRICS_HOST)
+        except OSError as e:
+            logger.error(f"Metrics endpoint not started on port {metrics_port}: {str(e)}")
+    if sharded:
+        coordinator = ShardCoordinator(config.CITIES, on_assign=warm_start)
+        use_worker_data_version(coordinator.worker_id)
+        coordinator.heartbeat()
+        scheduler.every(config.SHARD_HEARTBEAT_INTERVAL, coordinator.heartbeat, name='shard_heartbeat')
+
+        def fetch_weather_data_shard():
+            cities = coordinator.assigned()
+            if cities:
+                fetch_cities(cities)
+
+        fetch = fetch_weather_data_shard
+        maintenance = lambda func: _leader_only(coordinator, func)
+    else:
+        warm_start()
+        fetch = fetch_cities
+        maintenance = lambda func: func
+
+    scheduler.every(config.REQUEST_INTERVAL * 60, fetch)
+    scheduler.every(config.ROLLUP_INTERVAL * 60, maintenance(update_daily_summaries), coalesce=True)
+    scheduler.daily("23:59", maintenance(calculate_daily_summary), coalesce=True)
+    scheduler.every(config.REQUEST_INTERVAL * 60, check_thresholds)
+    scheduler.every(config.ALERT_RULES_REFRESH, alert_engine.refresh_rules, name='alert_rules', coalesce=True)
+    scheduler.daily("00:30", maintenance(cleanup_old_data))
+    scheduler.every(config.SCHEDULER_STATS_INTERVAL, scheduler.log_stats, name='scheduler_stats')
+
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    finally:
+        shutdown(coordinator, metrics_server)
 
 if __name__ == "__main__":
     schedule_tasks()
@@ -0,0 +1,169 @@
+"""
+Sharded ingestion across several scheduler processes
+
+Each worker holds a lease row in worker_leases and refreshes it every
+SHARD_HEARTBEAT_INTERVAL seconds. Workers whose lease is younger than
+SHARD_LEASE_TTL are live, and the cities are split between them on a
+consistent-hash ring, so a worker joining or leaving only moves its own share
+of the cities. Heartbeats and lease ages are taken from the database's clock,
+so workers whose local clocks disagree still agree on who is alive.
+
+To avoid two workers fetching the same city while their views of the
+membership differ, a worker gives up cities as soon as it sees a new
+membership but only takes on new cities once the membership has been stable
+for a full heartbeat.
+"""
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional, Sequence, Set
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+from app.models import WorkerLease, SessionLocal
+from app.db_utils import upsert
+import config
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent-hash ring mapping keys to nodes through virtual nodes
+    """
+
+    def __init__(self, nodes: Iterable[str], replicas: int = config.SHARD_RING_REPLICAS):
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{replica}"), node) for node in self.nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self._nodes:
+            return None
+        return self._nodes[bisect.bisect(self._hashes, _hash(key)) % len(self._nodes)]
+
+
+def default_worker_id() -> str:
+    return config.WORKER_ID or f"{socket.gethostname()}-{os.getpid()}"
+
+
+class ShardCoordinator:
+    """
+    Track live workers through the lease table and decide which cities this worker owns
+
+    Args:
+        cities (Sequence[str]): Every city to be ingested across all workers
+        worker_id (Optional[str]): Unique id of this worker
+        session_factory (Callable[[], Session]): Sessions on the shared database
+        lease_ttl (float): Seconds without a heartbeat before a worker is considered dead
+        on_assign (Optional[Callable[[List[str]], None]]): Called with cities newly taken over
+        clock (Optional[Callable[[], datetime]]): Source of the current time, the database's clock if None
+    """
+
+    def __init__(
+        self,
+        cities: Sequence[str],
+        worker_id: Optional[str] = None,
+        session_factory: Callable[[], Session] = SessionLocal,
+        lease_ttl: float = config.SHARD_LEASE_TTL,
+        on_assign: Optional[Callable[[List[str]], None]] = None,
+        clock: Optional[Callable[[], datetime]] = None,
+    ):
+        self.cities = list(cities)
+        self.worker_id = worker_id or default_worker_id()
+        self.session_factory = session_factory
+        self.lease_ttl = lease_ttl
+        self.on_assign = on_assign
+        self.clock = clock
+        self.members: List[str] = []
+        self._owned: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def _renew_lease(self) -> List[str]:
+        session = self.session_factory()
+        try:
+            # Heartbeats and the liveness cutoff must come from one clock shared by every worker
+            now = self.clock() if self.clock is not None else session.scalar(select(func.now()))
+            upsert(session, WorkerLease.__table__, [{
+                'worker_id': self.worker_id,
+                'hostname': socket.gethostname(),
+                'started_at': now,
+                'heartbeat': now,
+            }], ['worker_id'], set_=lambda excluded: {'heartbeat': excluded.heartbeat})
+            cutoff = now - timedelta(seconds=self.lease_ttl)
+            # Long-dead leases are removed; recently expired ones just stop counting
+            session.execute(delete(WorkerLease).where(WorkerLease.heartbeat < cutoff - timedelta(seconds=self.lease_ttl)))
+            members = session.scalars(
+                select(WorkerLease.worker_id).where(WorkerLease.heartbeat >= cutoff).order_by(WorkerLease.worker_id)
+            ).all()
+            session.commit()
+            return list(members)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def heartbeat(self) -> List[str]:
+        """
+        Renew this worker's lease and recompute its cities
+
+        Returns:
+            List[str]: Cities this worker owns after the heartbeat
+        """
+        members = self._renew_lease()
+        ring = HashRing(members)
+        target = {city for city in self.cities if ring.owner(city) == self.worker_id}
+        with self._lock:
+            if members != self.members:
+                # Drop lost cities now; gain new ones after a heartbeat with the same membership
+                logger.info(f"Shard membership changed: {self.members} -> {members}")
+                self.members = members
+                self._owned &= target
+                gained = []
+            else:
+                gained = sorted(target - self._owned)
+                self._owned = target
+            owned = sorted(self._owned)
+        if gained:
+            logger.info(f"Worker {self.worker_id} took over {len(gained)} cities")
+            if self.on_assign is not None:
+                self.on_assign(gained)
+        return owned
+
+    def assigned(self, cities: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Cities owned by this worker, in the order given (default: all cities)
+        """
+        with self._lock:
+            owned = set(self._owned)
+        return [city for city in (cities if cities is not None else self.cities) if city in owned]
+
+    def is_leader(self) -> bool:
+        """
+        Whether this worker runs the shared maintenance jobs (lowest live worker id)
+        """
+        with self._lock:
+            return bool(self.members) and self.members[0] == self.worker_id
+
+    def release(self) -> None:
+        """
+        Delete this worker's lease so the others take over its cities right away
+        """
+        session = self.session_factory()
+        try:
+            session.execute(delete(WorkerLease).where(WorkerLease.worker_id == self.worker_id))
+            session.commit()
+        finally:
+            session.close()
+        with self._lock:
+            self._owned = set()
+            self.members = []
@@ -0,0 +1,402 @@
+"""
+Local write-ahead spool between ingestion and the database
+
+With SPOOL_DIR set, a sweep appends its readings here instead of writing
+them to the database, and SpoolDrainer bulk-loads them into weather_data
+from a background thread. Fetching no longer waits for the database, bursts
+are absorbed on disk, and readings fetched while the database is down are
+written once it is back.
+
+The spool is a directory of append-only segments, segment-<seq>.jsonl, one
+JSON reading per line. Lines are only ever appended whole, so a segment can
+be memory-mapped and split on newlines; a torn last line left by a crash is
+cut off when the spool is opened. Appends are fsynced at most every
+SPOOL_FSYNC_INTERVAL seconds, and by sync(), which the sweep calls once at
+its end. A checkpoint file records the position up to which readings have
+been committed to the database; segments before it are deleted.
+
+Readings are drained in the order they were appended. A crash between the
+database commit and the checkpoint replays some readings, which the
+idempotent insert skips, so each reading is stored once.
+"""
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy.exc import SQLAlchemyError
+import config
+
+logger = logging.getLogger(__name__)
+
+# (segment sequence number, byte offset in the segment)
+Position = Tuple[int, int]
+
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def _segment_name(seq: int) -> str:
+    return f"segment-{seq:010d}.jsonl"
+
+
+def _fsync_directory(directory: str) -> None:
+    # Makes created, renamed and deleted files durable; not supported everywhere
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class Spool:
+    """
+    Segmented append-only log of readings with a drain checkpoint
+
+    Args:
+        directory (str): Directory holding the segments and the checkpoint; created if missing
+        segment_bytes (int): Size after which a new segment is started
+        fsync_interval (float): Seconds between fsyncs of appended readings, 0 syncs every append
+        datetime_fields (Sequence[str]): Fields stored as ISO 8601 strings and read back as datetimes
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = config.SPOOL_SEGMENT_BYTES,
+        fsync_interval: float = config.SPOOL_FSYNC_INTERVAL,
+        datetime_fields: Sequence[str] = ('timestamp',),
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.datetime_fields = tuple(datetime_fields)
+        self._lock = threading.Lock()
+        self.appended = 0
+        self.drained = 0
+        self.syncs = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments = self._list_segments()
+        self._checkpoint = self._load_checkpoint()
+        if self._segments:
+            self._repair(self._segments[-1])
+        else:
+            self._segments = [self._checkpoint[0]]
+        seq, offset = self._checkpoint
+        path = self._path(seq)
+        self._checkpoint = (seq, min(offset, os.path.getsize(path) if os.path.exists(path) else 0))
+        self._file = open(self._path(self._segments[-1]), 'ab')
+        self._dirty = False
+        self._synced_at = time.monotonic()
+        if self.backlog_bytes():
+            logger.info(f"Spool {directory} holds {self.backlog_bytes()} bytes of readings to replay")
+
+    @property
+    def checkpoint(self) -> Position:
+        return self._checkpoint
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, _segment_name(seq))
+
+    def _list_segments(self) -> List[int]:
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith('segment-') and name.endswith('.jsonl'):
+                try:
+                    segments.append(int(name[len('segment-'):-len('.jsonl')]))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def _load_checkpoint(self) -> Position:
+        first = self._segments[0] if self._segments else 1
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+            position = (int(checkpoint['segment']), int(checkpoint['offset']))
+        except FileNotFoundError:
+            return first, 0
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Unreadable spool checkpoint {path}, replaying from the oldest segment: {str(e)}")
+            return first, 0
+        # Segments before the checkpoint have been deleted; one after it means they all were
+        return position if position[0] >= first else (first, 0)
+
+    def _repair(self, seq: int) -> None:
+        # Cut off a line only partly written before a crash
+        path = self._path(seq)
+        with open(path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(max(0, size - 1))
+            if f.read(1) == b'\n':
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                end = mapped.rfind(b'\n') + 1
+            logger.warning(f"Truncating torn spool record at {path}:{end} ({size - end} bytes)")
+            f.truncate(end)
+            os.fsync(f.fileno())
+
+    def _encode(self, record: Dict[str, Any]) -> bytes:
+        record = dict(record)
+        for name in self.datetime_fields:
+            if isinstance(record.get(name), datetime):
+                record[name] = record[name].isoformat()
+        return json.dumps(record, separators=(',', ':')).encode() + b'\n'
+
+    def _decode(self, line: bytes) -> Dict[str, Any]:
+        record = json.loads(line)
+        for name in self.datetime_fields:
+            if isinstance(record.get(name), str):
+                record[name] = datetime.fromisoformat(record[name])
+        return record
+
+    def append(self, records: Iterable[Dict[str, Any]]) -> int:
+        """
+        Append records in one write, fsyncing if the last fsync is older than fsync_interval
+
+        Returns:
+            int: Number of records appended
+        """
+        lines = [self._encode(record) for record in records]
+        if not lines:
+            return 0
+        with self._lock:
+            self._file.write(b''.join(lines))
+            self._file.flush()
+            self._dirty = True
+            self.appended += len(lines)
+            if time.monotonic() - self._synced_at >= self.fsync_interval:
+                self._sync()
+            if self._file.tell() >= self.segment_bytes:
+                self._roll()
+        return len(lines)
+
+    def _sync(self) -> None:
+        if self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+            self.syncs += 1
+        self._synced_at = time.monotonic()
+
+    def _roll(self) -> None:
+        self._sync()
+        self._file.close()
+        seq = self._segments[-1] + 1
+        self._segments.append(seq)
+        self._file = open(self._path(seq), 'ab')
+        _fsync_directory(self.directory)
+
+    def sync(self) -> None:
+        """
+        fsync readings appended since the last fsync
+        """
+        with self._lock:
+            self._sync()
+
+    def read(self, limit: int) -> Tuple[List[Dict[str, Any]], Position]:
+        """
+        Read up to limit records from the checkpoint on, without consuming them
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Position]: The records, oldest first, and
+            the position after the last one, to pass to commit() once they are stored
+        """
+        records = []
+        with self._lock:
+            seq, offset = self._checkpoint
+            for segment in [s for s in self._segments if s >= seq]:
+                if segment != seq:
+                    seq, offset = segment, 0
+                with open(self._path(segment), 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if offset < size:
+                        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mapped:
+                            while offset < size and len(records) < limit:
+                                end = mapped.find(b'\n', offset)
+                                if end < 0:
+                                    break
+                                line = mapped[offset:end]
+                                offset = end + 1
+                                try:
+                                    records.append(self._decode(line))
+                                except ValueError as e:
+                                    logger.error(f"Skipping unreadable spool record in {_segment_name(segment)}: {str(e)}")
+                if len(records) >= limit:
+                    break
+        return records, (seq, offset)
+
+    def commit(self, position: Position, count: int = 0) -> None:
+        """
+        Record that everything before position is stored, deleting fully drained segments
+        """
+        with self._lock:
+            path = os.path.join(self.directory, CHECKPOINT_FILE)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'segment': position[0], 'offset': position[1]}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self._checkpoint = position
+            self.drained += count
+            drained = [seq for seq in self._segments if seq < position[0]]
+            for seq in drained:
+                os.remove(self._path(seq))
+            self._segments = [seq for seq in self._segments if seq >= position[0]]
+            _fsync_directory(self.directory)
+
+    def backlog_bytes(self) -> int:
+        """
+        Bytes of readings appended but not yet committed to the database
+        """
+        with self._lock:
+            seq, offset = self._checkpoint
+            total = -offset
+            for segment in self._segments:
+                if segment >= seq:
+                    try:
+                        total += os.path.getsize(self._path(segment))
+                    except OSError:
+                        continue
+            return max(0, total)
+
+    def close(self) -> None:
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'appended': self.appended,
+            'drained': self.drained,
+            'syncs': self.syncs,
+            'segments': len(self._segments),
+            'backlog_bytes': self.backlog_bytes(),
+        }
+
+
+class SpoolDrainer:
+    """
+    Background thread writing spooled readings to the database in order
+
+    Args:
+        spool (Spool): Spool to drain
+        write (Callable[..., int]): Writes a list of rows, raising the database's
+            unavailable errors instead of dropping rows (WeatherBatchWriter.write)
+        batch_size (int): Readings written per transaction
+        interval (float): Seconds between checks for new readings when not woken by notify()
+        max_backoff (float): Longest wait between attempts while the database is failing
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        write: Callable[..., int],
+        batch_size: int = config.WRITE_BATCH_SIZE,
+        interval: float = config.SPOOL_DRAIN_INTERVAL,
+        max_backoff: float = config.SPOOL_MAX_BACKOFF,
+    ):
+        self.spool = spool
+        self.write = write
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='spool-drainer', daemon=True)
+        self._thread.start()
+
+    def notify(self) -> None:
+        """
+        Wake the drainer, e.g. after a sweep appended readings
+        """
+        self._wake.set()
+
+    def drain_once(self) -> int:
+        """
+        Write the next batch of spooled readings and advance the checkpoint
+
+        Returns:
+            int: Number of readings taken off the spool
+
+        Raises:
+            SQLAlchemyError: If the database is unavailable; the readings stay spooled
+        """
+        records, position = self.spool.read(self.batch_size)
+        if records:
+            self.write(records, raise_unavailable=True)
+        if position != self.spool.checkpoint:
+            self.spool.commit(position, len(records))
+        return len(records)
+
+    def drain(self) -> int:
+        """
+        Drain until the spool is empty
+        """
+        total = 0
+        while True:
+            count = self.drain_once()
+            total += count
+            if count < self.batch_size:
+                return total
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.drain()
+                self.failures = 0
+                wait = self.interval
+            except SQLAlchemyError as e:
+                self.failures += 1
+                wait = min(self.max_backoff, self.interval * 2 ** self.failures)
+                logger.warning(
+                    f"Database unavailable, {self.spool.backlog_bytes()} spooled bytes waiting; "
+                    f"retrying in {wait:.1f}s: {str(e)}"
+                )
+            except Exception:
+                self.failures += 1
+                wait = self.max_backoff
+                logger.exception("Spool drain failed")
+            # After a failure only a stop ends the wait early, so sweeps do not hammer a failing database
+            if self.failures:
+                self._stop.wait(wait)
+            else:
+                self._wake.wait(wait)
+            self._wake.clear()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """
+        Stop the thread, then write what is still spooled if the database accepts it
+
+        If the thread is still inside a write after timeout, the readings are
+        left spooled for the next start rather than drained a second time
+        alongside it, and the spool is not closed under it.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f"Spool drainer still writing after {timeout}s; leaving "
+                               f"{self.spool.backlog_bytes()} spooled bytes for the next start")
+                return
+        try:
+            self.drain()
+        except SQLAlchemyError as e:
+            logger.warning(f"Readings left in the spool for the next start: {str(e)}")
+        self.spool.close()
@@ -1,11 +1,15 @@
 import streamlit as st
 import requests
-from sqlalchemy.orm import sessionmaker
-from models import WeatherData, DailySummary, engine, WeatherAlert
+import os, sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.models import get_engine
+from app.rollup_tiers import RAW, choose_tier
+from app.latest_weather import get_latest_readings
+from app.queries import convert_temperature_columns, latest_summaries, load_history, recent_alerts
+from app.query_cache import QueryCache, read_data_version
+from app.recent_store import RecentStore
+from app.analytics import period_statistics, rollup_period_statistics
 from datetime import datetime, timedelta
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 
 # Weather icon mapping
 def get_weather_icon(condition):
@@ -114,9 +118,25 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# Initialize database session
-Session = sessionmaker(bind=engine)
-session = Session()
+# Created once per process; reruns reuse the pooled connections
+engine = get_engine()
+
+# Query results are shared by every rerun and viewer until new data is written
+@st.cache_resource
+def get_query_cache():
+    return QueryCache(lambda: read_data_version(engine))
+
+query_cache = get_query_cache()
+
+# The last RECENT_STORE_HOURS of readings are kept in memory and caught up incrementally
+@st.cache_resource
+def get_recent_store():
+    store = RecentStore()
+    store.load(engine)
+    return store
+
+recent_store = get_recent_store()
+recent_store.refresh(engine)
 
 def convert_temperature(temp, unit):
     if unit == 'Fahrenheit':
@@ -153,19 +173,13 @@ col1, col2 = st.columns(2)
 # Current Weather Card
 with col1:
     st.markdown("<h3>Current Weather</h3>", unsafe_allow_html=True)
-    if city == 'All':
-        recent_weather_list = []
-        for city_name in ['Delhi', 'Mumbai', 'Chennai', 'Bangalore', 'Kolkata', 'Hyderabad']:
-            weather = session.query(WeatherData).filter(
-                WeatherData.city == city_name
-            ).order_by(WeatherData.timestamp.desc()).first()
-            if weather:
-                recent_weather_list.append(weather)
-    else:
-        recent_weather = session.query(WeatherData).filter(
-            WeatherData.city == city
-        ).order_by(WeatherData.timestamp.desc()).first()
-        recent_weather_list = [recent_weather] if recent_weather else []
+    selected_cities = ('Delhi', 'Mumbai', 'Chennai', 'Bangalore', 'Kolkata', 'Hyderabad') if city == 'All' else (city,)
+    recent_weather_list = recent_store.latest(selected_cities)
+    if len(recent_weather_list) < len(selected_cities):
+        # Cities without a reading in the store's window
+        recent_weather_list = query_cache.get_or_load(
+            ('latest', selected_cities), lambda: get_latest_readings(engine, selected_cities)
+        )
 
     for recent_weather in recent_weather_list:
         if recent_weather:
@@ -199,19 +213,9 @@ with col1:
 with col2:
     st.markdown("<h3>Daily Summary</h3>", unsafe_allow_html=True)
     
-    if city == 'All':
-        summary_list = []
-        for city_name in ['Delhi', 'Mumbai', 'Chennai', 'Bangalore', 'Kolkata', 'Hyderabad']:
-            summary = session.query(DailySummary).filter(
-                DailySummary.city == city_name
-            ).order_by(DailySummary.date.desc()).first()
-            if summary:
-                summary_list.append(summary)
-    else:
-        daily_summary = session.query(DailySummary).filter(
-            DailySummary.city == city
-        ).order_by(DailySummary.date.desc()).first()
-        summary_list = [daily_summary] if daily_summary else []
+    summary_list = query_cache.get_or_load(
+        ('summary', selected_cities), lambda: latest_summaries(engine, selected_cities)
+    )
 
     for daily_summary in summary_list:
         if daily_summary:
@@ -240,7 +244,7 @@ with col2:
                     </div>
                     <div style="margin-top: 1rem;">
                         <div class="metric-label">Dominant Condition</div>
-                        <div style="font-size: 1.2rem; color: #ffffff;">{daily_summary.dominant_condition}</div>
+                        <div style="font-size: 1.2rem; color: #ffffff;">{daily_summary.dominant_weather}</div>
                     </div>
                 </div>
                 """, unsafe_allow_html=True)
@@ -250,15 +254,10 @@ with col2:
 # Alert Section
 st.markdown("<h3>Weather Alerts</h3>", unsafe_allow_html=True)
 if enable_alerts:
-    if city == 'All':
-        alerts = session.query(WeatherAlert).filter(
-            WeatherAlert.temperature >= temp_threshold
-        ).order_by(WeatherAlert.timestamp.desc()).limit(5).all()
-    else:
-        alerts = session.query(WeatherAlert).filter(
-            WeatherAlert.city == city,
-            WeatherAlert.temperature >= temp_threshold
-        ).order_by(WeatherAlert.timestamp.desc()).limit(5).all()
+    alert_city = None if city == 'All' else city
+    alerts = query_cache.get_or_load(
+        ('alerts', alert_city, temp_threshold), lambda: recent_alerts(engine, temp_threshold, alert_city)
+    )
     
     if alerts:
         for alert in alerts:
@@ -273,29 +272,28 @@ if enable_alerts:
 # Enhanced Data Visualization Section
 st.markdown("<h3>Weather Analysis</h3>", unsafe_allow_html=True)
 
-# Fetch historical data based on selected days
-historical_start = datetime.now() - timedelta(days=days_to_show)
-
-if city == 'All':
-    historical_data = session.query(WeatherData).filter(
-        WeatherData.timestamp >= historical_start
-    ).order_by(WeatherData.timestamp.asc()).all()
+# Long windows are read from a rollup tier so each series stays within DASHBOARD_MAX_POINTS
+tier = choose_tier(timedelta(days=days_to_show))
+history_city = None if city == 'All' else city
+history_start = datetime.now() - timedelta(days=days_to_show)
+# Cities updating faster than RAW_SAMPLE_INTERVAL may have wrapped their buffer within the window
+history_cities = [history_city] if history_city else None
+if tier == RAW and recent_store.covers(history_start, history_cities):
+    df = recent_store.frame(history_start, history_cities)
 else:
-    historical_data = session.query(WeatherData).filter(
-        WeatherData.city == city,
-        WeatherData.timestamp >= historical_start
-    ).order_by(WeatherData.timestamp.asc()).all()
+    df = query_cache.get_or_load(
+        ('history', history_city, days_to_show, tier),
+        lambda: load_history(engine, history_start, history_city, tier),
+    )
 
-if historical_data:
-    df = pd.DataFrame([{
-        'timestamp': data.timestamp,
-        'temperature': convert_temperature(data.temperature, temp_unit),
-        'humidity': data.humidity,
-        'pressure': data.pressure,
-        'feels_like': convert_temperature(data.feels_like, temp_unit),
-        'wind_speed': data.wind_speed,
-        'city': data.city
-    } for data in historical_data])
+if not df.empty:
+    # plotly is only loaded once there is something to chart
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    df = convert_temperature_columns(df, temp_unit)
+    if tier != RAW:
+        st.caption(f"Showing {tier} averages")
     
     # Temperature Trend
     fig_temp = go.Figure()
@@ -377,14 +375,24 @@ if historical_data:
 
     # Daily Statistics Table
     st.markdown("<h3>Daily Statistics</h3>", unsafe_allow_html=True)
-    daily_stats = df.groupby(['city', df['timestamp'].dt.date]).agg({
-        'temperature': ['mean', 'min', 'max'],
-        'humidity': 'mean',
-        'wind_speed': 'mean'
-    }).round(2)
-    
-    daily_stats.columns = ['Avg Temp', 'Min Temp', 'Max Temp', 'Avg Humidity', 'Avg Wind Speed']
-    daily_stats = daily_stats.reset_index()
+    # Tier buckets are combined from their own extremes and count-weighted means, not from bucket means
+    daily_fields = ('temperature', 'humidity', 'wind_speed')
+    if tier == RAW:
+        daily_stats = period_statistics(df, 'D', fields=daily_fields, percentiles=())
+    else:
+        daily_stats = rollup_period_statistics(df, 'D', fields=daily_fields)
+    daily_stats = daily_stats.rename(columns={
+        'period': 'timestamp',
+        'temperature_mean': 'Avg Temp',
+        'temperature_min': 'Min Temp',
+        'temperature_max': 'Max Temp',
+        'humidity_mean': 'Avg Humidity',
+        'wind_speed_mean': 'Avg Wind Speed',
+    })
+    daily_stats['timestamp'] = daily_stats['timestamp'].dt.date
+    daily_stats = daily_stats[
+        ['city', 'timestamp', 'Avg Temp', 'Min Temp', 'Max Temp', 'Avg Humidity', 'Avg Wind Speed']
+    ].round(2)
     
     st.dataframe(daily_stats, use_container_width=True)
 
@@ -394,5 +402,3 @@ else:
 # Footer with last update time
 st.markdown("<br>", unsafe_allow_html=True)
 st.markdown(f"<div style='text-align: center; color: #bababa;'>Last updated: {datetime.now().strftime('%I:%M %p, %b %d, %Y')}</div>", unsafe_allow_html=True)
-
-session.close()
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""
+Compare the per-reading statistics loops with the vectorized app.analytics path
+
+Builds a synthetic batch of readings for every city and times, for each
+statistic, the Python loop it used to be computed with against the columnar
+version, checking both give the same answer:
+
+    daily     per-city daily mean/min/max and dominant condition (the old
+              daily summary loop) vs analytics.period_statistics and
+              dominant_conditions
+    rollup    the old per-reading rollup bucket fold vs
+              rollup_tiers.aggregate_readings
+    slopes    per-city least-squares trend slopes vs analytics.trend_slopes
+
+    python -m benchmarks.bench_analytics --cities 100 --days 7 --interval 600
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cities', type=int, default=100)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--interval', type=int, default=600, help='Seconds between readings per city')
+    parser.add_argument('--repeat', type=int, default=3)
+    return parser.parse_args()
+
+def synthetic_readings(cities, days, interval):
+    import numpy as np
+
+    start = datetime(2024, 10, 1)
+    steps = days * 86400 // interval
+    rng = np.random.default_rng(42)
+    conditions = np.array(['Clear', 'Clouds', 'Haze', 'Rain'])
+    timestamps = [start + timedelta(seconds=interval * step) for step in range(steps)]
+    rows = []
+    for index in range(cities):
+        temperatures = 25 + 8 * np.sin(np.arange(steps) / 24 + index) + rng.normal(0, 1, steps)
+        humidity = rng.uniform(30, 90, steps)
+        weather = conditions[rng.integers(0, len(conditions), steps)]
+        for timestamp, temperature, relative, condition in zip(timestamps, temperatures, humidity, weather):
+            rows.append({
+                'city': f'City{index}',
+                'timestamp': timestamp,
+                'temperature': float(temperature),
+                'feels_like': float(temperature) + 1.5,
+                'humidity': None if relative > 85 else float(relative),
+                'wind_speed': 3.0,
+                'weather_main': str(condition),
+            })
+    return rows
+
+def loop_daily(rows):
+    """The old daily summary loop, run for every city and day"""
+    by_day = {}
+    for row in rows:
+        by_day.setdefault((row['city'], row['timestamp'].date()), []).append(row)
+    summaries = {}
+    for key, data in by_day.items():
+        condition_counts = {}
+        for entry in sorted(data, key=lambda entry: entry['weather_main']):
+            condition_counts[entry['weather_main']] = condition_counts.get(entry['weather_main'], 0) + 1
+        summaries[key] = (
+            sum([entry['temperature'] for entry in data]) / len(data),
+            min([entry['temperature'] for entry in data]),
+            max([entry['temperature'] for entry in data]),
+            max(condition_counts, key=condition_counts.get),
+        )
+    return summaries
+
+def vectorized_daily(df):
+    from app.analytics import dominant_conditions, period_statistics
+
+    stats = period_statistics(df, 'D', percentiles=())
+    dominant = dominant_conditions(df, 'D')
+    return {
+        (city, period.date()): (mean, low, high, condition)
+        for city, period, mean, low, high, condition in zip(
+            stats['city'], stats['period'], stats['temperature_mean'], stats['temperature_min'],
+            stats['temperature_max'], dominant['weather_main'],
+        )
+    }
+
+def loop_rollup(rows, width):
+    """The old rollup fold: one dict update per reading and field"""
+    from app.rollup_tiers import FIELDS, NULLABLE_FIELDS, bucket_start
+
+    buckets = {}
+    for row in rows:
+        key = (row['city'], bucket_start(row['timestamp'], width))
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {'city': key[0], 'bucket_start': key[1], 'reading_count': 0}
+            for field in FIELDS:
+                bucket.update({f'{field}_sum': 0.0, f'{field}_min': None, f'{field}_max': None})
+                if field in NULLABLE_FIELDS:
+                    bucket[f'{field}_count'] = 0
+        bucket['reading_count'] += 1
+        for field in FIELDS:
+            value = row.get(field)
+            if value is None:
+                continue
+            bucket[f'{field}_sum'] += value
+            if field in NULLABLE_FIELDS:
+                bucket[f'{field}_count'] += 1
+            low, high = bucket[f'{field}_min'], bucket[f'{field}_max']
+            bucket[f'{field}_min'] = value if low is None else min(low, value)
+            bucket[f'{field}_max'] = value if high is None else max(high, value)
+    return sorted(buckets.values(), key=lambda bucket: (bucket['city'], bucket['bucket_start']))
+
+def loop_slopes(rows):
+    """Per-city least squares with plain Python sums"""
+    series = {}
+    origin = min(row['timestamp'] for row in rows)
+    for row in rows:
+        series.setdefault(row['city'], []).append(((row['timestamp'] - origin) / timedelta(days=1), row['temperature']))
+    slopes = {}
+    for city, points in series.items():
+        mean_x = sum(x for x, _ in points) / len(points)
+        mean_y = sum(y for _, y in points) / len(points)
+        slopes[city] = (
+            sum((x - mean_x) * (y - mean_y) for x, y in points) / sum((x - mean_x) ** 2 for x, _ in points)
+        )
+    return slopes
+
+def timed(function, *args, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+def same_values(left, right):
+    import math
+
+    if isinstance(left, dict):
+        return left.keys() == right.keys() and all(same_values(left[key], right[key]) for key in left)
+    if isinstance(left, (list, tuple)):
+        return len(left) == len(right) and all(same_values(a, b) for a, b in zip(left, right))
+    if isinstance(left, float) or isinstance(right, float):
+        return math.isclose(left, right, rel_tol=1e-9, abs_tol=1e-9)
+    return left == right
+
+def main():
+    args = parse_args()
+    scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+    os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import pandas as pd
+    from app.analytics import trend_slopes
+    from app.rollup_tiers import aggregate_readings
+
+    rows = synthetic_readings(args.cities, args.days, args.interval)
+    df = pd.DataFrame(rows)
+    df['city'] = df['city'].astype('category')
+    print(f"{len(rows):,} readings for {args.cities} cities over {args.days} days")
+
+    width = timedelta(minutes=15)
+    cases = (
+        ('daily', (loop_daily, rows), (vectorized_daily, df)),
+        ('rollup', (loop_rollup, rows, width), (aggregate_readings, rows, width)),
+        ('slopes', (loop_slopes, rows), (lambda frame: trend_slopes(frame).to_dict(), df)),
+    )
+    for name, (loop, *loop_args), (vectorized, *vectorized_args) in cases:
+        loop_seconds, expected = timed(loop, *loop_args, repeat=args.repeat)
+        vectorized_seconds, actual = timed(vectorized, *vectorized_args, repeat=args.repeat)
+        match = 'ok' if same_values(expected, actual) else 'MISMATCH'
+        print(f"{name:>7}: loop {loop_seconds * 1000:8.1f} ms  vectorized {vectorized_seconds * 1000:8.1f} ms  "
+              f"speedup {loop_seconds / vectorized_seconds:5.1f}x  {match}")
+
+    os.unlink(scratch.name)
+
+if __name__ == '__main__':
+    main()
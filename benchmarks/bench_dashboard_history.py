@@ -0,0 +1,130 @@
+"""
+Compare the dashboard's old ORM history load with the columnar read path
+
+Loads a synthetic history into a scratch SQLite database (or --database-url)
+and times both paths for the 30-day "All cities" view, reporting wall time
+and peak Python memory.
+
+    python -m benchmarks.bench_dashboard_history --days 30 --interval 60
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Database to load into (default: scratch SQLite file)')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--cities', type=int, default=6)
+    parser.add_argument('--interval', type=int, default=60, help='Seconds between readings per city')
+    parser.add_argument('--repeat', type=int, default=3)
+    return parser.parse_args()
+
+def populate(engine, cities, start, end, interval):
+    import numpy as np
+    from sqlalchemy import insert
+    from app.models import WeatherData
+
+    timestamps = np.arange(start, end, timedelta(seconds=interval)).astype(datetime)
+    rng = np.random.default_rng(42)
+    rows = 0
+    with engine.begin() as connection:
+        for city in cities:
+            temperatures = 25 + 8 * np.sin(np.arange(len(timestamps)) / 240) + rng.normal(0, 1, len(timestamps))
+            batch = [{
+                'city': city,
+                'temperature': float(temperature),
+                'feels_like': float(temperature) + 1.5,
+                'humidity': 60.0,
+                'pressure': 1010.0,
+                'wind_speed': 3.0,
+                'weather_main': 'Clear',
+                'timestamp': timestamp,
+            } for timestamp, temperature in zip(timestamps, temperatures)]
+            connection.execute(insert(WeatherData.__table__), batch)
+            rows += len(batch)
+    return rows
+
+def orm_history(engine, start, unit):
+    """The dashboard's original path: hydrate ORM rows, rebuild dicts, convert per value"""
+    import pandas as pd
+    from sqlalchemy.orm import Session
+    from app.models import WeatherData
+
+    def convert_temperature(temp, unit):
+        if unit == 'Fahrenheit':
+            return (temp * 9/5) + 32
+        return temp
+
+    with Session(engine) as session:
+        historical_data = session.query(WeatherData).filter(
+            WeatherData.timestamp >= start
+        ).order_by(WeatherData.timestamp.asc()).all()
+        return pd.DataFrame([{
+            'timestamp': data.timestamp,
+            'temperature': convert_temperature(data.temperature, unit),
+            'humidity': data.humidity,
+            'pressure': data.pressure,
+            'feels_like': convert_temperature(data.feels_like, unit),
+            'wind_speed': data.wind_speed,
+            'city': data.city
+        } for data in historical_data])
+
+def columnar_history(engine, start, unit):
+    from app.queries import convert_temperature_columns, load_history
+    return convert_temperature_columns(load_history(engine, start), unit)
+
+def measure(function, *args, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak, len(result)
+
+def main():
+    args = parse_args()
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from app.migrations import migrate
+    from app.models import get_engine
+
+    engine = get_engine()
+    migrate(engine)
+
+    end = datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=args.days)
+    cities = [f'City{i}' for i in range(args.cities)]
+    started = time.perf_counter()
+    rows = populate(engine, cities, start, end, args.interval)
+    print(f"Loaded {rows:,} readings in {time.perf_counter() - started:.1f}s")
+
+    results = {}
+    for name, function in (('orm', orm_history), ('columnar', columnar_history)):
+        seconds, peak, count = measure(function, engine, start, 'Fahrenheit', repeat=args.repeat)
+        results[name] = (seconds, peak)
+        print(f"{name:>9}: {seconds:7.2f}s  peak {peak / 2**20:8.1f} MiB  rows {count:,}")
+
+    print(f"  speedup: {results['orm'][0] / results['columnar'][0]:.1f}x time, "
+          f"{results['orm'][1] / results['columnar'][1]:.1f}x memory")
+
+    if scratch is not None:
+        engine.dispose()
+        os.unlink(scratch.name)
+
+if __name__ == '__main__':
+    main()
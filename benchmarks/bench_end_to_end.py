@@ -0,0 +1,170 @@
+"""
+End-to-end ingestion throughput benchmark
+
+Starts a local stub of the OpenWeatherMap API serving N synthetic cities with
+configurable latency and failure rate, points the app at it and a scratch
+SQLite database (or --database-url, e.g. a local PostgreSQL), then runs
+fetch_weather_data for a number of sweeps followed by calculate_daily_summary
+and check_thresholds. Reports readings/s, p50/p99 sweep and request latency,
+database commits and statements, and peak RSS.
+
+    python -m benchmarks.bench_end_to_end --cities 2000 --sweeps 5 --latency 0.05 --failure-rate 0.01
+    python -m benchmarks.bench_end_to_end --group --json results.json
+
+The stub's observation time advances by --step seconds between sweeps, so
+every sweep writes a fresh observation for each city.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Database to write to (default: scratch SQLite file)')
+    parser.add_argument('--cities', type=int, default=2000)
+    parser.add_argument('--sweeps', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.02, help='Base upstream latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.03, help='Extra random upstream latency in seconds')
+    parser.add_argument('--failure-rate', type=float, default=0.01, help='Share of upstream requests that fail')
+    parser.add_argument('--concurrency', type=int, help='FETCH_CONCURRENCY (default: config)')
+    parser.add_argument('--rate-limit', type=float, default=0, help='FETCH_RATE_LIMIT, 0 disables')
+    parser.add_argument('--deadline', type=float, default=600, help='SWEEP_DEADLINE in seconds')
+    parser.add_argument('--group', action='store_true', help='Fetch through the group endpoint')
+    parser.add_argument('--step', type=int, default=600, help='Seconds the observation time advances per sweep')
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='Keep the application logs')
+    return parser.parse_args()
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2**20 if sys.platform == 'darwin' else 2**10)
+
+def configure(args, scratch_dir, stub_url):
+    """Point config at the stub and scratch database before the app is imported."""
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(scratch_dir, 'bench.db')}"
+    os.environ['OPENWEATHER_BASE_URL'] = stub_url
+    os.environ['OPENWEATHER_API_KEY'] = 'benchmark'
+    os.environ['FETCH_RATE_LIMIT'] = str(args.rate_limit)
+    os.environ['SWEEP_DEADLINE'] = str(args.deadline)
+    os.environ['USE_GROUP_ENDPOINT'] = 'true' if args.group else 'false'
+    os.environ['CITY_ID_CACHE'] = os.path.join(scratch_dir, 'city_ids.json')
+    # Every sweep must reach the stub instead of the response cache
+    os.environ['RESPONSE_CACHE_TTL'] = '0'
+    if args.concurrency:
+        os.environ['FETCH_CONCURRENCY'] = str(args.concurrency)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run(args, stub):
+    from sqlalchemy import event
+    from app.api import fetch_weather_data
+    from app.data_processor import calculate_daily_summary, check_thresholds
+    from app.migrations import migrate
+    from app.models import get_engine
+
+    engine = get_engine()
+    migrate(engine)
+
+    counts = {'commits': 0, 'statements': 0}
+    event.listen(engine, 'commit', lambda connection: counts.__setitem__('commits', counts['commits'] + 1))
+    event.listen(engine, 'after_cursor_execute',
+                 lambda *args: counts.__setitem__('statements', counts['statements'] + 1))
+
+    cities = list(stub.city_ids)
+    stub.now = int(time.time()) - args.sweeps * args.step
+    if args.group:
+        # Resolve ids up front so the first sweep is comparable with the rest
+        from app.api import resolve_city_ids
+        resolve_city_ids(cities)
+
+    sweeps, latencies, fetched, failed = [], [], 0, 0
+    for _ in range(args.sweeps):
+        started = time.perf_counter()
+        report = fetch_weather_data(cities)
+        sweeps.append(time.perf_counter() - started)
+        latencies.extend(report.latencies.values())
+        fetched += len(report.fetched)
+        failed += len(report.failed) + len(report.skipped)
+        stub.now += args.step
+    ingest_commits, ingest_statements = counts['commits'], counts['statements']
+
+    started = time.perf_counter()
+    calculate_daily_summary()
+    summary_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    alerts = check_thresholds()
+    alert_seconds = time.perf_counter() - started
+
+    return {
+        'cities': len(cities),
+        'sweeps': args.sweeps,
+        'readings': fetched,
+        'failed': failed,
+        'readings_per_second': fetched / sum(sweeps),
+        'sweep_p50_seconds': percentile(sweeps, 0.5),
+        'sweep_p99_seconds': percentile(sweeps, 0.99),
+        'request_p50_seconds': percentile(latencies, 0.5),
+        'request_p99_seconds': percentile(latencies, 0.99),
+        'ingest_commits': ingest_commits,
+        'ingest_statements': ingest_statements,
+        'commits': counts['commits'],
+        'statements': counts['statements'],
+        'daily_summary_seconds': summary_seconds,
+        'check_thresholds_seconds': alert_seconds,
+        'alerts': alerts,
+        'upstream_requests': sum(stub.requests.values()),
+        'upstream_failures': stub.failures,
+        'peak_rss_mib': peak_rss_mib(),
+    }
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from tests.stub_server import StubWeatherServer, synthetic_cities
+
+    with tempfile.TemporaryDirectory() as scratch_dir, StubWeatherServer(
+        synthetic_cities(args.cities),
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        realistic=True,
+        seed=42,
+    ) as stub:
+        configure(args, scratch_dir, stub.url)
+        if not args.verbose:
+            # Injected upstream failures are logged as errors; keep the report readable
+            logging.disable(logging.ERROR)
+        results = run(args, stub)
+        from app.models import get_engine
+        get_engine().dispose()
+
+    mode = 'group' if args.group else 'per-city'
+    print(f"{results['cities']:,} cities x {results['sweeps']} sweeps ({mode}), "
+          f"{results['upstream_failures']:,}/{results['upstream_requests']:,} upstream requests failed")
+    print(f"  readings        {results['readings']:,} fetched, {results['failed']:,} failed or skipped")
+    print(f"  throughput      {results['readings_per_second']:,.0f} readings/s")
+    print(f"  sweep           p50 {results['sweep_p50_seconds']:.2f}s  p99 {results['sweep_p99_seconds']:.2f}s")
+    print(f"  request         p50 {results['request_p50_seconds'] * 1000:.0f}ms  "
+          f"p99 {results['request_p99_seconds'] * 1000:.0f}ms")
+    print(f"  database        {results['ingest_commits']:,} commits, {results['ingest_statements']:,} statements "
+          f"during ingestion ({results['commits']:,} / {results['statements']:,} total)")
+    print(f"  daily summary   {results['daily_summary_seconds']:.2f}s")
+    print(f"  alerts          {results['alerts']:,} written in {results['check_thresholds_seconds']:.2f}s")
+    print(f"  peak RSS        {results['peak_rss_mib']:.0f} MiB")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Measure cold-start import time of the scheduler, the dashboard and the tests
+
+Each entry point is imported in a fresh interpreter under `python -X importtime`,
+without a reachable database, and the best of --repeat runs is reported
+together with the modules that cost the most. With --budget the script
+exits non-zero when any entry point takes longer, so it can guard CI. It
+always exits non-zero when an entry point imports a module it must not, such
+as pandas in the dashboard, which loads it only once a chart is drawn.
+
+    python -m benchmarks.bench_importtime --repeat 5 --budget 1500
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Entry point -> modules it imports at startup. The dashboard script itself
+# runs Streamlit calls at import, so its app modules are imported instead.
+ENTRY_POINTS = {
+    'scheduler': ['app.scheduler'],
+    'dashboard': ['app.queries', 'app.query_cache', 'app.recent_store', 'app.latest_weather',
+                  'app.rollup_tiers', 'app.analytics'],
+    'tests': ['tests.helpers', 'app.api', 'app.data_processor'],
+}
+
+# Entry point -> top-level packages it must not import at startup
+FORBIDDEN = {
+    'dashboard': ['pandas'],
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=8, help='Slowest modules listed per entry point')
+    parser.add_argument('--budget', type=float, help='Fail if an entry point takes longer, in milliseconds')
+    return parser.parse_args()
+
+def import_times(modules: List[str]) -> Tuple[float, Dict[str, float]]:
+    """
+    Import modules in a fresh interpreter
+
+    Returns:
+        Tuple[float, Dict[str, float]]: Total milliseconds and self milliseconds per module
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    # Importing must not need the database; point it somewhere that cannot be opened
+    env['DATABASE_URL'] = 'sqlite:////nonexistent/weather.db'
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', '; '.join(f'import {module}' for module in modules)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    total = 0.0
+    self_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        self_times[name.strip()] = int(own) / 1000
+        # Nested imports are indented by two more spaces per level
+        if not name[1:].startswith(' '):
+            total += int(cumulative) / 1000
+    return total, self_times
+
+def main():
+    args = parse_args()
+    failed = []
+    forbidden = []
+    for name, modules in ENTRY_POINTS.items():
+        runs = [import_times(modules) for _ in range(args.repeat)]
+        total, self_times = min(runs, key=lambda run: run[0])
+        print(f"{name:>9}: {total:8.1f} ms  ({', '.join(modules)})")
+        for module, milliseconds in sorted(self_times.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"{'':>11}{milliseconds:8.1f} ms  {module}")
+        if args.budget is not None and total > args.budget:
+            failed.append(name)
+        imported = [package for package in FORBIDDEN.get(name, []) if package in self_times]
+        if imported:
+            print(f"{'':>11}imports {', '.join(imported)}, which it must not load at startup")
+            forbidden.append(name)
+
+    if failed:
+        print(f"Over the {args.budget:g} ms budget: {', '.join(failed)}")
+    if forbidden:
+        print(f"Importing forbidden modules: {', '.join(forbidden)}")
+    if failed or forbidden:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
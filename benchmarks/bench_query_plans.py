@@ -0,0 +1,222 @@
+"""
+Query plan and latency regression checks for the hot queries
+
+Loads a synthetic multi-city history into a scratch SQLite database (or
+--database-url, e.g. PostgreSQL), then for every hot query checks that its
+EXPLAIN plan reads through the expected index without a full scan (and,
+for top-N queries, without an explicit sort), and that its median latency
+stays within budget.
+
+    python -m benchmarks.bench_query_plans --rows 2000000
+    python -m benchmarks.bench_query_plans --database-url postgresql+psycopg2://...
+
+Exits with status 1 if any check fails.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', help='Database to load into (default: scratch SQLite file)')
+    parser.add_argument('--rows', type=int, default=2000000, help='Readings to load across all cities')
+    parser.add_argument('--cities', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--budget-ms', type=float, default=25, help='Median latency budget per query')
+    return parser.parse_args()
+
+def hot_queries(now, city='City0', threshold=35):
+    """
+    (name, statement, expected index, top-N) for every query the dashboard and rollups run per request
+
+    Top-N queries must be answered in index order; the others may sort the
+    rows the index matched, which PostgreSQL prefers after a bitmap scan or
+    across partitions.
+    """
+    from sqlalchemy import select
+    from app.models import WeatherData
+    from app.queries import history_statement, recent_alerts_statement
+    from app.rollup_tiers import RAW
+
+    day = datetime.combine(now.date(), datetime.min.time()) - timedelta(days=1)
+    return [
+        ('latest reading for a city',
+         select(WeatherData.__table__).where(WeatherData.city == city)
+         .order_by(WeatherData.timestamp.desc()).limit(1),
+         'ix_weather_data_city_timestamp', True),
+        ('7-day history for a city',
+         history_statement(now - timedelta(days=7), city, RAW),
+         'ix_weather_data_city_timestamp', False),
+        ('one day of readings for a city',
+         select(WeatherData.temperature, WeatherData.weather_main)
+         .where(WeatherData.city == city, WeatherData.timestamp >= day, WeatherData.timestamp < day + timedelta(days=1)),
+         'ix_weather_data_city_timestamp', False),
+        ('alerts for a city',
+         recent_alerts_statement(threshold, city),
+         'ix_weather_alerts_high_temperature_city_timestamp', True),
+        ('alerts for all cities',
+         recent_alerts_statement(threshold),
+         'ix_weather_alerts_timestamp', True),
+    ]
+
+def _sqlite_plan(connection, sql):
+    details = [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+    indexes = {detail.split(' USING INDEX ')[1].split()[0] for detail in details if ' USING INDEX ' in detail}
+    indexes |= {detail.split(' USING COVERING INDEX ')[1].split()[0] for detail in details if ' USING COVERING INDEX ' in detail}
+    scans = [detail for detail in details if detail.startswith('SCAN ') and ' INDEX ' not in detail]
+    sorts = [detail for detail in details if 'TEMP B-TREE' in detail]
+    return details, indexes, scans, sorts
+
+def _postgresql_plan(connection, sql):
+    plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {sql}').scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes, stack = [], [plan[0]['Plan']]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.get('Plans', []))
+
+    indexes = set()
+    for node in nodes:
+        name = node.get('Index Name')
+        if name:
+            # Indexes on partitions are named after the partition; report the parent index
+            parent = connection.exec_driver_sql(
+                "SELECT p.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE c.relname = %(name)s",
+                {'name': name},
+            ).scalar()
+            indexes.add(parent or name)
+    details = [f"{node['Node Type']} {node.get('Relation Name') or node.get('Index Name') or ''}".strip() for node in nodes]
+    scans = [f"Seq Scan {node.get('Relation Name')}" for node in nodes if node['Node Type'] == 'Seq Scan']
+    sorts = [node['Node Type'] for node in nodes if node['Node Type'] in ('Sort', 'Incremental Sort')]
+    return details, indexes, scans, sorts
+
+def explain(connection, statement):
+    """
+    Return (plan lines, indexes used, full scans, sorts) for a statement
+    """
+    sql = str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+    if connection.dialect.name == 'postgresql':
+        return _postgresql_plan(connection, sql)
+    return _sqlite_plan(connection, sql)
+
+def check_plans(engine, now=None):
+    """
+    Check every hot query's plan
+
+    Returns:
+        list: (query name, problem) pairs, empty when every plan is as expected
+    """
+    failures = []
+    with engine.connect() as connection:
+        for name, statement, index, top_n in hot_queries(now or datetime.now()):
+            details, indexes, scans, sorts = explain(connection, statement)
+            if index not in indexes:
+                failures.append((name, f"expected {index}, plan was {details}"))
+            if scans:
+                failures.append((name, f"full scan: {scans}"))
+            if top_n and sorts:
+                failures.append((name, f"explicit sort: {sorts}"))
+    return failures
+
+def populate(engine, rows, cities, end, interval=timedelta(minutes=10)):
+    """Load rows readings spread across cities, plus an alert for every hot reading."""
+    import numpy as np
+    from sqlalchemy import insert
+    from sqlalchemy.orm import Session
+    from app.batch_writer import insert_readings
+    from app.models import HIGH_TEMPERATURE, WeatherAlert
+
+    per_city = rows // cities
+    rng = np.random.default_rng(42)
+    offsets = np.arange(per_city)[::-1]
+    chunk = 10000
+    for number in range(cities):
+        city = f'City{number}'
+        temperatures = 28 + 8 * np.sin(offsets / 72) + rng.normal(0, 1.5, per_city)
+        for start in range(0, per_city, chunk):
+            batch = [{
+                'city': city,
+                'temperature': float(temperature),
+                'feels_like': float(temperature) + 1.5,
+                'humidity': 60.0,
+                'pressure': 1010.0,
+                'wind_speed': 3.0,
+                'weather_main': 'Clear',
+                'timestamp': end - interval * int(offset),
+            } for offset, temperature in zip(offsets[start:start + chunk], temperatures[start:start + chunk])]
+            alerts = [{
+                'city': city,
+                'alert_type': HIGH_TEMPERATURE,
+                'message': f"{city} temperature exceeded 35°C for 2 consecutive updates",
+                'temperature': row['temperature'],
+                'consecutive_count': 2,
+                'timestamp': row['timestamp'],
+            } for row in batch if row['temperature'] > 37]
+            with Session(engine) as session:
+                insert_readings(session, batch)
+                if alerts:
+                    session.execute(insert(WeatherAlert.__table__), alerts)
+                session.commit()
+    with engine.begin() as connection:
+        connection.exec_driver_sql('ANALYZE')
+    return per_city * cities
+
+def measure(engine, statement, repeat):
+    timings = []
+    with engine.connect() as connection:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            connection.execute(statement).all()
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+def main():
+    args = parse_args()
+    scratch = None
+    if args.database_url:
+        os.environ['DATABASE_URL'] = args.database_url
+    else:
+        scratch = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        os.environ['DATABASE_URL'] = f'sqlite:///{scratch.name}'
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from app.migrations import migrate
+    from app.models import get_engine
+
+    engine = get_engine()
+    migrate(engine)
+
+    now = datetime.now().replace(microsecond=0)
+    started = time.perf_counter()
+    rows = populate(engine, args.rows, args.cities, now)
+    print(f"Loaded {rows:,} readings for {args.cities} cities in {time.perf_counter() - started:.1f}s")
+
+    failures = check_plans(engine, now)
+    for name, statement, _, _ in hot_queries(now):
+        latency = measure(engine, statement, args.repeat)
+        status = 'ok'
+        if any(failure[0] == name for failure in failures):
+            status = 'PLAN'
+        if latency > args.budget_ms:
+            failures.append((name, f"median {latency:.1f} ms over the {args.budget_ms:g} ms budget"))
+            status = 'SLOW'
+        print(f"{status:>5}  {latency:8.2f} ms  {name}")
+
+    for name, problem in failures:
+        print(f"FAIL {name}: {problem}")
+
+    if scratch is not None:
+        engine.dispose()
+        os.unlink(scratch.name)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -11,3 +11,112 @@ EMAIL_PASSWORD = os.getenv('EMAIL_PASSWORD')
 CITIES = ['Delhi', 'Mumbai', 'Chennai', 'Bangalore', 'Kolkata', 'Hyderabad']
 TEMP_THRESHOLD = float(os.getenv('TEMP_THRESHOLD', 35))
 REQUEST_INTERVAL = 0.1 
+
+# Ingestion sweep settings
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', 8))
+FETCH_RATE_LIMIT = float(os.getenv('FETCH_RATE_LIMIT', 10))  # requests per second per host, 0 disables
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 10))
+SWEEP_DEADLINE = float(os.getenv('SWEEP_DEADLINE', REQUEST_INTERVAL * 60))  # seconds
+
+# Batched database writes
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', 500))
+WRITE_BATCH_MAX_AGE = float(os.getenv('WRITE_BATCH_MAX_AGE', 0))  # seconds, 0 flushes after every sweep
+
+# Pooled HTTP client and upstream response cache
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 4))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', FETCH_CONCURRENCY))
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', 60))  # seconds
+
+# Upstream retries, circuit breakers and hedged requests
+CONNECT_TIMEOUT = float(os.getenv('CONNECT_TIMEOUT', 3.05))  # seconds to establish a connection
+READ_TIMEOUT = float(os.getenv('READ_TIMEOUT', REQUEST_TIMEOUT))  # seconds to wait for response data
+RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', 3))  # attempts per request, the first included
+RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 0.25))  # seconds, doubled per retry with full jitter
+RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 4))  # seconds
+RETRY_AFTER_MAX = float(os.getenv('RETRY_AFTER_MAX', 30))  # longest Retry-After waited for, longer ones fail at once
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))  # consecutive failures that open an endpoint's breaker
+BREAKER_RESET = float(os.getenv('BREAKER_RESET', 30))  # seconds before an open breaker lets a trial request through
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 0))  # latency percentile that triggers a second request, 0 disables
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))  # latencies needed per endpoint before hedging
+
+# Adaptive per-city polling
+ADAPTIVE_POLLING = os.getenv('ADAPTIVE_POLLING', 'true').lower() == 'true'  # false polls every city on every tick
+POLL_GRACE = float(os.getenv('POLL_GRACE', 30))  # seconds after a city's expected update before polling it
+POLL_RETRY_INTERVAL = float(os.getenv('POLL_RETRY_INTERVAL', RESPONSE_CACHE_TTL))  # first retry delay, doubled per miss
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', 3600))  # seconds
+POLL_PRIORITY_MARGIN = float(os.getenv('POLL_PRIORITY_MARGIN', 2))  # °C below TEMP_THRESHOLD that prioritises a city
+POLL_PRIORITY_FACTOR = float(os.getenv('POLL_PRIORITY_FACTOR', 0.5))  # retry delay multiplier for prioritised cities
+
+# Multi-city group endpoint
+OPENWEATHER_BASE_URL = os.getenv('OPENWEATHER_BASE_URL', 'http://api.openweathermap.org')
+USE_GROUP_ENDPOINT = os.getenv('USE_GROUP_ENDPOINT', 'false').lower() == 'true'
+GROUP_CHUNK_SIZE = 20  # maximum number of ids the group endpoint accepts
+CITY_ID_CACHE = os.getenv('CITY_ID_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'city_ids.json'))
+
+# Daily summary rollups
+ROLLUP_INTERVAL = float(os.getenv('ROLLUP_INTERVAL', 5))  # minutes between incremental updates
+ROLLUP_GAP_TIMEOUT = float(os.getenv('ROLLUP_GAP_TIMEOUT', 900))  # seconds an id skipped by a fold is waited for
+ROLLUP_CHUNK_SIZE = int(os.getenv('ROLLUP_CHUNK_SIZE', 50000))  # readings folded per transaction
+ROLLUP_MAX_GAPS = int(os.getenv('ROLLUP_MAX_GAPS', 1000))  # skipped id runs waited for at once
+
+# Streaming alert evaluation
+ALERT_RULES_REFRESH = float(os.getenv('ALERT_RULES_REFRESH', 300))  # seconds between AlertConfig reloads
+
+# Time-partitioned storage and retention
+PARTITION_PERIOD = os.getenv('PARTITION_PERIOD', '')  # 'day', 'week' or empty for a single table
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 30))
+RETENTION_CHUNK_SIZE = int(os.getenv('RETENTION_CHUNK_SIZE', 5000))
+ROLLUP_15M_RETENTION_DAYS = int(os.getenv('ROLLUP_15M_RETENTION_DAYS', 90))
+ROLLUP_HOURLY_RETENTION_DAYS = int(os.getenv('ROLLUP_HOURLY_RETENTION_DAYS', 730))
+CONDITION_ROLLUP_RETENTION_DAYS = int(os.getenv('CONDITION_ROLLUP_RETENTION_DAYS', RETENTION_DAYS))  # daily_condition_rollup
+
+# Downsampled rollup tiers for the dashboard
+DASHBOARD_MAX_POINTS = int(os.getenv('DASHBOARD_MAX_POINTS', 2000))  # per series
+RAW_SAMPLE_INTERVAL = float(os.getenv('RAW_SAMPLE_INTERVAL', 600))  # seconds between stored observations per city
+
+# Dashboard query cache
+DASHBOARD_CACHE_TTL = float(os.getenv('DASHBOARD_CACHE_TTL', 300))  # seconds
+DASHBOARD_CACHE_SIZE = int(os.getenv('DASHBOARD_CACHE_SIZE', 128))  # cached query results
+DATA_VERSION_CHECK_INTERVAL = float(os.getenv('DATA_VERSION_CHECK_INTERVAL', 5))  # seconds
+
+# Job scheduler
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', 4))  # raised to the number of jobs if lower
+SCHEDULER_STATS_INTERVAL = float(os.getenv('SCHEDULER_STATS_INTERVAL', 900))  # seconds between job stats logs
+
+# Sharded ingestion across scheduler processes
+SHARDED_INGESTION = os.getenv('SHARDED_INGESTION', 'false').lower() == 'true'
+WORKER_ID = os.getenv('WORKER_ID')  # defaults to <hostname>-<pid>
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv('SHARD_HEARTBEAT_INTERVAL', 10))  # seconds
+SHARD_LEASE_TTL = float(os.getenv('SHARD_LEASE_TTL', 30))  # seconds without a heartbeat before a worker is dropped
+SHARD_RING_REPLICAS = int(os.getenv('SHARD_RING_REPLICAS', 64))  # virtual nodes per worker
+
+# Alert email notifications
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', 'true').lower() == 'true'
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', 10))  # seconds
+SMTP_IDLE_TIMEOUT = float(os.getenv('SMTP_IDLE_TIMEOUT', 60))  # seconds an unused connection is kept open
+ALERT_DIGEST_WINDOW = float(os.getenv('ALERT_DIGEST_WINDOW', 30))  # seconds of alerts collected into one email
+ALERT_EMAIL_MIN_INTERVAL = float(os.getenv('ALERT_EMAIL_MIN_INTERVAL', 300))  # seconds between emails to one recipient
+ALERT_EMAIL_RETRIES = int(os.getenv('ALERT_EMAIL_RETRIES', 5))
+ALERT_EMAIL_BACKOFF = float(os.getenv('ALERT_EMAIL_BACKOFF', 5))  # seconds before the first retry, doubled per retry
+
+# In-process store of recent readings
+RECENT_STORE_HOURS = float(os.getenv('RECENT_STORE_HOURS', 24))  # hours of readings kept per city
+RECENT_STORE_REFRESH = float(os.getenv('RECENT_STORE_REFRESH', 5))  # seconds between dashboard catch-up queries
+
+# Local write-ahead spool between ingestion and the database
+SPOOL_DIR = os.getenv('SPOOL_DIR', '')  # empty writes readings to the database from the sweep
+SPOOL_SEGMENT_BYTES = int(os.getenv('SPOOL_SEGMENT_BYTES', 16 * 1024 * 1024))  # size at which a new segment starts
+SPOOL_FSYNC_INTERVAL = float(os.getenv('SPOOL_FSYNC_INTERVAL', 1))  # seconds between fsyncs, besides one per sweep
+SPOOL_DRAIN_INTERVAL = float(os.getenv('SPOOL_DRAIN_INTERVAL', 1))  # seconds between drains when not woken by a sweep
+SPOOL_MAX_BACKOFF = float(os.getenv('SPOOL_MAX_BACKOFF', 60))  # longest wait between drains while the database fails
+
+# Cold archive of expired rows as Parquet (requires pyarrow)
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '')  # empty deletes expired rows without archiving
+ARCHIVE_CHUNK_SIZE = int(os.getenv('ARCHIVE_CHUNK_SIZE', 50000))  # rows exported and deleted per transaction
+
+# Prometheus metrics endpoint served by the scheduler
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))  # 0 disables the endpoint
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PER_CITY = os.getenv('METRICS_PER_CITY', 'true').lower() == 'true'  # city label on stage metrics
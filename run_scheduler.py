@@ -1,4 +1,33 @@
-from app.scheduler import schedule_tasks  
+import argparse
+import multiprocessing
+
+def run_worker(sharded, index=0):
+    import os
+    import config
+    from app.scheduler import schedule_tasks
+    # Each worker serves its metrics on its own port and spools to its own directory
+    schedule_tasks(
+        sharded=sharded,
+        metrics_port=config.METRICS_PORT + index if config.METRICS_PORT else 0,
+        spool_dir=os.path.join(config.SPOOL_DIR, f'worker-{index}') if config.SPOOL_DIR else '',
+    )
 
 if __name__ == "__main__":
-    schedule_tasks()
+    parser = argparse.ArgumentParser(description="Run the weather ingestion scheduler")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Scheduler processes to start; more than one shards the cities between them")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        from app.scheduler import schedule_tasks
+        schedule_tasks()
+    else:
+        workers = [multiprocessing.Process(target=run_worker, args=(True, index)) for index in range(args.workers)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,22 @@
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.models import Base
+
+def make_session_factory():
+    """Return a sessionmaker bound to a fresh in-memory SQLite database"""
+    engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+def make_reading(city, temperature=30.0, timestamp=None, weather_main='Clear'):
+    return {
+        'city': city,
+        'temperature': temperature,
+        'feels_like': temperature,
+        'humidity': 40,
+        'wind_speed': 2.5,
+        'weather_main': weather_main,
+        'timestamp': timestamp or datetime(2024, 10, 22, 12, 0),
+    }
@@ -0,0 +1,137 @@
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CONDITIONS = ('Clear', 'Clouds', 'Rain', 'Haze', 'Mist', 'Thunderstorm')
+
+def make_payload(city, city_id, temperature=30.0, dt=None, weather_main='Clear'):
+    """Build a response in the shape of OpenWeatherMap's current weather API"""
+    return {
+        'id': city_id,
+        'name': city,
+        'dt': int(dt if dt is not None else time.time()),
+        'main': {'temp': temperature, 'feels_like': temperature + 1.5, 'humidity': 40, 'pressure': 1010},
+        'wind': {'speed': 3.2},
+        'weather': [{'main': weather_main}],
+    }
+
+def synthetic_cities(count):
+    return [f"City{index:05d}" for index in range(count)]
+
+class StubWeatherServer:
+    """
+    Local stand-in for the OpenWeatherMap API
+
+    Serves /data/2.5/weather?q=<city> and /data/2.5/group?id=<ids> for the
+    given cities and counts requests per path.
+
+    By default every city reports 30°C, clear skies, observed now. With
+    realistic=True each city gets its own daily temperature curve and
+    changing conditions, so some cities cross alert thresholds. latency and
+    jitter (seconds) delay every response, failure_rate makes that share of
+    requests fail with a 500, and setting now pins the observation time so a
+    load generator can step it between sweeps. fault() queues scripted
+    responses, used in order by the next requests.
+    """
+
+    def __init__(self, cities, latency=0.0, jitter=0.0, failure_rate=0.0, realistic=False, seed=None):
+        self.city_ids = {city: 1000 + index for index, city in enumerate(cities)}
+        self.cities_by_id = {city_id: city for city, city_id in self.city_ids.items()}
+        self.requests = Counter()
+        self.failures = 0
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.realistic = realistic
+        self.now = None
+        self.faults = deque()
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                with stub.lock:
+                    stub.requests[url.path] += 1
+                    delay = stub.latency + stub.random.uniform(0, stub.jitter) if stub.latency or stub.jitter else 0
+                    fail = stub.failure_rate and stub.random.random() < stub.failure_rate
+                    status, retry_after = 500, None
+                    if stub.faults:
+                        status, fault_delay, retry_after = stub.faults.popleft()
+                        delay += fault_delay
+                        fail = status is not None
+                    if fail:
+                        stub.failures += 1
+                if delay:
+                    time.sleep(delay)
+                if fail:
+                    headers = {'Retry-After': str(retry_after)} if retry_after is not None else {}
+                    return self.reply(status, {'cod': str(status), 'message': 'injected failure'}, headers)
+                if url.path == '/data/2.5/weather':
+                    city = params.get('q', [''])[0]
+                    if city not in stub.city_ids:
+                        return self.reply(404, {'cod': '404', 'message': 'city not found'})
+                    return self.reply(200, stub.payload(city))
+                if url.path == '/data/2.5/group':
+                    ids = [int(city_id) for city_id in params.get('id', [''])[0].split(',') if city_id]
+                    items = [stub.payload(stub.cities_by_id[i]) for i in ids if i in stub.cities_by_id]
+                    return self.reply(200, {'cnt': len(items), 'list': items})
+                self.reply(404, {'cod': '404'})
+
+            def reply(self, status, body, headers=None):
+                # A 304 has no body; one would be read as the start of the next response
+                payload = json.dumps(body).encode() if status != 304 else b''
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        # Pooled clients keep connections open; don't wait for them on shutdown
+        self.server.block_on_close = False
+        # Clients that time out close the connection before a delayed reply is written
+        self.server.handle_error = lambda request, client_address: None
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def fault(self, status=500, delay=0.0, count=1, retry_after=None):
+        """Answer the next count requests with status after delay seconds (status None: normal reply)"""
+        with self.lock:
+            self.faults.extend([(status, delay, retry_after)] * count)
+
+    def payload(self, city):
+        city_id = self.city_ids[city]
+        dt = self.now if self.now is not None else time.time()
+        if not self.realistic:
+            return make_payload(city, city_id, dt=dt)
+        # Stable per-city climate (a fifth of the cities run above 35°C) plus a daily cycle
+        seed = zlib.crc32(city.encode())
+        hour = (dt % 86400) / 3600
+        temperature = 18 + seed % 20 + 3 * math.cos((hour - 15) * math.pi / 12) + (seed >> 8) % 5 * 0.3
+        weather_main = CONDITIONS[(seed + int(dt // 3600)) % len(CONDITIONS)]
+        return make_payload(city, city_id, round(temperature, 2), dt, weather_main)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
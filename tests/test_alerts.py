@@ -0,0 +1,80 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import api
+from app.alerts import AlertEngine, AlertRule
+from app.batch_writer import WeatherBatchWriter
+from app.http_client import ResponseCache
+from app.models import WeatherAlert
+from app.poller import AdaptivePoller
+from app.recent_store import RecentStore
+from tests.helpers import make_reading, make_session_factory
+
+class TestAlertEngine(unittest.TestCase):
+    def setUp(self):
+        self.Session = make_session_factory()
+        self.notified = []
+        self.engine = AlertEngine(self.Session, rules=[AlertRule(35, 2), AlertRule(38, 3, {'ops@example.com'})],
+                                  notify=self.notified.append)
+        self.start = datetime(2024, 10, 22, 12, 0)
+
+    def feed(self, city, temperatures):
+        fired = []
+        for minutes, temperature in enumerate(temperatures):
+            reading = make_reading(city, temperature, self.start + timedelta(minutes=10 * minutes))
+            fired.extend(self.engine.observe(reading))
+        return fired
+
+    def test_fires_once_per_streak(self):
+        fired = self.feed('Delhi', [36, 37, 37, 36, 30, 36, 36])
+        self.assertEqual([alert['consecutive_count'] for alert in fired], [2, 2])
+        self.assertEqual(self.feed('Mumbai', [34, 36, 34, 36]), [])
+
+    def test_rules_with_longer_streaks(self):
+        fired = self.feed('Delhi', [39, 39, 39])
+        self.assertEqual([alert['emails'] for alert in fired], [[], ['ops@example.com']])
+
+    def test_new_rules_pick_up_buffered_history(self):
+        self.feed('Delhi', [39, 39])
+        self.engine.set_rules([AlertRule(38, 3)])
+        self.assertEqual(len(self.feed('Delhi', [39])), 1)
+
+    def test_flush_persists_alerts(self):
+        self.feed('Delhi', [36, 37])
+        self.assertEqual(self.engine.flush(), 1)
+        self.assertEqual(self.engine.flush(), 0)
+        self.assertEqual([alert['city'] for alert in self.notified], ['Delhi'])
+        session = self.Session()
+        try:
+            alert = session.query(WeatherAlert).one()
+            self.assertEqual((alert.city, alert.temperature), ('Delhi', 37))
+        finally:
+            session.close()
+
+    def test_failed_reload_keeps_rules_and_firing_state(self):
+        self.assertEqual(len(self.feed('Delhi', [39, 39, 39])), 2)
+        self.engine.session_factory = sessionmaker(bind=create_engine('sqlite:////nonexistent/weather.db'))
+        self.assertFalse(self.engine.refresh_rules())
+        self.assertEqual({rule.key for rule in self.engine.rules}, {(35, 2), (38, 3)})
+        self.assertEqual(self.feed('Delhi', [39]), [])
+
+    def test_restart_keeps_firing_rule_quiet(self):
+        start = datetime.now().replace(microsecond=0) - timedelta(minutes=30)
+        readings = [make_reading('Delhi', 36 + minutes / 10, start + timedelta(minutes=minutes)) for minutes in (0, 10)]
+        self.assertEqual(len([alert for reading in readings for alert in self.engine.observe(reading)]), 1)
+        writer = WeatherBatchWriter(self.Session, max_size=100, max_age=0)
+        writer.add_many(readings)
+        writer.flush()
+
+        # A restarted process rebuilds the two-reading streak from the stored history
+        restarted = AlertEngine(self.Session, rules=[AlertRule(35, 2)])
+        with mock.patch.multiple(api, get_engine=lambda: self.Session.kw['bind'], alert_engine=restarted,
+                                 recent_store=RecentStore(), response_cache=ResponseCache(ttl=0),
+                                 poller=AdaptivePoller()):
+            api.warm_start(['Delhi'])
+        self.assertEqual(restarted.observe(make_reading('Delhi', 38, start + timedelta(minutes=20))), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from app.analytics import (dominant_conditions, heat_index, period_statistics, rolling_anomaly,
+                           rollup_period_statistics, trend_slopes)
+from app.batch_writer import WeatherBatchWriter
+from app.queries import load_history
+from app.rollup_tiers import aggregate_readings
+from tests.helpers import make_reading, make_session_factory
+
+START = datetime(2024, 10, 22, 0, 0)
+
+def frame(readings):
+    df = pd.DataFrame(readings)
+    df['city'] = df['city'].astype('category')
+    return df
+
+class TestAnalytics(unittest.TestCase):
+    def test_period_statistics_and_dominant_condition(self):
+        df = frame([
+            make_reading('Delhi', 30.0, START + timedelta(hours=1), weather_main='Clear'),
+            make_reading('Delhi', 34.0, START + timedelta(hours=2), weather_main='Haze'),
+            make_reading('Delhi', 32.0, START + timedelta(hours=3), weather_main='Haze'),
+            make_reading('Delhi', 20.0, START + timedelta(days=1), weather_main='Rain'),
+            make_reading('Mumbai', 28.0, START + timedelta(hours=5), weather_main='Clouds'),
+        ])
+        stats = period_statistics(df, 'D', percentiles=(0.5,))
+        self.assertEqual(list(zip(stats['city'], stats['period'])),
+                         [('Delhi', START), ('Delhi', START + timedelta(days=1)), ('Mumbai', START)])
+        first = stats.iloc[0]
+        self.assertEqual((first['reading_count'], first['temperature_mean'], first['temperature_min'],
+                          first['temperature_max'], first['temperature_p50']), (3, 32.0, 30.0, 34.0, 32.0))
+        self.assertEqual(dominant_conditions(df, 'D')['weather_main'].tolist(), ['Haze', 'Rain', 'Clouds'])
+
+    def test_anomaly_and_trend_slope(self):
+        readings = [make_reading('Delhi', 30.0 + hour % 2, START + timedelta(hours=hour)) for hour in range(6)]
+        readings.append(make_reading('Delhi', 40.0, START + timedelta(hours=6)))
+        readings += [make_reading('Mumbai', 20.0 + 2 * day, START + timedelta(days=day)) for day in range(3)]
+        df = frame(readings)
+        scores = rolling_anomaly(df, window='24h', min_periods=3)
+        self.assertTrue(np.isnan(scores.iloc[0]))
+        self.assertGreater(scores.iloc[6], 10)
+        slopes = trend_slopes(df)
+        self.assertAlmostEqual(slopes['Mumbai'], 2.0)
+
+    def test_rollup_period_statistics_match_raw_readings(self):
+        # Uneven buckets: a plain mean of bucket means or min of bucket means would differ
+        readings = [make_reading('Delhi', 20.0 + minutes, START + timedelta(minutes=minutes))
+                    for minutes in range(0, 60, 5)]
+        readings += [make_reading('Delhi', 50.0, START + timedelta(hours=5)),
+                     make_reading('Mumbai', 28.0, START + timedelta(hours=1))]
+        Session = make_session_factory()
+        writer = WeatherBatchWriter(Session, max_size=1000, max_age=0)
+        writer.add_many(readings)
+        writer.flush()
+        fields = ('temperature', 'humidity')
+        expected = period_statistics(frame(readings), 'D', fields=fields, percentiles=())
+        for tier in ('15m', '1h'):
+            buckets = load_history(Session.kw['bind'], START - timedelta(days=1), tier=tier)
+            pd.testing.assert_frame_equal(rollup_period_statistics(buckets, 'D', fields=fields), expected,
+                                          check_dtype=False, check_categorical=False)
+
+    def test_heat_index(self):
+        # 32°C at 70% relative humidity feels like about 41°C
+        self.assertAlmostEqual(float(heat_index(32.0, 70.0)), 40.7, delta=0.5)
+        self.assertAlmostEqual(float(heat_index(20.0, 50.0)), 19.6, delta=0.5)
+        self.assertTrue(np.isnan(heat_index([30.0], [np.nan])[0]))
+
+    def test_rollup_buckets_match_per_reading_fold(self):
+        readings = [make_reading('Delhi', 30.0 + minutes, START + timedelta(minutes=minutes * 7))
+                    for minutes in range(10)]
+        readings[2]['humidity'] = None
+        buckets = aggregate_readings(readings, timedelta(minutes=15))
+        self.assertEqual([bucket['reading_count'] for bucket in buckets], [3, 2, 2, 2, 1])
+        self.assertEqual((buckets[0]['temperature_min'], buckets[0]['temperature_max']), (30.0, 32.0))
+        self.assertEqual(buckets[0]['humidity_count'], 2)
+        self.assertIsInstance(buckets[0]['bucket_start'], datetime)
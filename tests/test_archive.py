@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from app.batch_writer import WeatherBatchWriter
+from app.models import DailySummary, WeatherData
+from tests.helpers import make_reading, make_session_factory
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+START = datetime(2022, 1, 1)
+
+@unittest.skipUnless(pyarrow, "pyarrow is not installed")
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        from app import archive
+        self.archive = archive
+        self.Session = make_session_factory()
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir)
+        writer = WeatherBatchWriter(self.Session, max_size=10000, max_age=0)
+        # One reading per city every 12 hours for two years
+        writer.add_many(
+            make_reading(city, temperature + (step % 60) / 10, START + timedelta(hours=12 * step))
+            for step in range(2 * 730)
+            for city, temperature in (('Delhi', 30), ('Mumbai', 25))
+        )
+        writer.flush()
+        session = self.Session()
+        session.add(DailySummary(city='Delhi', date=START, avg_temp=31, max_temp=33, min_temp=29,
+                                 dominant_weather='Clear', reading_count=2))
+        session.commit()
+        session.close()
+
+    def count(self, model):
+        session = self.Session()
+        try:
+            return session.query(model).count()
+        finally:
+            session.close()
+
+    def test_moves_expired_rows_and_queries_them(self):
+        cutoff = datetime(2023, 7, 1)
+        archived = self.archive.archive_expired(cutoff, self.Session, self.archive_dir, chunk_size=500)
+        self.assertEqual(archived, {'weather_data': 2 * 2 * 546, 'daily_summary': 1})
+        self.assertEqual(self.count(WeatherData), 2 * 2 * (730 - 546))
+        self.assertEqual(self.count(DailySummary), 0)
+        # A rerun finds nothing left to move
+        self.assertEqual(self.archive.archive_expired(cutoff, self.Session, self.archive_dir)['weather_data'], 0)
+
+        df = self.archive.read_archive(start=datetime(2022, 3, 1), end=datetime(2022, 3, 2), cities=['Delhi'],
+                                       archive_dir=self.archive_dir)
+        self.assertEqual(df['timestamp'].tolist(), [datetime(2022, 3, 1), datetime(2022, 3, 1, 12)])
+        self.assertEqual(set(df['city']), {'Delhi'})
+
+        monthly = self.archive.aggregate_archive('Y', archive_dir=self.archive_dir)
+        delhi_2022 = monthly[(monthly['city'] == 'Delhi') & (monthly['period'] == datetime(2022, 1, 1))].iloc[0]
+        self.assertEqual(delhi_2022['count'], 730)
+        self.assertEqual(delhi_2022['max'], 35.9)
+        summaries = self.archive.read_archive('daily_summary', archive_dir=self.archive_dir)
+        self.assertEqual(summaries['avg_temp'].tolist(), [31])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+from app import api
+from app.models import LatestWeather, WeatherData, WeatherRollupHourly
+from app.batch_writer import WeatherBatchWriter
+from app.http_client import ResponseCache
+from app.query_cache import read_data_version
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from tests.helpers import make_reading, make_session_factory
+
+class TestWeatherBatchWriter(unittest.TestCase):
+    def setUp(self):
+        self.Session = make_session_factory()
+
+    def count_rows(self):
+        session = self.Session()
+        try:
+            return session.query(WeatherData).count()
+        finally:
+            session.close()
+
+    def test_flushes_when_batch_is_full(self):
+        writer = WeatherBatchWriter(self.Session, max_size=3, max_age=60)
+        writer.add(make_reading('Delhi'))
+        writer.add(make_reading('Mumbai'))
+        self.assertEqual(self.count_rows(), 0)
+        self.assertFalse(writer.due())
+        writer.add(make_reading('Chennai'))
+        self.assertEqual(self.count_rows(), 3)
+        self.assertEqual(writer.flushes, 1)
+
+    def test_bad_row_does_not_discard_batch(self):
+        writer = WeatherBatchWriter(self.Session, max_size=100, max_age=0)
+        writer.add_many([make_reading('Delhi'), make_reading('Mumbai', temperature=None), make_reading('Chennai')])
+        self.assertTrue(writer.due())
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(writer.rows_failed, 1)
+        self.assertEqual(self.count_rows(), 2)
+
+    def test_repeated_observations_are_written_once(self):
+        writer = WeatherBatchWriter(self.Session, max_size=100, max_age=0)
+        later = datetime(2024, 10, 22, 12, 10)
+        writer.add_many([make_reading('Delhi'), make_reading('Delhi'), make_reading('Mumbai')])
+        self.assertEqual(writer.flush(), 2)
+        writer.add_many([make_reading('Delhi'), make_reading('Delhi', timestamp=later)])
+        self.assertEqual(writer.flush(), 1)
+        self.assertEqual((writer.rows_written, writer.rows_duplicate, writer.rows_failed), (3, 2, 0))
+        self.assertEqual(self.count_rows(), 3)
+
+        # Skipped duplicates must not be folded into the rollups either
+        session = self.Session()
+        try:
+            rollup = session.query(WeatherRollupHourly).filter_by(city='Delhi').one()
+            self.assertEqual(rollup.reading_count, 2)
+        finally:
+            session.close()
+
+    def test_dialects_without_on_conflict_fall_back_to_lookups(self):
+        later = datetime(2024, 10, 22, 12, 10)
+        with mock.patch('app.db_utils.ON_CONFLICT_DIALECTS', ()):
+            writer = WeatherBatchWriter(self.Session, max_size=100, max_age=0)
+            writer.add_many([make_reading('Delhi', 30), make_reading('Delhi', 30), make_reading('Mumbai')])
+            self.assertEqual(writer.flush(), 2)
+            writer.add_many([make_reading('Delhi', 30), make_reading('Delhi', 34, timestamp=later)])
+            self.assertEqual(writer.flush(), 1)
+        self.assertEqual((writer.rows_written, writer.rows_duplicate, writer.rows_failed), (3, 2, 0))
+        session = self.Session()
+        try:
+            rollup = session.query(WeatherRollupHourly).filter_by(city='Delhi').one()
+            self.assertEqual((rollup.reading_count, rollup.temperature_sum, rollup.temperature_max), (2, 64, 34))
+            self.assertEqual(session.query(LatestWeather).filter_by(city='Delhi').one().temperature, 34)
+        finally:
+            session.close()
+        self.assertEqual(read_data_version(self.Session.kw['bind']), 2)
+
+    def test_save_weather_data_writes_through_the_batch_writer(self):
+        writer = WeatherBatchWriter(self.Session, max_size=100, max_age=60)
+        with mock.patch.object(api, 'batch_writer', writer):
+            api.save_weather_data(make_reading('Delhi'))
+        self.assertEqual(self.count_rows(), 1)
+        session = self.Session()
+        try:
+            self.assertEqual(session.query(WeatherRollupHourly).filter_by(city='Delhi').one().reading_count, 1)
+            self.assertEqual(session.query(LatestWeather).filter_by(city='Delhi').one().temperature, 30.0)
+        finally:
+            session.close()
+        self.assertEqual(read_data_version(self.Session.kw['bind']), 1)
+
+    def test_dropped_reading_is_fetched_again(self):
+        cache = ResponseCache(ttl=0)
+        broken = sessionmaker(bind=create_engine('sqlite:////nonexistent/weather.db'))
+        reading = make_reading('Delhi')
+        self.assertTrue(cache.is_new_observation('Delhi', reading['timestamp']))
+        # Still buffered: fetching the same observation again is skipped
+        self.assertFalse(cache.is_new_observation('Delhi', reading['timestamp']))
+
+        writer = WeatherBatchWriter(broken, max_size=100, max_age=0, on_drop=cache.forget_observations)
+        writer.add(reading)
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(writer.rows_failed, 1)
+        self.assertTrue(cache.is_new_observation('Delhi', reading['timestamp']))
+
+        writer = WeatherBatchWriter(self.Session, max_size=100, max_age=0, on_drop=cache.forget_observations)
+        writer.add(reading)
+        self.assertEqual(writer.flush(), 1)
+        self.assertFalse(cache.is_new_observation('Delhi', reading['timestamp']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import insert, inspect, text
+from app.compaction import UNIQUE_INDEX, create_unique_index, remove_duplicates
+from app.models import WeatherData
+from tests.helpers import make_reading, make_session_factory
+
+START = datetime(2024, 10, 22, 12, 0)
+
+class TestCompaction(unittest.TestCase):
+    def setUp(self):
+        self.Session = make_session_factory()
+        self.engine = self.Session.kw['bind']
+        # A table from before the unique index, holding repeated observations
+        with self.engine.begin() as connection:
+            connection.execute(text(f'DROP INDEX {UNIQUE_INDEX}'))
+            connection.execute(text(f'CREATE INDEX {UNIQUE_INDEX} ON weather_data (city, timestamp)'))
+            connection.execute(insert(WeatherData.__table__), [
+                make_reading(city, temperature, START + timedelta(days=days))
+                for days in (0, 1, 2)
+                for city, temperature in (('Delhi', 30), ('Delhi', 31), ('Mumbai', 28), ('Delhi', 32))
+            ])
+
+    def test_removes_duplicates_and_enforces_uniqueness(self):
+        result = remove_duplicates(self.Session, window=timedelta(hours=12), chunk_size=2)
+        self.assertEqual(result['deleted'], 6)
+        self.assertEqual(len(result['days']), 3)
+
+        session = self.Session()
+        try:
+            rows = session.query(WeatherData.city, WeatherData.temperature).order_by(WeatherData.id).all()
+        finally:
+            session.close()
+        # The first copy of each observation is kept
+        self.assertEqual(rows, [('Delhi', 30), ('Mumbai', 28)] * 3)
+
+        self.assertEqual(create_unique_index(self.engine), [UNIQUE_INDEX])
+        indexes = {index['name']: index for index in inspect(self.engine).get_indexes('weather_data')}
+        self.assertTrue(indexes[UNIQUE_INDEX]['unique'])
+        self.assertEqual(create_unique_index(self.engine), [])
+
+if __name__ == '__main__':
+    unittest.main()
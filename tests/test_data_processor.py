@@ -0,0 +1,125 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from sqlalchemy import delete, insert
+from app import data_processor
+from app.models import (DailyConditionRollup, DailySummary, RollupWatermark, WeatherData, WeatherRollup15m,
+                        WeatherRollupHourly)
+from app.batch_writer import WeatherBatchWriter
+from tests.helpers import make_reading, make_session_factory
+
+DAY = datetime(2024, 10, 22)
+
+class TestDailySummaryRollup(unittest.TestCase):
+    def setUp(self):
+        self.Session = make_session_factory()
+        patcher = mock.patch.object(data_processor, 'SessionLocal', self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.writer = WeatherBatchWriter(self.Session, max_size=1000, max_age=0)
+
+    def write(self, *readings):
+        self.writer.add_many(readings)
+        self.writer.flush()
+
+    def summaries(self):
+        session = self.Session()
+        try:
+            return {summary.city: summary for summary in session.query(DailySummary).all()}
+        finally:
+            session.close()
+
+    def test_incremental_updates_match_full_rebuild(self):
+        self.write(
+            make_reading('Delhi', 30, DAY.replace(hour=9), 'Clear'),
+            make_reading('Delhi', 36, DAY.replace(hour=10), 'Haze'),
+            make_reading('Mumbai', 28, DAY.replace(hour=9), 'Rain'),
+        )
+        data_processor.update_daily_summaries()
+        self.write(
+            make_reading('Delhi', 39, DAY.replace(hour=11), 'Haze'),
+            make_reading('Delhi', 24, DAY.replace(hour=12), 'Clear'),
+            make_reading('Delhi', 33, DAY.replace(hour=13), 'Haze'),
+        )
+        data_processor.update_daily_summaries()
+
+        delhi = self.summaries()['Delhi']
+        self.assertAlmostEqual(delhi.avg_temp, 32.4)
+        self.assertEqual((delhi.min_temp, delhi.max_temp), (24, 39))
+        self.assertEqual(delhi.dominant_weather, 'Haze')
+        self.assertEqual(delhi.reading_count, 5)
+
+        data_processor.calculate_daily_summary(DAY.date())
+        data_processor.calculate_daily_summary(DAY.date())
+        summaries = self.summaries()
+        self.assertEqual(len(summaries), 2)
+        self.assertAlmostEqual(summaries['Delhi'].avg_temp, 32.4)
+        self.assertEqual(summaries['Delhi'].reading_count, 5)
+        self.assertEqual(summaries['Mumbai'].dominant_weather, 'Rain')
+
+    def test_row_committed_below_watermark_is_folded_once(self):
+        engine = self.Session.kw['bind']
+
+        def commit(id_, temperature, hour):
+            with engine.begin() as connection:
+                connection.execute(insert(WeatherData.__table__), [
+                    dict(make_reading('Delhi', temperature, DAY.replace(hour=hour)), id=id_)
+                ])
+
+        # Writer A took id 1 but commits after writer B's id 2 has been folded
+        commit(2, 30, 10)
+        data_processor.update_daily_summaries()
+        self.assertEqual(self.summaries()['Delhi'].reading_count, 1)
+        data_processor.calculate_daily_summary(DAY.date())
+        commit(1, 36, 9)
+        data_processor.update_daily_summaries()
+        data_processor.update_daily_summaries()
+
+        delhi = self.summaries()['Delhi']
+        self.assertEqual((delhi.reading_count, delhi.max_temp), (2, 36))
+        data_processor.calculate_daily_summary(DAY.date())
+        self.assertEqual(self.summaries()['Delhi'].reading_count, 2)
+
+    def test_first_run_folds_in_chunks_and_caps_gaps(self):
+        engine = self.Session.kw['bind']
+        with engine.begin() as connection:
+            connection.execute(insert(WeatherData.__table__), [
+                dict(make_reading('Delhi', 30 + id_, DAY.replace(hour=id_)), id=id_) for id_ in (1, 3, 5, 7, 8)
+            ])
+        with mock.patch.object(data_processor, 'ROLLUP_MAX_GAPS', 2):
+            data_processor.update_daily_summaries(chunk_size=2)
+        self.assertEqual(self.summaries()['Delhi'].reading_count, 5)
+        session = self.Session()
+        try:
+            watermark = session.get(RollupWatermark, data_processor.DAILY_ROLLUP)
+            self.assertEqual((watermark.last_id, [gap[:2] for gap in json.loads(watermark.gaps)]), (8, [[4, 4], [6, 6]]))
+        finally:
+            session.close()
+
+    def test_rebuild_deletes_summaries_of_days_without_readings(self):
+        self.write(make_reading('Delhi', 30, DAY.replace(hour=9)), make_reading('Mumbai', 28, DAY.replace(hour=9)))
+        data_processor.update_daily_summaries()
+        with self.Session.kw['bind'].begin() as connection:
+            connection.execute(delete(WeatherData.__table__).where(WeatherData.city == 'Mumbai'))
+        data_processor.calculate_daily_summary(DAY.date())
+        self.assertEqual(list(self.summaries()), ['Delhi'])
+
+    def test_cleanup_prunes_rollups_after_their_own_retention(self):
+        now = datetime.now()
+        self.write(*[make_reading('Delhi', 30, now - timedelta(days=days)) for days in (0, 60, 400, 1000)])
+        data_processor.update_daily_summaries()
+        data_processor.cleanup_old_data(days=30, archive_dir='')
+        session = self.Session()
+        try:
+            def days_kept(model, column):
+                return sorted((now - getattr(row, column)).days for row in session.query(model).all())
+            self.assertEqual(days_kept(WeatherData, 'timestamp'), [0])
+            self.assertEqual(days_kept(WeatherRollup15m, 'bucket_start'), [0, 60])
+            self.assertEqual(days_kept(WeatherRollupHourly, 'bucket_start'), [0, 60, 400])
+            self.assertEqual(len(days_kept(DailyConditionRollup, 'date')), 1)
+        finally:
+            session.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import socket
+import time
+import unittest
+from app.email_notifier import AlertNotifier
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+def make_alert(city, temperature=36.0):
+    return {'city': city, 'temperature': temperature, 'message': f"{city} temperature exceeded 35°C for 2 consecutive updates"}
+
+class RecordingHandler:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        if self.failures:
+            self.failures -= 1
+            return '451 Try again later'
+        self.messages.append((envelope.rcpt_tos, envelope.content.decode('utf8', errors='replace')))
+        return '250 OK'
+
+@unittest.skipUnless(Controller, "aiosmtpd is not installed")
+class TestAlertNotifier(unittest.TestCase):
+    def start_server(self, handler):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        controller = Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        self.addCleanup(controller.stop)
+        return controller
+
+    def make_notifier(self, controller, **kwargs):
+        notifier = AlertNotifier(
+            host=controller.hostname, port=controller.port,
+            sender='alerts@example.com', password=None, default_recipients=['ops@example.com'],
+            starttls=False, **kwargs,
+        )
+        self.addCleanup(notifier.stop, 5)
+        return notifier
+
+    def wait_for(self, condition, timeout=5):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_burst_is_sent_as_one_digest_per_recipient(self):
+        handler = RecordingHandler()
+        notifier = self.make_notifier(self.start_server(handler), digest_window=0.2, min_interval=0)
+        started = time.monotonic()
+        for city in ('Delhi', 'Mumbai', 'Chennai'):
+            self.assertTrue(notifier.enqueue(make_alert(city)))
+        notifier.enqueue(make_alert('Kolkata'), recipients=['city@example.com'])
+        # Enqueueing never waits for SMTP
+        self.assertLess(time.monotonic() - started, 0.1)
+
+        self.assertTrue(self.wait_for(lambda: len(handler.messages) == 2))
+        by_recipient = {tuple(rcpt): content for rcpt, content in handler.messages}
+        self.assertIn('3 weather alerts for Chennai, Delhi, Mumbai', by_recipient[('ops@example.com',)])
+        self.assertIn('High Temperature in Kolkata', by_recipient[('city@example.com',)])
+        # Both emails went over the same connection
+        self.assertEqual(len(handler.sessions), 1)
+
+    def test_rate_limit_holds_alerts_for_the_next_digest(self):
+        handler = RecordingHandler()
+        notifier = self.make_notifier(self.start_server(handler), digest_window=0, min_interval=0.5)
+        notifier.enqueue(make_alert('Delhi'))
+        self.assertTrue(self.wait_for(lambda: len(handler.messages) == 1))
+        notifier.enqueue(make_alert('Mumbai'))
+        notifier.enqueue(make_alert('Chennai'))
+        time.sleep(0.2)
+        self.assertEqual(len(handler.messages), 1)
+        self.assertTrue(self.wait_for(lambda: len(handler.messages) == 2))
+        self.assertIn('2 weather alerts', handler.messages[1][1])
+
+    def test_transient_failures_are_retried(self):
+        handler = RecordingHandler(failures=2)
+        notifier = self.make_notifier(self.start_server(handler), digest_window=0, min_interval=0, backoff=0.05)
+        notifier.enqueue(make_alert('Delhi'))
+        self.assertTrue(self.wait_for(lambda: len(handler.messages) == 1))
+        self.assertEqual(notifier.stats()['retried'], 2)
+        self.assertEqual(notifier.stats()['alerts_dropped'], 0)
+
+    def test_unexpected_errors_drop_the_batch_and_keep_the_worker(self):
+        handler = RecordingHandler()
+        notifier = self.make_notifier(self.start_server(handler), digest_window=0, min_interval=0)
+        notifier.enqueue({'city': 'Delhi'})
+        self.assertTrue(self.wait_for(lambda: notifier.stats()['alerts_dropped'] == 1))
+        notifier.enqueue(make_alert('Mumbai'))
+        self.assertTrue(self.wait_for(lambda: len(handler.messages) == 1))
+        self.assertIn('High Temperature in Mumbai', handler.messages[0][1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from app import api
+from tests.stub_server import StubWeatherServer
+
+class TestGroupFetch(unittest.TestCase):
+    def setUp(self):
+        self.cities = [f"City{i}" for i in range(45)]
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmpdir.name, 'city_ids.json')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_city_ids_resolved_once_and_cached_on_disk(self):
+        with StubWeatherServer(self.cities) as stub, mock.patch.object(api, 'BASE_URL', stub.url):
+            city_ids = api.resolve_city_ids(self.cities, path=self.cache_path)
+            self.assertEqual(city_ids, stub.city_ids)
+            self.assertEqual(api.resolve_city_ids(self.cities, path=self.cache_path), city_ids)
+            self.assertEqual(stub.requests['/data/2.5/weather'], len(self.cities))
+        self.assertEqual(api.load_city_ids(self.cache_path), city_ids)
+
+    def test_group_fetch_matches_single_city_shape(self):
+        with StubWeatherServer(self.cities) as stub, mock.patch.object(api, 'BASE_URL', stub.url):
+            readings = {}
+            for chunk in api.chunk_cities(self.cities):
+                readings.update(api.get_weather_data_group(chunk, stub.city_ids))
+            self.assertEqual(stub.requests['/data/2.5/group'], 3)
+            self.assertEqual(set(readings), set(self.cities))
+            self.assertEqual(set(readings['City0']), set(api.get_weather_data('City0')))
+
+if __name__ == '__main__':
+    unittest.main()
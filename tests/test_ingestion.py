@@ -0,0 +1,30 @@
+import time
+import unittest
+from app.ingestion import RateLimiter, run_sweep
+
+class TestRunSweep(unittest.TestCase):
+    def test_sweep_reports_fetched_failed_and_skipped(self):
+        def process_city(city, remaining):
+            if city == 'Bad':
+                raise ValueError("boom")
+            time.sleep(0.2)
+
+        report = run_sweep(['Bad', 'A', 'B', 'C'], process_city, concurrency=2, deadline=0.15)
+        self.assertIn('Bad', report.failed)
+        self.assertEqual(sorted(report.fetched), ['A', 'B'])
+        self.assertEqual(report.skipped, ['C'])
+        self.assertEqual(set(report.latencies), set(report.fetched) | set(report.failed))
+
+    def test_cities_run_concurrently(self):
+        report = run_sweep([str(i) for i in range(8)], lambda city, remaining: time.sleep(0.2),
+                           concurrency=8, deadline=5)
+        self.assertEqual(len(report.fetched), 8)
+        self.assertLess(report.duration, 1.0)
+
+    def test_rate_limiter_gives_up_at_deadline(self):
+        limiter = RateLimiter(rate=1, burst=1)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire(deadline=time.monotonic() + 0.1))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from app.alerts import AlertEngine, AlertRule
+from app.batch_writer import WeatherBatchWriter
+from app.latest_weather import get_latest_readings, rebuild_latest_weather
+from app.models import LatestWeather, WeatherData
+from tests.helpers import make_reading, make_session_factory
+
+START = datetime(2024, 10, 22, 12, 0)
+
+class TestLatestWeather(unittest.TestCase):
+    def setUp(self):
+        self.Session = make_session_factory()
+        self.engine = self.Session.kw['bind']
+        self.writer = WeatherBatchWriter(self.Session, max_size=100, max_age=0)
+
+    def test_writer_keeps_newest_reading_per_city(self):
+        self.writer.add_many([
+            make_reading('Delhi', 30, START),
+            make_reading('Delhi', 32, START + timedelta(minutes=10)),
+            make_reading('Mumbai', 28, START),
+        ])
+        self.writer.flush()
+        # A late, older reading must not replace the newer one
+        self.writer.add(make_reading('Delhi', 25, START - timedelta(minutes=10)))
+        self.writer.flush()
+        rows = get_latest_readings(self.engine, ['Mumbai', 'Delhi', 'Chennai'])
+        self.assertEqual([(row.city, row.temperature) for row in rows], [('Mumbai', 28), ('Delhi', 32)])
+
+    def test_falls_back_to_history_and_rebuilds(self):
+        with self.engine.begin() as connection:
+            connection.execute(insert(WeatherData.__table__), [
+                make_reading('Delhi', temperature, START + timedelta(minutes=minutes))
+                for minutes, temperature in ((0, 30), (20, 33), (10, 31))
+            ])
+        self.assertEqual([row.temperature for row in get_latest_readings(self.engine)], [33])
+
+        session = self.Session()
+        try:
+            self.assertEqual(rebuild_latest_weather(session), 1)
+            session.commit()
+            self.assertEqual(session.get(LatestWeather, 'Delhi').timestamp, START + timedelta(minutes=20))
+        finally:
+            session.close()
+
+    def test_falls_back_for_cities_missing_from_table(self):
+        self.writer.add(make_reading('Mumbai', 28))
+        self.writer.flush()
+        with self.engine.begin() as connection:
+            connection.execute(insert(WeatherData.__table__), [make_reading('Delhi', 31), make_reading('Chennai', 29)])
+        rows = get_latest_readings(self.engine, ['Delhi', 'Mumbai', 'Kolkata'])
+        self.assertEqual([(row.city, row.temperature) for row in rows], [('Delhi', 31), ('Mumbai', 28)])
+        rows = get_latest_readings(self.engine)
+        self.assertEqual([row.city for row in rows], ['Chennai', 'Delhi', 'Mumbai'])
+
+    def test_alert_engine_primes_from_latest_readings(self):
+        self.writer.add_many([make_reading('Delhi', 36), make_reading('Mumbai', 40)])
+        self.writer.flush()
+        alerts = AlertEngine(self.Session, rules=[AlertRule(35, 2)])
+        alerts.prime(get_latest_readings(self.engine))
+        self.assertEqual(len(alerts.observe(make_reading('Delhi', 37, START + timedelta(minutes=10)))), 1)
+
+if __name__ == '__main__':
+    unittest.main()
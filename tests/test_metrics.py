@@ -0,0 +1,59 @@
+import unittest
+import urllib.error
+import urllib.request
+from app import metrics
+from app.batch_writer import WeatherBatchWriter
+from tests.helpers import make_reading, make_session_factory
+
+class TestMetrics(unittest.TestCase):
+    def test_prometheus_text_format(self):
+        registry = metrics.Registry()
+        requests = registry.counter('requests_total', 'Requests served', ('city',))
+        requests.inc(city='Delhi')
+        requests.inc(2, city='Mumbai "West"')
+        latency = registry.histogram('latency_seconds', 'Latency', ('stage',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            latency.observe(value, stage='fetch')
+        registry.gauge('queue_length', 'Queued items').set_function(lambda: 3)
+
+        text = registry.render()
+        self.assertIn('# TYPE requests_total counter\n', text)
+        self.assertIn('requests_total{city="Delhi"} 1.0\n', text)
+        self.assertIn('requests_total{city="Mumbai \\"West\\""} 2.0\n', text)
+        self.assertIn('latency_seconds_bucket{stage="fetch",le="0.1"} 1.0\n', text)
+        self.assertIn('latency_seconds_bucket{stage="fetch",le="1.0"} 2.0\n', text)
+        self.assertIn('latency_seconds_bucket{stage="fetch",le="+Inf"} 3.0\n', text)
+        self.assertIn('latency_seconds_sum{stage="fetch"} 5.55\n', text)
+        self.assertIn('queue_length 3.0\n', text)
+        with self.assertRaises(ValueError):
+            requests.inc(stage='fetch')
+
+    def test_stage_timer_counts_failures(self):
+        before = metrics.STAGE_ERRORS.value(stage='parse', city='Delhi')
+        with self.assertRaises(KeyError):
+            with metrics.stage('parse', 'Delhi'):
+                raise KeyError('main')
+        self.assertEqual(metrics.STAGE_ERRORS.value(stage='parse', city='Delhi'), before + 1)
+
+        writes = metrics.STAGE_SECONDS.count(stage='db_write', city='')
+        written = metrics.READINGS.value(outcome='written')
+        writer = WeatherBatchWriter(make_session_factory(), max_size=100, max_age=0)
+        writer.add_many([make_reading('Delhi'), make_reading('Mumbai')])
+        writer.flush()
+        self.assertEqual(metrics.STAGE_SECONDS.count(stage='db_write', city=''), writes + 1)
+        self.assertEqual(metrics.READINGS.value(outcome='written'), written + 2)
+
+    def test_http_endpoint(self):
+        registry = metrics.Registry()
+        registry.counter('sweeps_total', 'Sweeps').inc()
+        server = metrics.start_http_server(0, '127.0.0.1', registry)
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}'
+            with urllib.request.urlopen(f'{url}/metrics', timeout=5) as response:
+                self.assertEqual(response.headers['Content-Type'], metrics.CONTENT_TYPE)
+                self.assertIn('sweeps_total 1.0', response.read().decode())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f'{url}/other', timeout=5)
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+from sqlalchemy import create_engine, insert, inspect, text
+from sqlalchemy.orm import Session, sessionmaker
+from app.compaction import UNIQUE_INDEX, remove_duplicates
+from app.migrations import MIGRATIONS, applied_versions, migrate
+from app.models import Base, LatestWeather, WeatherData, WeatherRollupHourly
+from tests.helpers import make_reading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine = create_engine(f"sqlite:///{os.path.join(directory.name, 'weather.db')}")
+        self.addCleanup(self.engine.dispose)
+
+    def test_migrate_creates_schema_once(self):
+        self.assertEqual(applied_versions(self.engine), set())
+        self.assertEqual(migrate(self.engine), [version for version, _, _ in MIGRATIONS])
+        self.assertIn(WeatherData.__tablename__, inspect(self.engine).get_table_names())
+        self.assertEqual(migrate(self.engine), [])
+
+    def test_existing_database_is_adopted(self):
+        Base.metadata.create_all(bind=self.engine)
+        self.assertEqual(len(migrate(self.engine)), len(MIGRATIONS))
+        self.assertEqual(applied_versions(self.engine), {version for version, _, _ in MIGRATIONS})
+
+    def test_existing_readings_are_rolled_up(self):
+        Base.metadata.create_all(bind=self.engine)
+        with Session(bind=self.engine) as session:
+            session.add_all(WeatherData(**make_reading('Delhi', 20 + minutes, datetime(2024, 10, 22, 9, minutes)))
+                            for minutes in range(0, 60, 5))
+            session.commit()
+        migrate(self.engine)
+        with Session(bind=self.engine) as session:
+            rollup = session.query(WeatherRollupHourly).filter_by(city='Delhi').one()
+            latest = session.get(LatestWeather, 'Delhi')
+        self.assertEqual((rollup.bucket_start, rollup.reading_count), (datetime(2024, 10, 22, 9), 12))
+        self.assertEqual((latest.timestamp, latest.temperature), (datetime(2024, 10, 22, 9, 55), 75))
+
+    def test_duplicate_readings_block_migration_until_compacted(self):
+        Base.metadata.create_all(bind=self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(text(f'DROP INDEX {UNIQUE_INDEX}'))
+            connection.execute(text(f'CREATE INDEX {UNIQUE_INDEX} ON weather_data (city, timestamp)'))
+            connection.execute(insert(WeatherData.__table__), [make_reading('Delhi')] * 2)
+        with self.assertRaises(RuntimeError):
+            migrate(self.engine)
+        self.assertNotIn(5, applied_versions(self.engine))
+
+        remove_duplicates(sessionmaker(bind=self.engine))
+        self.assertEqual(migrate(self.engine), [5, 6])
+        indexes = {index['name']: index for index in inspect(self.engine).get_indexes('weather_data')}
+        self.assertTrue(indexes[UNIQUE_INDEX]['unique'])
+
+    def test_import_does_not_touch_the_database(self):
+        env = dict(os.environ, DATABASE_URL='sqlite:////nonexistent/weather.db')
+        script = 'import app.scheduler, app.models; assert app.models._engine is None'
+        subprocess.run([sys.executable, '-c', script], cwd=ROOT, env=env, check=True, timeout=60)
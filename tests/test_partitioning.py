@@ -0,0 +1,57 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import config
+from app import data_processor
+from app.batch_writer import WeatherBatchWriter
+from app.models import Base, WeatherData
+from app.partitioning import create_partitioned_table, list_partitions
+from tests.helpers import make_reading
+
+class TestSQLitePartitioning(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(config, 'PARTITION_PERIOD', 'day')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.engine = create_engine('sqlite://', connect_args={'check_same_thread': False}, poolclass=StaticPool)
+        weather_table = WeatherData.__table__
+        create_partitioned_table(self.engine, weather_table)
+        Base.metadata.create_all(bind=self.engine, tables=[
+            table for table in Base.metadata.sorted_tables if table is not weather_table
+        ])
+        self.Session = sessionmaker(bind=self.engine)
+        patcher = mock.patch.object(data_processor, 'SessionLocal', self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        now = datetime.now()
+        writer = WeatherBatchWriter(self.Session, max_size=1000, max_age=0)
+        writer.add_many(make_reading('Delhi', 30, now - timedelta(days=days)) for days in range(5))
+        writer.flush()
+
+    def test_rows_are_routed_to_daily_partitions(self):
+        self.assertEqual(len(list_partitions(self.engine, 'weather_data')), 5)
+        self.assertIn('weather_data', inspect(self.engine).get_view_names())
+        session = self.Session()
+        try:
+            ids = sorted(row.id for row in session.query(WeatherData).all())
+        finally:
+            session.close()
+        self.assertEqual(ids, [1, 2, 3, 4, 5])
+
+    def test_retention_drops_expired_partitions(self):
+        dropped, deleted = data_processor.cleanup_old_data(days=2, chunk_size=1)
+        self.assertEqual(dropped, 2)
+        self.assertEqual(deleted, 1)
+        session = self.Session()
+        try:
+            self.assertEqual(session.query(WeatherData).count(), 2)
+        finally:
+            session.close()
+
+if __name__ == '__main__':
+    unittest.main()
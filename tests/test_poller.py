@@ -0,0 +1,71 @@
+import unittest
+from datetime import datetime, timedelta
+from app.poller import AdaptivePoller
+import config
+
+START = datetime(2024, 10, 22, 12, 0)
+
+class FakeClock:
+    def __init__(self, now: datetime):
+        self.now = now.timestamp()
+
+    def __call__(self) -> float:
+        return self.now
+
+class TestAdaptivePoller(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(START)
+        self.poller = AdaptivePoller(default_interval=600, grace=30, retry_interval=60, max_interval=3600,
+                                     priority_margin=2, priority_factor=0.5, clock=self.clock)
+
+    def test_next_poll_follows_learned_interval(self):
+        self.assertEqual(self.poller.due(['Delhi']), ['Delhi'])
+        self.poller.prime('Delhi', [START - timedelta(seconds=900), START - timedelta(seconds=300)], 25.0)
+        self.assertEqual(self.poller.interval('Delhi'), 600)
+        # Next update expected 300s from now, polled after the grace period
+        self.assertEqual(self.poller.next_poll('Delhi'), START + timedelta(seconds=330))
+        self.assertEqual(self.poller.due(['Delhi']), [])
+        self.clock.now += 330
+        self.assertEqual(self.poller.due(['Delhi']), ['Delhi'])
+
+    def test_stale_and_failed_polls_back_off(self):
+        self.poller.prime('Delhi', [START - timedelta(seconds=600), START], 25.0)
+        self.clock.now += 630
+        delays = []
+        for _ in range(3):
+            self.assertFalse(self.poller.observe('Delhi', START))
+            delays.append(self.poller.next_poll('Delhi').timestamp() - self.clock.now)
+        self.assertEqual(delays, [60, 120, 240])
+        self.assertTrue(self.poller.observe('Delhi', START + timedelta(seconds=600)))
+        for _ in range(7):
+            self.poller.failure('Delhi')
+        self.assertEqual(self.poller.next_poll('Delhi').timestamp() - self.clock.now, 3600)
+        self.assertEqual(self.poller.stats(), {'polls': 0, 'fresh': 1, 'stale': 3, 'failed': 7})
+
+    def test_cities_near_threshold_are_retried_sooner(self):
+        observed = [START - timedelta(seconds=1200), START - timedelta(seconds=600)]
+        self.poller.prime('Delhi', observed, config.TEMP_THRESHOLD - 1)
+        self.poller.prime('Shimla', observed, config.TEMP_THRESHOLD - 20)
+        self.clock.now += 30
+        self.poller.observe('Delhi', observed[-1])
+        self.poller.observe('Shimla', observed[-1])
+        self.assertEqual(self.poller.next_poll('Delhi'), START + timedelta(seconds=60))
+        self.assertEqual(self.poller.next_poll('Shimla'), START + timedelta(seconds=90))
+        self.poller.set_priority('Shimla', 0.25)
+        self.assertEqual(self.poller.next_poll('Shimla'), START + timedelta(seconds=45))
+
+    def test_polls_an_order_of_magnitude_less_than_a_fixed_tick(self):
+        # Stations updating every 10 minutes, swept on a 6 second tick for two hours
+        cities = [f'City {i}' for i in range(20)]
+        offsets = {city: 30 * i for i, city in enumerate(cities)}
+        fixed = adaptive = 0
+        for tick in range(0, 7200, 6):
+            self.clock.now = START.timestamp() + tick
+            fixed += len(cities)
+            for city in self.poller.due(cities):
+                adaptive += 1
+                latest = tick - (tick - offsets[city]) % 600
+                self.poller.observe(city, START + timedelta(seconds=latest), 20.0)
+        self.assertLess(adaptive * 10, fixed)
+        # Each city still picks up every update within the grace period and a tick
+        self.assertLessEqual(self.poller.stats()['stale'], 2 * len(cities))
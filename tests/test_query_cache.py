@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+from unittest import mock
+from app.batch_writer import WeatherBatchWriter
+from app import query_cache
+from app.query_cache import QueryCache, read_data_version, use_worker_data_version
+from app.latest_weather import get_latest_readings
+from tests.helpers import make_reading, make_session_factory
+
+class TestQueryCache(unittest.TestCase):
+    def setUp(self):
+        self.Session = make_session_factory()
+        self.engine = self.Session.kw['bind']
+        self.writer = WeatherBatchWriter(self.Session, max_size=100, max_age=0)
+        self.cache = QueryCache(lambda: read_data_version(self.engine), ttl=60, max_entries=2,
+                                version_check_interval=0)
+        self.loads = 0
+
+    def load_latest(self):
+        self.loads += 1
+        return get_latest_readings(self.engine, ['Delhi'])
+
+    def test_results_are_reused_until_new_data_is_written(self):
+        self.writer.add(make_reading('Delhi', 30))
+        self.writer.flush()
+        first = self.cache.get_or_load(('latest', 'Delhi'), self.load_latest)
+        self.assertIs(self.cache.get_or_load(('latest', 'Delhi'), self.load_latest), first)
+        self.assertEqual(self.loads, 1)
+
+        self.writer.add(make_reading('Delhi', 31, first[0].timestamp.replace(hour=13)))
+        self.writer.flush()
+        latest = self.cache.get_or_load(('latest', 'Delhi'), self.load_latest)
+        self.assertEqual(self.loads, 2)
+        self.assertEqual(latest[0].temperature, 31)
+
+    def test_each_worker_bumps_its_own_version(self):
+        patcher = mock.patch.object(query_cache, '_worker_version', query_cache.DATA_VERSION)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.writer.add(make_reading('Delhi', 30))
+        self.writer.flush()
+        for worker, city in (('a', 'Mumbai'), ('b', 'Chennai')):
+            use_worker_data_version(worker)
+            self.writer.add(make_reading(city))
+            self.writer.flush()
+        with self.engine.connect() as connection:
+            names = connection.exec_driver_sql('SELECT name FROM data_versions ORDER BY name').scalars().all()
+        self.assertEqual(names, ['weather_data', 'weather_data:a', 'weather_data:b'])
+        self.assertEqual(read_data_version(self.engine), 3)
+
+    def test_entries_expire_and_are_evicted(self):
+        cache = QueryCache(lambda: 0, ttl=0.05, max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.get_or_load(key, lambda: key)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_or_load('a', lambda: 'reloaded'), 'reloaded')
+        time.sleep(0.06)
+        self.assertEqual(cache.get_or_load('c', lambda: 'expired'), 'expired')
+
+    def test_concurrent_misses_load_once(self):
+        cache = QueryCache(lambda: 0)
+        calls = []
+
+        def loader():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        threads = [threading.Thread(target=cache.get_or_load, args=('key', loader)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.hits, 4)
+
+if __name__ == '__main__':
+    unittest.main()
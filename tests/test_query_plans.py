@@ -0,0 +1,24 @@
+import unittest
+from datetime import datetime
+from sqlalchemy import text
+from benchmarks.bench_query_plans import check_plans, populate
+from tests.helpers import make_session_factory
+
+NOW = datetime(2024, 10, 22, 12, 0)
+
+class TestQueryPlans(unittest.TestCase):
+    def setUp(self):
+        self.engine = make_session_factory().kw['bind']
+        populate(self.engine, rows=3000, cities=3, end=NOW)
+
+    def test_hot_queries_use_their_indexes(self):
+        self.assertEqual(check_plans(self.engine, NOW), [])
+
+    def test_missing_index_is_reported(self):
+        with self.engine.begin() as connection:
+            connection.execute(text('DROP INDEX ix_weather_data_city_timestamp'))
+        failed = {name for name, _ in check_plans(self.engine, NOW)}
+        self.assertIn('latest reading for a city', failed)
+
+if __name__ == '__main__':
+    unittest.main()
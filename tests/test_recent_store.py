@@ -0,0 +1,71 @@
+import unittest
+from datetime import datetime, timedelta
+from app.batch_writer import WeatherBatchWriter
+from app.recent_store import RecentStore
+from tests.helpers import make_reading, make_session_factory
+import config
+
+START = datetime(2024, 10, 22, 12, 0)
+
+class TestRecentStore(unittest.TestCase):
+    def setUp(self):
+        self.store = RecentStore(capacity=4)
+
+    def feed(self, city, temperatures):
+        for minutes, temperature in enumerate(temperatures):
+            self.store.add(make_reading(city, temperature, START + timedelta(minutes=10 * minutes)))
+
+    def test_ring_buffer_keeps_newest_readings(self):
+        self.feed('Delhi', [30, 31, 32, 33, 34, 35])
+        self.assertEqual([reading.temperature for reading in self.store.last('Delhi', 10)], [32, 33, 34, 35])
+        latest = self.store.latest(['Mumbai', 'Delhi'])
+        self.assertEqual([(reading.city, reading.timestamp) for reading in latest],
+                         [('Delhi', START + timedelta(minutes=50))])
+        # Repeated or older observations are ignored
+        self.assertFalse(self.store.add(make_reading('Delhi', 20, START + timedelta(minutes=50))))
+        self.assertEqual(self.store.memory_bytes(), 4 * (8 + 4 * 4 + 2))
+
+    def test_window_aggregates(self):
+        self.feed('Delhi', [30, 32, 34, 36])
+        stats = self.store.aggregate('Delhi', START + timedelta(minutes=10), START + timedelta(minutes=30))
+        self.assertEqual(stats, {'count': 2, 'mean': 33.0, 'min': 32.0, 'max': 34.0})
+        self.assertEqual(self.store.aggregate('Chennai', START)['count'], 0)
+        df = self.store.frame(START + timedelta(minutes=20))
+        self.assertEqual(df['temperature'].tolist(), [34, 36])
+
+    def test_fed_by_writer_and_cold_started_from_database(self):
+        Session = make_session_factory()
+        writer = WeatherBatchWriter(Session, max_size=100, max_age=0, on_write=self.store.add_many)
+        now = datetime.now().replace(microsecond=0)
+        writer.add_many([make_reading(city, 30, now - timedelta(minutes=10 * offset))
+                         for offset in (3, 2, 1, 0) for city in ('Delhi', 'Mumbai')])
+        writer.flush()
+        self.assertEqual(len(self.store.last('Mumbai', 10)), 4)
+
+        restarted = RecentStore(capacity=6)
+        self.assertEqual(restarted.load(Session.kw['bind'], ['Delhi'], now=now), 4)
+        self.assertEqual([reading.timestamp for reading in restarted.last('Delhi', 4)],
+                         [reading.timestamp for reading in self.store.last('Delhi', 4)])
+        self.assertEqual(restarted.cities(), ['Delhi'])
+        loaded_from = now - timedelta(seconds=6 * config.RAW_SAMPLE_INTERVAL)
+        self.assertTrue(restarted.covers(loaded_from, ['Delhi']))
+        self.assertFalse(restarted.covers(loaded_from, ['Delhi', 'Mumbai']))
+        self.assertFalse(restarted.covers(loaded_from))
+
+    def test_covers_only_windows_the_buffers_still_hold(self):
+        now = datetime.now().replace(microsecond=0)
+        self.assertFalse(self.store.covers(now - timedelta(hours=1)))
+        self.store.load(make_session_factory().kw['bind'], now=now)
+        loaded_from = now - timedelta(seconds=4 * config.RAW_SAMPLE_INTERVAL)
+        self.assertTrue(self.store.covers(loaded_from))
+        self.assertFalse(self.store.covers(loaded_from - timedelta(minutes=1)))
+
+        # Readings every minute wrap Delhi's buffer within a few minutes
+        for minutes in range(6):
+            self.store.add(make_reading('Delhi', 30, now + timedelta(minutes=minutes)))
+        self.assertFalse(self.store.covers(loaded_from, ['Delhi']))
+        self.assertTrue(self.store.covers(loaded_from, ['Mumbai']))
+        self.assertTrue(self.store.covers(now + timedelta(minutes=2), ['Delhi']))
+
+if __name__ == '__main__':
+    unittest.main()
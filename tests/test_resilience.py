@@ -0,0 +1,105 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from requests.exceptions import HTTPError, Timeout
+from app import api, metrics, resilience
+from app.http_client import ResponseCache
+from tests.stub_server import StubWeatherServer
+
+FAST = {'RETRY_ATTEMPTS': 3, 'RETRY_BASE_DELAY': 0.01, 'RETRY_MAX_DELAY': 0.05, 'READ_TIMEOUT': 2,
+        'HEDGE_PERCENTILE': 0}
+
+class TestResilience(unittest.TestCase):
+    def setUp(self):
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+        patcher = mock.patch.multiple('config', **FAST)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stub = StubWeatherServer(['Delhi']).__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        for name, value in (('BASE_URL', self.stub.url), ('response_cache', ResponseCache(ttl=0))):
+            patcher = mock.patch.object(api, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.endpoint = resilience.endpoint_for(f"{self.stub.url}/data/2.5/weather")
+
+    def test_transient_errors_are_retried(self):
+        self.stub.fault(503)
+        self.stub.fault(429, retry_after=0)
+        self.assertEqual(api.get_weather_data('Delhi')['city'], 'Delhi')
+        self.assertEqual(self.stub.requests['/data/2.5/weather'], 3)
+        self.assertEqual(resilience.stats()[self.endpoint]['retries'], 2)
+        self.assertEqual(metrics.UPSTREAM_RETRIES.value(endpoint=self.endpoint, reason='429'), 1)
+
+        # Client errors are not retried
+        with self.assertRaises(HTTPError):
+            api.get_weather_data('Atlantis')
+        self.assertEqual(self.stub.requests['/data/2.5/weather'], 4)
+
+    def test_not_modified_without_cached_payload_is_fetched_again(self):
+        self.stub.fault(304)
+        with mock.patch.object(metrics, 'stage', wraps=metrics.stage) as stage:
+            self.assertEqual(api.get_weather_data('Delhi')['city'], 'Delhi')
+        self.assertEqual(self.stub.requests['/data/2.5/weather'], 2)
+        self.assertEqual([call.args[0] for call in stage.call_args_list], ['fetch', 'parse'])
+
+    def test_retries_stop_at_the_deadline(self):
+        self.stub.fault(None, delay=0.5, count=3)
+        started = time.monotonic()
+        with self.assertRaises(Timeout):
+            api.get_weather_data('Delhi', timeout=0.3)
+        self.assertLess(time.monotonic() - started, 0.45)
+        self.assertEqual(self.stub.requests['/data/2.5/weather'], 1)
+
+    def test_long_retry_after_fails_at_once(self):
+        self.stub.fault(429, retry_after=3600)
+        started = time.monotonic()
+        with self.assertRaises(HTTPError):
+            api.get_weather_data('Delhi')
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.stub.requests['/data/2.5/weather'], 1)
+
+    def test_city_id_lookups_share_the_timeout(self):
+        self.stub.fault(None, delay=0.5, count=3)
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.monotonic()
+            city_ids = api.resolve_city_ids(['Delhi', 'Atlantis'], path=os.path.join(directory, 'ids.json'),
+                                            timeout=0.3)
+        self.assertEqual(city_ids, {})
+        self.assertLess(time.monotonic() - started, 0.45)
+        self.assertEqual(self.stub.requests['/data/2.5/weather'], 1)
+
+    def test_breaker_opens_and_recovers(self):
+        breaker = resilience.breaker_for(self.endpoint)
+        breaker.failure_threshold = 3
+        self.stub.fault(500, count=3)
+        with self.assertRaises(HTTPError):
+            api.get_weather_data('Delhi')
+        self.assertEqual(resilience.stats()[self.endpoint]['state'], resilience.OPEN)
+        self.assertEqual(metrics.BREAKER_STATE.value(endpoint=self.endpoint), 2)
+
+        with self.assertRaises(resilience.CircuitOpenError):
+            api.get_weather_data('Delhi')
+        self.assertEqual(self.stub.requests['/data/2.5/weather'], 3)
+
+        breaker.opened_at -= breaker.reset_timeout
+        self.assertEqual(api.get_weather_data('Delhi')['city'], 'Delhi')
+        self.assertEqual(breaker.state, resilience.CLOSED)
+
+    def test_slow_requests_are_hedged(self):
+        latency = resilience.latency_for(self.endpoint)
+        for _ in range(20):
+            latency.observe(0.01)
+        self.stub.fault(None, delay=1.0)
+        started = time.monotonic()
+        with mock.patch('config.HEDGE_PERCENTILE', 95):
+            self.assertEqual(api.get_weather_data('Delhi')['city'], 'Delhi')
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(self.stub.requests['/data/2.5/weather'], 2)
+        self.assertEqual(metrics.UPSTREAM_HEDGES.value(endpoint=self.endpoint, outcome='won'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
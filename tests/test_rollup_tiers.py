@@ -0,0 +1,61 @@
+import unittest
+from datetime import datetime, timedelta
+from app.batch_writer import WeatherBatchWriter
+from app.rollup_tiers import RAW, choose_tier, rebuild_rollup_tiers
+from app.queries import load_history
+from tests.helpers import make_reading, make_session_factory
+
+START = datetime(2024, 10, 22, 9, 0)
+
+class TestRollupTiers(unittest.TestCase):
+    def setUp(self):
+        self.Session = make_session_factory()
+        writer = WeatherBatchWriter(self.Session, max_size=1000, max_age=0)
+        # Two batches so buckets are merged across flushes
+        for offset in (0, 5):
+            writer.add_many(
+                make_reading('Delhi', 20 + minutes, START + timedelta(minutes=minutes))
+                for minutes in range(offset, 60, 10)
+            )
+            writer.flush()
+
+    def load(self, tier):
+        engine = self.Session.kw['bind']
+        return load_history(engine, START - timedelta(days=1), tier=tier).to_dict('records')
+
+    def test_buckets_are_updated_incrementally(self):
+        quarter_hours = self.load('15m')
+        self.assertEqual([row['timestamp'].minute for row in quarter_hours], [0, 15, 30, 45])
+        self.assertEqual((quarter_hours[0]['temperature_min'], quarter_hours[0]['temperature_max']), (20, 30))
+        hourly = self.load('1h')
+        self.assertEqual(len(hourly), 1)
+        self.assertAlmostEqual(hourly[0]['temperature'], 47.5)
+
+    def test_rebuild_matches_incremental(self):
+        incremental = self.load('1h') + self.load('15m')
+        session = self.Session()
+        try:
+            self.assertEqual(rebuild_rollup_tiers(session, START, START + timedelta(hours=1)), 12)
+            session.commit()
+        finally:
+            session.close()
+        self.assertEqual(self.load('1h') + self.load('15m'), incremental)
+
+    def test_rebuild_leaves_partial_last_bucket(self):
+        before = self.load('1h') + self.load('15m')
+        session = self.Session()
+        try:
+            # Ends mid-hour: the hour's bucket must not be rebuilt from half its readings
+            self.assertEqual(rebuild_rollup_tiers(session, START, START + timedelta(minutes=30)), 0)
+            session.commit()
+        finally:
+            session.close()
+        self.assertEqual(self.load('1h') + self.load('15m'), before)
+
+    def test_choose_tier_bounds_points_per_series(self):
+        self.assertEqual(choose_tier(timedelta(days=1), max_points=2000), RAW)
+        self.assertEqual(choose_tier(timedelta(days=14), max_points=2000), '15m')
+        self.assertEqual(choose_tier(timedelta(days=30), max_points=2000), '1h')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+from app import scheduler as scheduler_module
+from app.alerts import AlertEngine, AlertRule
+from app.batch_writer import WeatherBatchWriter
+from app.models import WeatherAlert, WeatherData
+from app.scheduler import Job, JobScheduler
+from tests.helpers import make_reading, make_session_factory
+
+class TestJob(unittest.TestCase):
+    def test_interval_ticks_align_to_wall_clock(self):
+        job = Job(lambda: None, interval=300)
+        moment = datetime(2024, 10, 22, 12, 7, 31).timestamp()
+        self.assertEqual(datetime.fromtimestamp(job.next_after(moment)), datetime(2024, 10, 22, 12, 10))
+        self.assertEqual(job.next_after(job.next_after(moment)), datetime(2024, 10, 22, 12, 15).timestamp())
+
+    def test_daily_ticks(self):
+        job = Job(lambda: None, at='23:59')
+        self.assertEqual(datetime.fromtimestamp(job.next_after(datetime(2024, 10, 22, 23, 59).timestamp())),
+                         datetime(2024, 10, 23, 23, 59))
+
+class TestJobScheduler(unittest.TestCase):
+    def run_scheduler(self, scheduler, seconds):
+        thread = threading.Thread(target=scheduler.run_forever)
+        thread.start()
+        time.sleep(seconds)
+        scheduler.stop()
+        thread.join()
+
+    def test_overrunning_job_is_skipped_without_blocking_others(self):
+        scheduler = JobScheduler(workers=1)
+        active, overlaps = [], []
+
+        def slow():
+            overlaps.append(bool(active))
+            active.append(1)
+            time.sleep(0.25)
+            active.pop()
+
+        scheduler.every(0.05, slow, name='slow')
+        fast = scheduler.every(0.05, lambda: None, name='fast')
+        self.run_scheduler(scheduler, 0.6)
+
+        stats = scheduler.stats()
+        self.assertNotIn(True, overlaps)
+        self.assertGreater(stats['slow']['skipped'], 0)
+        self.assertGreaterEqual(stats['fast']['runs'], 8)
+        self.assertLess(fast.max_lag, 0.05)
+
+    def test_coalesced_ticks_run_once_after_overrun(self):
+        scheduler = JobScheduler()
+        runs = []
+        scheduler.every(0.05, lambda: (runs.append(1), time.sleep(0.2)), name='rollup', coalesce=True)
+        self.run_scheduler(scheduler, 0.5)
+        stats = scheduler.stats()['rollup']
+        self.assertEqual(stats['skipped'], 0)
+        self.assertGreaterEqual(stats['runs'], 2)
+        self.assertEqual(stats['failures'], 0)
+
+    def test_failures_are_counted(self):
+        scheduler = JobScheduler()
+        scheduler.every(0.05, lambda: 1 / 0, name='broken')
+        self.run_scheduler(scheduler, 0.2)
+        stats = scheduler.stats()['broken']
+        self.assertEqual(stats['failures'], stats['runs'])
+        self.assertGreater(stats['runs'], 0)
+
+class TestShutdown(unittest.TestCase):
+    def test_buffered_readings_and_pending_alerts_are_written(self):
+        Session = make_session_factory()
+        writer = WeatherBatchWriter(Session, max_size=100, max_age=3600)
+        notifier = mock.Mock()
+        engine = AlertEngine(Session, rules=[AlertRule(35, 2)], notify=notifier.enqueue)
+        for minutes in (0, 10):
+            reading = make_reading('Delhi', 40, datetime(2024, 10, 22, 12, minutes))
+            writer.add(reading)
+            engine.observe(reading)
+
+        with mock.patch.multiple(scheduler_module, batch_writer=writer, alert_engine=engine,
+                                 notifier=notifier, stop_spool=mock.DEFAULT):
+            scheduler_module.shutdown()
+
+        session = Session()
+        try:
+            self.assertEqual(session.query(WeatherData).count(), 2)
+            self.assertEqual(session.query(WeatherAlert).count(), 1)
+        finally:
+            session.close()
+        self.assertEqual(notifier.enqueue.call_count, 1)
+        # Alerts are queued before the notifier sends its last digests
+        self.assertEqual([call[0] for call in notifier.mock_calls], ['enqueue', 'stop'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from sqlalchemy import func, select
+from app.models import WorkerLease
+from app.sharding import HashRing, ShardCoordinator
+from tests.helpers import make_session_factory
+from tests.stub_server import synthetic_cities
+
+CITIES = synthetic_cities(300)
+
+class FakeClock:
+    def __init__(self):
+        self.now = datetime(2024, 10, 22, 12, 0)
+
+    def __call__(self):
+        return self.now
+
+class TestHashRing(unittest.TestCase):
+    def test_adding_a_node_only_moves_its_share(self):
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b', 'c', 'd'])
+        moved = [city for city in CITIES if before.owner(city) != after.owner(city)]
+        self.assertTrue(all(after.owner(city) == 'd' for city in moved))
+        self.assertLess(len(moved), len(CITIES) * 0.4)
+        shares = [sum(after.owner(city) == node for city in CITIES) for node in after.nodes]
+        self.assertGreater(min(shares), len(CITIES) / 4 * 0.5)
+
+class TestShardCoordinator(unittest.TestCase):
+    def setUp(self):
+        self.Session = make_session_factory()
+        self.clock = FakeClock()
+
+    def worker(self, worker_id):
+        return ShardCoordinator(CITIES, worker_id, self.Session, lease_ttl=30, clock=self.clock)
+
+    def tick(self, *workers):
+        self.clock.now += timedelta(seconds=10)
+        return [set(worker.heartbeat()) for worker in workers]
+
+    def assert_disjoint(self, owned):
+        for index, cities in enumerate(owned):
+            for other in owned[index + 1:]:
+                self.assertFalse(cities & other)
+
+    def test_workers_split_cities_without_overlap(self):
+        a, b = self.worker('a'), self.worker('b')
+        self.tick(a)
+        self.assertEqual(self.tick(a)[0], set(CITIES))
+
+        # b joins: a gives up b's share before b starts fetching it
+        for _ in range(3):
+            owned = self.tick(b, a)
+            self.assert_disjoint(owned)
+        self.assertEqual(owned[0] | owned[1], set(CITIES))
+        self.assertTrue(a.is_leader())
+        self.assertFalse(b.is_leader())
+
+    def test_dead_worker_is_replaced_after_lease_expires(self):
+        a, b = self.worker('a'), self.worker('b')
+        taken_over = []
+        b.on_assign = taken_over.extend
+        for _ in range(3):
+            self.tick(a, b)
+        a_cities = set(a.assigned())
+
+        # a stops heartbeating; its cities move to b once the lease has expired
+        for _ in range(5):
+            self.tick(b)
+        self.assertEqual(set(b.assigned()), set(CITIES))
+        self.assertTrue(a_cities <= set(taken_over))
+        self.assertTrue(b.is_leader())
+
+    def test_release_hands_over_immediately(self):
+        a, b = self.worker('a'), self.worker('b')
+        for _ in range(3):
+            self.tick(a, b)
+        a.release()
+        self.tick(b)
+        self.assertEqual(set(self.tick(b)[0]), set(CITIES))
+        self.assertEqual(a.assigned(), [])
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), 'needs time.tzset')
+    def test_leases_use_the_database_clock(self):
+        session = self.Session()
+        try:
+            now = session.scalar(select(func.now()))
+            for worker_id, age in (('b', 20), ('c', 40)):
+                session.add(WorkerLease(worker_id=worker_id, hostname=worker_id, started_at=now,
+                                        heartbeat=now - timedelta(seconds=age)))
+            session.commit()
+        finally:
+            session.close()
+
+        # A local clock hours off the database's must not expire live leases
+        with mock.patch.dict(os.environ, {'TZ': 'Etc/GMT-5'}):
+            time.tzset()
+            self.addCleanup(time.tzset)
+            a = ShardCoordinator(CITIES, 'a', self.Session, lease_ttl=30)
+            a.heartbeat()
+        self.assertEqual(a.members, ['a', 'b'])
+
+if __name__ == '__main__':
+    unittest.main()
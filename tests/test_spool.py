@@ -0,0 +1,124 @@
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app.batch_writer import WEATHER_COLUMNS, WeatherBatchWriter
+from app.models import WeatherData
+from app.spool import Spool, SpoolDrainer
+from tests.helpers import make_reading, make_session_factory
+
+def make_rows(count, start=datetime(2024, 10, 22, 12, 0)):
+    readings = [make_reading('Delhi', temperature=20.0 + i, timestamp=start + timedelta(minutes=10 * i))
+                for i in range(count)]
+    return [{name: reading.get(name) for name in WEATHER_COLUMNS} for reading in readings]
+
+class TestSpool(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_records_survive_reopening_in_order(self):
+        spool = Spool(self.directory, segment_bytes=500, fsync_interval=0)
+        rows = make_rows(10)
+        spool.append(rows[:6])
+        spool.append(rows[6:])
+        self.assertGreater(spool.stats()['segments'], 1)
+        records, position = spool.read(4)
+        self.assertEqual(records, rows[:4])
+        spool.commit(position, len(records))
+        spool.close()
+
+        # A crash mid-append leaves a torn line, which is dropped on reopening
+        last = sorted(name for name in os.listdir(self.directory) if name.startswith('segment-'))[-1]
+        with open(os.path.join(self.directory, last), 'ab') as f:
+            f.write(b'{"city":"Del')
+        spool = Spool(self.directory, segment_bytes=500, fsync_interval=0)
+        records, position = spool.read(100)
+        self.assertEqual(records, rows[4:])
+        spool.commit(position, len(records))
+        self.assertEqual(spool.backlog_bytes(), 0)
+        self.assertEqual(spool.stats()['segments'], 1)
+        spool.close()
+
+    def test_drainer_replays_after_outage_without_duplicates(self):
+        Session = make_session_factory()
+        writer = WeatherBatchWriter(Session, max_size=100, max_age=0)
+        down = [True]
+
+        def write(rows, raise_unavailable=False):
+            if down[0]:
+                raise OperationalError('INSERT', {}, Exception('connection refused'))
+            return writer.write(rows, raise_unavailable=raise_unavailable)
+
+        spool = Spool(self.directory, fsync_interval=0)
+        drainer = SpoolDrainer(spool, write, batch_size=3)
+        rows = make_rows(7)
+        spool.append(rows)
+        with self.assertRaises(OperationalError):
+            drainer.drain()
+        self.assertEqual(spool.read(100)[0], rows)
+
+        down[0] = False
+        self.assertEqual(drainer.drain(), 7)
+        self.assertEqual(spool.backlog_bytes(), 0)
+
+        # Readings replayed after a crash before the checkpoint are skipped by the insert
+        spool.append(rows[5:] + make_rows(2, start=datetime(2024, 10, 23)))
+        self.assertEqual(drainer.drain(), 4)
+        session = Session()
+        try:
+            stored = session.query(WeatherData).order_by(WeatherData.timestamp).all()
+        finally:
+            session.close()
+        self.assertEqual(len(stored), 9)
+        self.assertEqual([row.temperature for row in stored[:7]], [row['temperature'] for row in rows])
+        self.assertEqual(writer.rows_duplicate, 2)
+        drainer.stop()
+
+    def test_outage_during_row_by_row_retry_keeps_readings_spooled(self):
+        Session = make_session_factory()
+        writer = WeatherBatchWriter(Session, max_size=100, max_age=0)
+        spool = Spool(self.directory, fsync_interval=0)
+        drainer = SpoolDrainer(spool, writer.write, batch_size=10)
+        rows = make_rows(3)
+        spool.append(rows)
+        # A bad row fails the bulk insert, then the database goes away mid-retry
+        failures = [IntegrityError('INSERT', {}, Exception('constraint failed')),
+                    OperationalError('INSERT', {}, Exception('connection refused'))]
+        with mock.patch('app.batch_writer.insert_readings', side_effect=failures):
+            with self.assertRaises(OperationalError):
+                drainer.drain()
+        self.assertEqual(writer.rows_failed, 0)
+        self.assertEqual(spool.read(100)[0], rows)
+        self.assertEqual(drainer.drain(), 3)
+        spool.close()
+
+    def test_stop_leaves_readings_spooled_while_a_write_hangs(self):
+        entered, release = threading.Event(), threading.Event()
+        calls = []
+
+        def write(rows, raise_unavailable=False):
+            calls.append(len(rows))
+            entered.set()
+            release.wait(5)
+            return len(rows)
+
+        spool = Spool(self.directory, fsync_interval=0)
+        drainer = SpoolDrainer(spool, write, batch_size=10, interval=60)
+        spool.append(make_rows(3))
+        drainer.start()
+        self.assertTrue(entered.wait(5))
+        drainer.stop(timeout=0.1)
+        # No second, concurrent drain of the same readings; the spool stays open for the thread
+        self.assertEqual(calls, [3])
+        release.set()
+        drainer._thread.join(5)
+        self.assertEqual(spool.backlog_bytes(), 0)
+        spool.close()
+
+if __name__ == '__main__':
+    unittest.main()